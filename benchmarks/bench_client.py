@@ -0,0 +1,100 @@
+# end to end cost of Client.send_command, set_screen and update against
+# the crawl stand-in (dcss/fakecrawl.py), over a local terminal and over
+# ssh to a FakeCrawlServer on this machine
+# the stand-in answers after --delay (+- --jitter) seconds, so what's on
+# top of it is the client's own overhead: waiting out the end of each
+# response, reading it and parsing the screens
+# usage: python benchmarks/bench_client.py [iterations] [--delay S]
+#            [--jitter S] [--chunk-size N] [--more-chance P]
+#            [--only local|remote]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.client import Client
+from dcss.fakecrawl import FakeCrawlServer
+from dcss.screens import Screens
+
+# the stand-in runs as python -m dcss.fakecrawl, from this checkout
+os.environ['PYTHONPATH'] = os.pathsep.join(
+    [os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))]
+    + [p for p in [os.environ.get('PYTHONPATH')] if p])
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def timed(samples, call, *args):
+    start = time.perf_counter()
+    call(*args)
+    samples.append(time.perf_counter() - start)
+
+
+def measure(client, iterations):
+    results = {'send_command': [], 'set_screen': [], 'update': []}
+    for i in range(iterations):
+        timed(results['send_command'], client.send_command, 'hjkl'[i % 4])
+    for i in range(iterations):
+        timed(results['set_screen'], client.set_screen, Screens.INVENTORY)
+        timed(results['set_screen'], client.set_screen, Screens.MAIN)
+    for _ in range(iterations):
+        # everything is read again, not only what went out of date
+        client.invalidate()
+        timed(results['update'], client.update)
+    return results
+
+
+def report(transport, results, delay):
+    for name, samples in results.items():
+        print("{:<7} {:<13} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            transport, name, len(samples),
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.9) * 1000,
+            percentile(samples, 0.99) * 1000,
+            (sum(samples) / len(samples) - delay) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iterations', type=int, nargs='?', default=50)
+    parser.add_argument('--delay', type=float, default=0.01)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int)
+    parser.add_argument('--more-chance', type=float, default=0.0)
+    parser.add_argument('--quiescence-ms', type=int, default=20,
+                        help="LocalConnection's quiet time")
+    parser.add_argument('--only', choices=['local', 'remote'])
+    args = parser.parse_args()
+
+    options = ['--delay', str(args.delay), '--jitter', str(args.jitter),
+               '--more-chance', str(args.more_chance)]
+    if args.chunk_size:
+        options += ['--chunk-size', str(args.chunk_size)]
+
+    # the last column is the mean time per call beyond one --delay
+    print("{:<7} {:<13} {:>6} {:>9} {:>9} {:>9} {:>9}".format(
+        'conn', 'call', 'calls', 'p50 ms', 'p90 ms', 'p99 ms', 'over ms'))
+    if args.only != 'remote':
+        client = Client('bench', '', False, connectionArgs={
+            'quiescenceMs': args.quiescence_ms,
+            'command': sys.executable,
+            'args': ['-m', 'dcss.fakecrawl'] + options})
+        report('local', measure(client, args.iterations), args.delay)
+        client.quit()
+    if args.only != 'local':
+        with FakeCrawlServer(delay=args.delay, jitter=args.jitter,
+                             chunkSize=args.chunk_size,
+                             moreChance=args.more_chance) as server:
+            client = Client('bench', 'bench', True, connectionArgs={
+                'host': server.host, 'port': server.port})
+            report('remote', measure(client, args.iterations), args.delay)
+            client.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# what 'import dcss' costs a fresh interpreter, in time and memory
+# 'dcss' is the package alone, as for parsing output or replaying a
+# recording; 'dcss + pty' and 'dcss + ssh' also load the backend of a
+# LocalConnection (pexpect) or a RemoteConnection (paramiko), which the
+# package leaves until a connection needs it
+# each case runs in its own interpreter, the median of the runs is shown
+# usage: python benchmarks/bench_import.py [runs]
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# run in the child: the imports, then what they cost
+_child = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in ('paramiko', 'pexpect', 'cryptography', 'asyncio')
+               if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'modules': len(sys.modules),
+                  'maxrss_kb': resource.getrusage(
+                      resource.RUSAGE_SELF).ru_maxrss,
+                  'heavy': heavy}}))
+"""
+
+# the interpreter alone comes first, for comparison
+CASES = [
+    ('python', ""),
+    ('dcss', "import dcss"),
+    ('dcss + pty', "import dcss; dcss.backends.require('pty')"),
+    ('dcss + ssh', "import dcss; dcss.backends.require('ssh')"),
+    ('dcss + async', "import dcss; dcss.AsyncClient"),
+]
+
+
+def run(imports):
+    code = _child.format(root=ROOT, imports=imports)
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return json.loads(out.decode())
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("{:<14} {:>10} {:>9} {:>11}  {}".format(
+        'import', 'ms', 'modules', 'maxrss KB', 'heavy modules loaded'))
+    for name, imports in CASES:
+        results = [run(imports) for _ in range(runs)]
+        print("{:<14} {:>10.1f} {:>9} {:>11}  {}".format(
+            name,
+            statistics.median(r['seconds'] for r in results) * 1000,
+            results[-1]['modules'],
+            int(statistics.median(r['maxrss_kb'] for r in results)),
+            ', '.join(results[-1]['heavy']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
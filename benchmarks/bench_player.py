@@ -0,0 +1,50 @@
+# cost of Player.update on a static main screen, and once per turn when
+# only a few sidebar rows change
+# usage: python benchmarks/bench_player.py [iterations] [--compact]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.player import Player
+from dcss.screens import Screens
+from dcss.terminal_buffer import TerminalBuffer
+import frames
+
+
+def run(terminal, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        # a fresh Player every time, so the sidebar is really parsed
+        Player().update(Screens.MAIN, terminal)
+    return time.perf_counter() - start
+
+
+def run_turns(terminal, updates):
+    # one Player kept across turns, so unchanged rows are skipped
+    player = Player()
+    player.update(Screens.MAIN, terminal)
+    elapsed = 0.0
+    for update in updates:
+        terminal.input(update)
+        start = time.perf_counter()
+        player.update(Screens.MAIN, terminal)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+if __name__ == '__main__':
+    compact = '--compact' in sys.argv
+    args = [a for a in sys.argv[1:] if a != '--compact']
+    iterations = int(args[0]) if args else 20000
+    terminal = TerminalBuffer(compact=compact)
+    terminal.input(frames.main_frame(random.Random(0)))
+    elapsed = min(run(terminal, iterations) for _ in range(3))
+    print("Player.update {:>8} calls {:>8.3f} s {:>8.2f} us/call".format(
+        iterations, elapsed, elapsed / iterations * 1e6))
+    updates = frames.turns(iterations)
+    elapsed = min(run_turns(terminal.snapshot(), updates) for _ in range(3))
+    print("per turn      {:>8} calls {:>8.3f} s {:>8.2f} us/call".format(
+        iterations, elapsed, elapsed / iterations * 1e6))
@@ -0,0 +1,66 @@
+# cost of opening games on an ssh server, each with its own connection
+# and over a TransportPool, against a FakeCrawlServer on this machine
+# only RemoteConnection.connect (and disconnect) is timed, not the login
+# usage: python benchmarks/bench_pool.py [games] [--max-channels N]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.connection import RemoteConnection
+from dcss.fakecrawl import FakeCrawlServer
+from dcss.ssh_pool import TransportPool
+
+
+def open_games(server, games, pool=None):
+    # seconds each connect took, with all the games open at once
+    connections = []
+    samples = []
+    for i in range(games):
+        conn = RemoteConnection('bench{}'.format(i), 'bench',
+                                host=server.host, port=server.port,
+                                pool=pool)
+        start = time.perf_counter()
+        conn.connect()
+        samples.append(time.perf_counter() - start)
+        connections.append(conn)
+    for conn in connections:
+        conn.disconnect()
+    return samples
+
+
+def report(name, samples, connections):
+    samples = sorted(samples)
+    print("{:<10} {:>6} {:>10.2f} {:>9.2f} {:>9.2f} {:>12}".format(
+        name, len(samples), sum(samples) * 1000,
+        samples[len(samples) // 2] * 1000, samples[-1] * 1000,
+        connections))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('games', type=int, nargs='?', default=20)
+    parser.add_argument('--max-channels', type=int, default=10)
+    args = parser.parse_args()
+
+    with FakeCrawlServer() as server:
+        print("{:<10} {:>6} {:>10} {:>9} {:>9} {:>12}".format(
+            'connect', 'games', 'total ms', 'p50 ms', 'max ms',
+            'ssh conns'))
+        before = server.connections
+        report('own', open_games(server, args.games),
+               server.connections - before)
+        before = server.connections
+        with TransportPool(maxChannels=args.max_channels) as pool:
+            report('pooled', open_games(server, args.games, pool),
+                   server.connections - before)
+            # the pool's transports are up now, as they'd be in a long run
+            before = server.connections
+            report('warm pool', open_games(server, args.games, pool),
+                   server.connections - before)
+
+
+if __name__ == '__main__':
+    main()
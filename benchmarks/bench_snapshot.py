@@ -0,0 +1,69 @@
+# how fast Client.load_state restores a snapshot from disk, with and
+# without the map levels, for a client on either TerminalBuffer grid
+# the client is one that replayed a recorded game from corpus/ (and read
+# the map from its last main screen), each restore reads the file again
+# usage: python benchmarks/bench_snapshot.py [restores] [--scenario NAME]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.client import Client
+from dcss.connection import ReplayConnection
+from dcss.screens import Screens
+import corpus
+
+
+def replayed_client(scenario, compact):
+    # set up as Client.__init__ does, on a replay of the scenario
+    client = Client.__new__(Client)
+    client._setup(corpus.NAME, compact=compact)
+    client.conn = connection = ReplayConnection(corpus.path(scenario))
+    connection.outputListener = client.terminal.input
+    connection.connect()
+    client.terminal.input(connection.crawl_login())
+    client._check_start_screen()
+    client._update_messages()
+    while not connection.finished:
+        client.send_command('.')
+    client._parse_screen(Screens.MAIN)
+    return client
+
+
+def run(client, path, restores):
+    start = time.perf_counter()
+    for _ in range(restores):
+        with open(path, 'rb') as f:
+            client.load_state(f.read())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('restores', type=int, nargs='?', default=5000)
+    parser.add_argument('--scenario', default='messages',
+                        choices=sorted(corpus.SCENARIOS))
+    args = parser.parse_args()
+    print("{:<8} {:<5} {:>9} {:>10} {:>9}".format(
+        'grid', 'maps', 'bytes', 'restores/s', 'us each'))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.dcss')
+        for compact in (False, True):
+            client = replayed_client(args.scenario, compact)
+            for maps in (False, True):
+                data = client.save_state(maps)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                elapsed = run(client, path, args.restores)
+                print("{:<8} {:<5} {:>9} {:>10.0f} {:>9.1f}".format(
+                    'compact' if compact else 'default', str(maps),
+                    len(data), args.restores / elapsed,
+                    elapsed / args.restores * 1e6))
+            client.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# the benchmark suite: TerminalBuffer.input, get_text, Player.update and
+# Client round trips (send_command and _update_messages) over the
+# recorded games in corpus/, offline
+# reports bytes/s, frames/s (ttyrec records), latency percentiles per
+# response and peak memory. --json saves the results, --compare prints
+# them next to saved ones, e.g. from the commit before
+# usage: python benchmarks/bench_suite.py [--repeat N] [--compact]
+#            [--only NAME] [--json FILE] [--compare FILE]
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.client import Client
+from dcss.connection import ReplayConnection
+from dcss.player import Player
+from dcss.screens import Screens
+from dcss.terminal_buffer import TerminalBuffer
+import corpus
+
+
+def responses(frames):
+    # the decoded chunks of each response, split at the recording's marks
+    # (the first one is the login, showing the main screen)
+    result = [[]]
+    for frame in frames:
+        if frame.data:
+            result[-1].append(frame.data.decode('utf-8'))
+        elif result[-1]:
+            result.append([])
+    return [r for r in result if r]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# each benchmark is given the responses of one recording and a fresh
+# TerminalBuffer, and returns a latency sample per response
+
+def bench_input(game, terminal):
+    samples = []
+    clock = time.perf_counter
+    for chunks in game:
+        start = clock()
+        for chunk in chunks:
+            terminal.input(chunk)
+        samples.append(clock() - start)
+    return samples
+
+
+def bench_get_text(game, terminal):
+    samples = []
+    clock = time.perf_counter
+    for chunks in game:
+        for chunk in chunks:
+            terminal.input(chunk)
+        start = clock()
+        terminal.get_text()
+        samples.append(clock() - start)
+    return samples
+
+
+def bench_player(game, terminal):
+    samples = []
+    player = Player()
+    clock = time.perf_counter
+    for chunks in game:
+        for chunk in chunks:
+            terminal.input(chunk)
+        start = clock()
+        player.update(Screens.MAIN, terminal)
+        samples.append(clock() - start)
+    return samples
+
+
+def bench_client(game, terminal, path=None):
+    # a Client replaying the game: one command per response, the client
+    # answers --more-- itself
+    # set up as Client.__init__ does, but on the terminal given
+    client = Client.__new__(Client)
+    client._setup(corpus.NAME)
+    client.terminal = terminal
+    client.conn = connection = ReplayConnection(path)
+    connection.outputListener = terminal.input
+    connection.connect()
+    terminal.input(connection.crawl_login())
+    client._check_start_screen()
+    client._update_messages()
+    samples = []
+    clock = time.perf_counter
+    while not connection.finished:
+        start = clock()
+        client.send_command('.')
+        samples.append(clock() - start)
+    client.quit()
+    return samples
+
+
+BENCHMARKS = [
+    ('input', bench_input),
+    ('get_text', bench_get_text),
+    ('player', bench_player),
+    ('client', bench_client),
+]
+
+
+def run(name, bench, scenario, game, args):
+    path = corpus.path(scenario)
+    size = sum(len(c.encode('utf-8')) for chunks in game for c in chunks)
+    records = sum(len(chunks) for chunks in game)
+
+    def once():
+        terminal = TerminalBuffer(compact=args.compact)
+        if bench is bench_client:
+            return bench(game, terminal, path)
+        return bench(game, terminal)
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        samples = once()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, samples)
+    elapsed, samples = best
+    # tracemalloc slows everything down, so memory gets a run of its own
+    tracemalloc.start()
+    once()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'benchmark': name,
+        'scenario': scenario,
+        'seconds': elapsed,
+        'bytes_per_s': size / elapsed,
+        'frames_per_s': records / elapsed,
+        'responses_per_s': len(samples) / elapsed,
+        'p50_us': percentile(samples, 0.5) * 1e6,
+        'p90_us': percentile(samples, 0.9) * 1e6,
+        'p99_us': percentile(samples, 0.99) * 1e6,
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+_header = "{:<10} {:<9} {:>9} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+    'benchmark', 'scenario', 'MB/s', 'frames/s', 'resp/s',
+    'p50 us', 'p90 us', 'p99 us', 'peak KB')
+
+
+def report(result, previous=None):
+    line = "{benchmark:<10} {scenario:<9} {mb:>9.2f} {frames_per_s:>10.0f} " \
+        "{responses_per_s:>10.0f} {p50_us:>9.1f} {p90_us:>9.1f} " \
+        "{p99_us:>9.1f} {peak_kb:>9.0f}".format(
+            mb=result['bytes_per_s'] / 1e6, **result)
+    if previous is not None:
+        # above 1.0 is faster than before
+        line += "   x{:.2f} vs {}".format(
+            result['bytes_per_s'] / previous['bytes_per_s'],
+            previous.get('commit') or 'saved')
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compact', action='store_true',
+                        help="use the compact TerminalBuffer grid")
+    parser.add_argument('--only', help="run only this benchmark")
+    parser.add_argument('--json', help="save the results to this file")
+    parser.add_argument('--compare', help="results saved with --json")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as saved:
+            saved = json.load(saved)
+        for result in saved['results']:
+            result['commit'] = saved['environment'].get('commit')
+            previous[(result['benchmark'], result['scenario'])] = result
+
+    games = {name: responses(corpus.load(name))
+             for name in sorted(corpus.SCENARIOS)}
+    results = []
+    print(_header)
+    for name, bench in BENCHMARKS:
+        if args.only and name != args.only:
+            continue
+        for scenario, game in games.items():
+            result = run(name, bench, scenario, game, args)
+            results.append(result)
+            report(result, previous.get((name, scenario)))
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'environment': environment(),
+                       'compact': args.compact,
+                       'results': results}, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# throughput of TerminalBuffer.input on full-screen redraws
+# usage: python benchmarks/bench_terminal.py [frames] [repeat] [--compact]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.terminal_buffer import TerminalBuffer
+import frames
+
+
+def run(data, repeat, compact=False):
+    best = None
+    for _ in range(repeat):
+        terminal = TerminalBuffer(compact=compact)
+        start = time.perf_counter()
+        for chunk in data:
+            terminal.input(chunk)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(label, data, elapsed):
+    size = sum(len(chunk) for chunk in data)
+    print("{:<24} {:>6} chunks {:>9} chars {:>8.3f} s {:>8.2f} MB/s "
+          "{:>9.1f} chunks/s".format(
+              label, len(data), size, elapsed,
+              size / elapsed / 1e6, len(data) / elapsed))
+
+
+if __name__ == '__main__':
+    compact = '--compact' in sys.argv
+    args = [a for a in sys.argv[1:] if a != '--compact']
+    count = int(args[0]) if len(args) > 0 else 200
+    repeat = int(args[1]) if len(args) > 1 else 3
+    redraws = frames.redraws(count)
+    report("full redraw", redraws, run(redraws, repeat, compact))
+    # the same redraws arriving as one big chunk, e.g. after a runrest
+    joined = ["".join(redraws)]
+    report("single large chunk", joined, run(joined, repeat, compact))
+    turns = frames.turns(count * 10)
+    report("incremental turns", turns, run(turns, repeat, compact))
@@ -0,0 +1,140 @@
+# the recorded crawl output the benchmark suite runs on
+# the recordings in corpus/ are ttyrecs (gzipped) of a game on the
+# 'bench' character, with a mark after each response so a Client can be
+# driven through them with a ReplayConnection (see dcss/ttyrec.py)
+# they're made by this script from the frames in frames.py, so they are
+# the same on every machine; run it to write them again
+# usage: python benchmarks/corpus.py
+import gzip
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.ttyrec import TtyrecWriter, read_ttyrec
+import frames
+
+DIRECTORY = os.path.join(os.path.dirname(__file__), 'corpus')
+NAME = 'bench'
+
+# messages the spam is made of
+_messages = [
+    "You hit the goblin.",
+    "The goblin hits you!",
+    "You miss the jackal.",
+    "The jackal bites you.",
+    "You hear a distant noise.",
+    "You see here 3 stones.",
+    "Found a flight of stone stairs leading down.",
+    "There is an open door here.",
+    "You kill the goblin!",
+    "The kobold shouts!",
+]
+_more = "--more--"
+
+
+def _message_lines(rng, count):
+    # scroll count messages into the message window (rows 17-22)
+    out = ["\x1b[18;23r", frames.goto(22, 0)]
+    for _ in range(count):
+        out.append("\r\n")
+        out.append(frames.sgr(rng.choice(frames._colors)))
+        out.append("_" + rng.choice(_messages))
+        out.append("\x1b[K")
+    out.append("\x1b[1;24r")
+    return "".join(out)
+
+
+def redraws(rng, count):
+    # every response redraws the whole main screen
+    return [frames.main_frame(rng, turn, NAME) for turn in range(count)]
+
+
+def messages(rng, count):
+    # scroll-heavy message spam: each turn a few cells, the time and a
+    # handful of messages scrolled into the message window
+    responses = []
+    for turn in range(count):
+        responses.append(frames.turn_frame(rng, turn)
+                         + _message_lines(rng, rng.randint(3, 8)))
+    return responses
+
+
+def more_chains(rng, count):
+    # turns that print more messages than fit, each page ending in
+    # --more-- until the last one (the client answers each with a key)
+    responses = []
+    turn = 0
+    while len(responses) < count:
+        turn += 1
+        pages = rng.randint(2, 6)
+        for page in range(pages):
+            out = [frames.goto(23, 0), "\x1b[K"]
+            if not page:
+                out.insert(0, frames.turn_frame(rng, turn))
+            out.append(_message_lines(rng, 6))
+            if page < pages - 1:
+                out.append(frames.goto(23, 0) + frames.sgr(37) + _more)
+            responses.append("".join(out))
+    return responses
+
+
+# name -> (responses, how many)
+SCENARIOS = {
+    'redraw': (redraws, 60),
+    'messages': (messages, 500),
+    'more': (more_chains, 300),
+}
+
+
+def _chunks(rng, data):
+    # the way a response arrives: in reads of up to a few KB
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(256, 4096)
+        yield data[pos:pos + size]
+        pos += size
+
+
+def record(responses, seed=0):
+    # the ttyrec bytes of a game that starts on the main screen and
+    # then shows responses, one per command
+    rng = random.Random(seed)
+    out = io.BytesIO()
+    writer = TtyrecWriter(out)
+    clock = 1000000000.0
+    start = frames.main_frame(random.Random(seed), 0, NAME)
+    for response in [start] + responses:
+        for chunk in _chunks(rng, response.encode('utf-8')):
+            writer.write(chunk, clock)
+            clock += 0.0005
+        writer.write(b'', clock)
+        clock += 0.05
+    return out.getvalue()
+
+
+def path(name):
+    return os.path.join(DIRECTORY, name + '.ttyrec.gz')
+
+
+def load(name):
+    # the Frames of a recording in the corpus
+    return read_ttyrec(path(name))
+
+
+def write():
+    if not os.path.isdir(DIRECTORY):
+        os.makedirs(DIRECTORY)
+    for name, (make, count) in sorted(SCENARIOS.items()):
+        data = record(make(random.Random(name), count))
+        # mtime 0, so the same corpus gives the same file
+        with open(path(name), 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as archive:
+                archive.write(data)
+        print("{:<10} {:>9} bytes".format(name, len(data)))
+
+
+if __name__ == '__main__':
+    write()
@@ -0,0 +1,88 @@
+# synthetic crawl-like terminal output for the benchmarks
+# the layout mimics the main screen: a map viewport on the left,
+# the stats sidebar on the right and the message area at the bottom
+import random
+
+WIDTH = 80
+HEIGHT = 24
+
+_glyphs = '#....##..~+>@<$)[!?%"g'
+_colors = [0, 31, 32, 33, 34, 35, 36, 37]
+
+# sidebar rows as (text at column 37, text at column 55)
+_sidebar = [
+    ("{name} the Skirmisher", ""),
+    ("Minotaur Berserker", ""),
+    ("Health: {hp}/{maxhp}", "=" * 24),
+    ("Magic: 0/0", "=" * 24),
+    ("AC:  5", "Str: 21"),
+    ("EV:  9", "Int: 8"),
+    ("SH:  0", "Dex: 11"),
+    ("XL:  3 Next: 42%", "Place: Dungeon:2"),
+    ("Noise: ---------", "Time: {time} (1.0)"),
+    ("a) +0 hand axe", ""),
+    ("c) 3 stones", ""),
+]
+
+
+def sgr(color):
+    return "\x1b[0;{}m".format(color)
+
+
+def goto(row, col):
+    return "\x1b[{};{}H".format(row + 1, col + 1)
+
+
+def main_frame(rng, turn=0, name="bench"):
+    out = ["\x1b[H\x1b[2J"]
+    # map viewport, colours change every few glyphs like a real level
+    for row in range(17):
+        out.append(goto(row, 0))
+        col = 0
+        while col < 33:
+            run = rng.randint(1, 6)
+            out.append(sgr(rng.choice(_colors)))
+            out.append("".join(rng.choice(_glyphs) for _ in range(run)))
+            col += run
+        out.append("\x1b[K")
+    # sidebar
+    hp = rng.randint(1, 40)
+    for row, (left, right) in enumerate(_sidebar):
+        out.append(goto(row, 37))
+        out.append(sgr(37))
+        out.append(left.format(name=name, hp=hp, maxhp=40).ljust(18))
+        out.append(right.format(time=turn))
+        out.append("\x1b[K")
+    # messages
+    for row in range(17, 23):
+        out.append(goto(row, 0))
+        out.append(sgr(37))
+        out.append("_You see here {} stones.".format(rng.randint(1, 9)))
+        out.append("\x1b[K")
+    out.append(goto(0, 0))
+    return "".join(out)
+
+
+def turn_frame(rng, turn=0):
+    # a typical turn only redraws a few map cells, the time and a message
+    out = []
+    for _ in range(rng.randint(3, 12)):
+        out.append(goto(rng.randint(0, 16), rng.randint(0, 32)))
+        out.append(sgr(rng.choice(_colors)))
+        out.append(rng.choice(_glyphs))
+    out.append(goto(8, 55))
+    out.append(sgr(37))
+    out.append("Time: {} (1.0)\x1b[K".format(turn))
+    out.append(goto(22, 0))
+    out.append("_You hear a distant noise.\x1b[K")
+    return "".join(out)
+
+
+def redraws(count, seed=0):
+    rng = random.Random(seed)
+    return [main_frame(rng, i) for i in range(count)]
+
+
+def turns(count, seed=0):
+    rng = random.Random(seed)
+    return [turn_frame(rng, i) for i in range(count)]
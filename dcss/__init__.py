@@ -3,17 +3,47 @@
 __title__ = 'dcss'
 __license__ = 'MIT'
 
-from .client import Client
-from .abilities import Abilities
-from .connection import RemoteConnection, LocalConnection
-from .inventory import Inventory
-from .map import Map
-from .player import Player
-from .spells import Spells
+from .client import Client, Direction
+from .abilities import Abilities, Ability
+from .connection import RemoteConnection, LocalConnection, ReplayConnection
+from .inventory import Inventory, InventoryChange, Item
+from .map import Level, Map, Overview
+from .messages import Message, MessageLog
+from .orchestrator import Orchestrator
+from .pathfinding import DijkstraMap, PathFinder
+from .player import Player, PlayerStats
+from .religion import Religion
+from .spells import Spell, Spells
+from .ssh_pool import TransportPool
 from .terminal_buffer import TerminalBuffer
+from .ttyrec import TtyrecWriter, read_ttyrec
 from .screens import Screens
 
+import importlib
 import logging
+import os
+
+# loaded on first use: the asyncio clients and the crawl stand-in are
+# left out of 'import dcss' (and paramiko and pexpect are only imported
+# by the connections that need them, see backends.py)
+_lazy = {
+    'AsyncClient': 'async_client',
+    'AsyncLocalConnection': 'async_connection',
+    'AsyncRemoteConnection': 'async_connection',
+    'FakeCrawl': 'fakecrawl',
+    'FakeCrawlServer': 'fakecrawl',
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _lazy[name], __name__),
+                    name)
+    globals()[name] = value
+    return value
+
 
 try:
     from logging import NullHandler
@@ -23,3 +53,8 @@ except:
             pass
 
 logging.getLogger(__name__).addHandler(NullHandler())
+
+# nothing is logged unless tracing is enabled, see trace.py
+if os.environ.get('DCSS_TRACE'):
+    from . import trace
+    trace.enable(os.environ['DCSS_TRACE'])
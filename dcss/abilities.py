@@ -1,9 +1,47 @@
+from collections import namedtuple
+import re
+
+from .cached_section import CachedSection, percent, split_menu_line
 from .screens import Screens
 
+# one ability; cost as shown (e.g. '5 MP, Piety'), failure a percentage
+Ability = namedtuple('Ability', ['letter', 'name', 'cost', 'failure'])
+
+
+class Abilities(CachedSection):
+    _screen = Screens.ABILITIES
+    # gods grant and take away abilities, and so do mutations
+    _invalidating = re.compile(
+        r"You can now|You (?:can no longer|have lost|lose)|"
+        r"You (?:join|renounce|abandon)|welcomes you|"
+        r"You feel (?:a bit |very )?(?:different|strange)|"
+        r"Your .* (?:changes|grows|shrinks|disappears)|[Mm]utat")
 
-class Abilities():
     def __init__(self):
+        super().__init__()
+        self.abilities = {}
         return
 
-    def update(self, screenType, screen):
-        pass
+    def __getitem__(self, letter):
+        return self.abilities[letter]
+
+    def __iter__(self):
+        return iter(self.abilities.values())
+
+    def __len__(self):
+        return len(self.abilities)
+
+    def _read(self, terminal):
+        abilities = {}
+        if terminal is not None:
+            for line in terminal.get_text().split('\n'):
+                entry = split_menu_line(line)
+                if entry is None or len(entry[1]) < 3:
+                    continue
+                letter, columns = entry
+                name, cost, failure = columns[:3]
+                if percent(failure) is None:
+                    continue
+                abilities[letter] = Ability(letter, name, cost,
+                                            percent(failure))
+        self.abilities = abilities
@@ -0,0 +1,155 @@
+from .async_connection import AsyncLocalConnection, AsyncRemoteConnection
+from .client import Client
+from .screens import Screens
+from .stats import timed_async
+
+
+class AsyncClient(Client):
+    # the same client, driven from an asyncio event loop
+    # only waiting on the game is awaited, the terminal and the parsers
+    # stay synchronous, so one loop can drive hundreds of games
+    # create with 'await AsyncClient.create(...)', which also logs in
+
+    def __init__(self, crawlUserName, crawlPassword, useRemoteConnection,
+                 connectionArgs=None, messageArgs=None, compact=False):
+        self._setup(crawlUserName, messageArgs, compact)
+        self.new_game = False
+        self.weird = False
+        # attribute access can't wait on the game, refresh with section()
+        self.lazy = False
+
+        # extra keyword arguments for the connection,
+        # e.g. {'quiescenceMs': 20} for an AsyncLocalConnection
+        connectionArgs = connectionArgs or {}
+        if useRemoteConnection:
+            self.conn = AsyncRemoteConnection(
+                crawlUserName, crawlPassword, **connectionArgs)
+        else:
+            self.conn = AsyncLocalConnection(crawlUserName, **connectionArgs)
+        self.conn.outputListener = self.terminal.input
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        client = cls(*args, **kwargs)
+        await client.connect()
+        return client
+
+    async def connect(self):
+        if not self.conn.validConnection:
+            if await self.conn.connect():
+                self.terminal.input(await self.conn.crawl_login())
+            else:
+                raise Exception("failed to connect")
+
+        self._check_start_screen()
+
+        # if we're on the main screen, start populating messages
+        await self._update_messages()
+
+    async def section(self, name):
+        # the parsed section, first refreshing its screens if it is stale
+        if self.is_stale(name):
+            previous = self.screen
+            await self.update(screens=Client._section_screens[name])
+            await self.set_screen(previous)
+        return self._sections[name]
+
+    @timed_async('client', call=True)
+    async def send_command(self, command):
+        await self._send_command_helper(command)
+        await self._update_messages()
+        return self.terminal.get_text()
+
+    @timed_async('connection')
+    async def _send_command_helper(self, command):
+        if self.metrics is not None:
+            self.metrics.roundTrips += 1
+        self.terminal.input(await self.conn.send_command(command, False))
+
+    @timed_async('connection')
+    async def _send_keys_helper(self, keys):
+        if self.metrics is not None:
+            self.metrics.roundTrips += 1
+        self.terminal.input(
+            await self.conn.send_keys(keys, Client._pipeline_key_gap))
+
+    @timed_async('connection')
+    async def _get_output_helper(self):
+        self.terminal.input(await self.conn.get_output())
+
+    @timed_async('messages')
+    async def _update_messages(self):
+        # messages only appear on main screen
+        if self.screen == Screens.MAIN:
+            self._refresh_main()
+            self._read_messages(True)
+            # if we have more messages send ' ' and repeat
+            while self._more_message_exists():
+                if self.metrics is not None:
+                    self.metrics.moreMessages += 1
+                await self._send_command_helper(' ')
+                self._refresh_main()
+                self._read_messages(False)
+
+    async def quit(self):
+        await self.conn.disconnect()
+        self.messages.close()
+
+    @timed_async('client', call=True)
+    async def update(self, pipelined=False, screens=None):
+        if pipelined and screens is None:
+            return await self._update_pipelined()
+        result = True
+        for s in self._update_order(screens):
+            result = result and await self.set_screen(s)
+            if result:
+                self._parse_screen(s)
+                while self._more_pages(s):
+                    await self._send_command_helper(Client._next_page_key)
+                    self._parse_screen(s)
+
+        return self._finish_update(result)
+
+    async def _update_pipelined(self):
+        # Client._update_pipelined, awaiting crawl
+        if not await self.set_screen(Screens.MAIN):
+            self.fresh = False
+            return False
+        plan, keys, snapshots = self._start_pipeline()
+        try:
+            await self._send_keys_helper(keys)
+            while len(snapshots) < 2 * len(plan):
+                version = self.terminal.version
+                await self._get_output_helper()
+                if self.terminal.version == version:
+                    break
+        finally:
+            self._end_pipeline(snapshots)
+
+        paged = self._pipeline_paged(plan, snapshots)
+        if paged is None:
+            if not self._check_main_screen():
+                await self.send_command('\x1b')
+            self.screen = Screens.MAIN
+            return await self.update()
+        if paged:
+            return await self.update(screens=paged)
+        return True
+
+    @timed_async('client', call=True)
+    async def set_screen(self, screenType):
+        result = True
+        if self.screen == screenType:
+            return True
+        if screenType == Screens.MAIN:
+            await self.send_command('\x1b')
+            result = self._check_main_screen()
+        else:
+            # moving between secondary screens requires going to main first
+            if self.screen != Screens.MAIN:
+                result = await self.set_screen(Screens.MAIN)
+            if result:
+                await self.send_command(self._screen_key(screenType))
+                result = not self._check_main_screen()
+
+        return self._finish_transition(screenType, result)
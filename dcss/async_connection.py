@@ -0,0 +1,348 @@
+from abc import ABC, abstractmethod
+import asyncio
+import codecs
+import fcntl
+import logging
+import os
+import pty
+import struct
+import termios
+import time
+
+from .connection import MARKER_WINDOW, PROMPT_MARKERS, UTF8
+from . import backends, trace
+from .stats import LatencyStats
+from .ttyrec import TtyrecWriter, recorded_async
+
+log = logging.getLogger(__name__)
+
+
+class _AsyncConnection(ABC):
+    # shared by the asyncio connections: the event loop reads chunks
+    # into a queue as they arrive, and get_output takes them from there
+    # until the game goes idle or shows a prompt marker
+    _newline = '\n'
+
+    def __init__(self, promptMarkers=None, recordPath=None):
+        self.isWaitingForResponse = False
+        self.validConnection = False
+        self.lastOutput = ''
+        # if set, output is handed to this callable as soon as it is read
+        # (e.g. TerminalBuffer.input) instead of being collected
+        self.outputListener = None
+        if promptMarkers is None:
+            promptMarkers = PROMPT_MARKERS
+        self.promptMarkers = promptMarkers
+        # the longest to wait for a response to start, in seconds
+        self.responseTimeout = 5.0
+        self.bufferSize = 4096
+        # timings of send_command, of the first output after sending,
+        # and of the gaps between chunks of one response
+        self.responseStats = LatencyStats()
+        self.firstByteStats = LatencyStats()
+        self.gapStats = LatencyStats()
+        self._decoder = codecs.getincrementaldecoder(UTF8)('replace')
+        self._chunks = asyncio.Queue()
+        self._sentAt = None
+        # if set, everything read is also written to this ttyrec file
+        self.recorder = None if recordPath is None else \
+            TtyrecWriter(recordPath)
+
+    @abstractmethod
+    def idle_timeout(self):
+        # how long output may pause before the response counts as over
+        pass
+
+    @abstractmethod
+    def _write(self, data):
+        # send the text in data to crawl
+        pass
+
+    def _received(self, data):
+        # called by the event loop, an empty chunk marks the end of output
+        self._chunks.put_nowait(data)
+
+    @recorded_async
+    async def get_output(self, timeout=None):
+        start = time.monotonic()
+        deadline = start + (timeout or self.responseTimeout)
+        output = ''
+        # bytes read
+        size = 0
+        tail = ''
+        lastChunk = None
+        prompted = False
+        while True:
+            if not self._chunks.empty():
+                buffer = self._chunks.get_nowait()
+            elif prompted:
+                # crawl won't print anything else until a key is pressed
+                break
+            else:
+                now = time.monotonic()
+                if lastChunk is None:
+                    wait = deadline - now
+                else:
+                    wait = min(self.idle_timeout(), deadline - now)
+                if wait <= 0:
+                    break
+                try:
+                    buffer = await asyncio.wait_for(self._chunks.get(), wait)
+                except asyncio.TimeoutError:
+                    break
+
+            if not buffer:
+                self.validConnection = False
+                break
+            self.isWaitingForResponse = False
+            now = time.monotonic()
+            if lastChunk is None:
+                self.firstByteStats.add(now - (self._sentAt or start))
+            else:
+                self.gapStats.add(now - lastChunk)
+            lastChunk = now
+
+            if self.recorder is not None:
+                self.recorder.write(buffer)
+            trace.raw(buffer)
+            size += len(buffer)
+            data = self._decoder.decode(buffer)
+            if self.outputListener:
+                self.outputListener(data)
+                self.lastOutput = data
+            else:
+                output += data
+            tail = (tail + data)[-MARKER_WINDOW:]
+            if any(m.search(tail) for m in self.promptMarkers):
+                prompted = True
+
+        if not self.outputListener:
+            self.lastOutput = output
+        log.debug("%s received %d bytes", type(self).__name__, size)
+        return output
+
+    @recorded_async
+    async def send_command(self, command, addNewline=False):
+        log.debug("%s sending command: %r", type(self).__name__, command)
+        self._sentAt = time.monotonic()
+        # sent with the command, see RemoteConnection.send_command
+        if(addNewline):
+            command += self._newline
+        if(command):
+            self.isWaitingForResponse = True
+            self._write(command)
+
+        output = await self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    @recorded_async
+    async def send_keys(self, keys, gap=0.0):
+        # send several keypresses, pausing gap seconds between them,
+        # then read the output of all of them as one response
+        log.debug("%s sending keys: %r", type(self).__name__, keys)
+        self._sentAt = time.monotonic()
+        for i, key in enumerate(keys):
+            if i and gap and keys[i - 1] == '\x1b':
+                await asyncio.sleep(gap)
+            self.isWaitingForResponse = True
+            self._write(key)
+
+        output = await self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    def stats(self):
+        return {
+            'response': self.responseStats.as_dict(),
+            'first_byte': self.firstByteStats.as_dict(),
+            'gap': self.gapStats.as_dict(),
+            'idle_timeout': self.idle_timeout(),
+        }
+
+
+class AsyncLocalConnection(_AsyncConnection):
+    # runs crawl on a pseudo terminal, read by the event loop
+    _newline = '\r'
+
+    def __init__(self, playerName, quiescenceMs=20, promptMarkers=None,
+                 command='crawl', args=(), recordPath=None):
+        super().__init__(promptMarkers, recordPath)
+        self.playerName = playerName
+        self.quiescenceMs = quiescenceMs
+        self.command = command
+        self.args = list(args)
+        # loading or creating a game can take a while
+        self.startupTimeout = 10.0
+        self.process = None
+        self._master = None
+
+    def idle_timeout(self):
+        return self.quiescenceMs / 1000.0
+
+    async def connect(self):
+        master, slave = pty.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                    struct.pack('HHHH', 24, 80, 0, 0))
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                self.command, *self.args,
+                stdin=slave, stdout=slave, stderr=slave,
+                start_new_session=True,
+                preexec_fn=_take_controlling_terminal)
+        except OSError:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        self._master = master
+        os.set_blocking(master, False)
+        asyncio.get_running_loop().add_reader(master, self._on_readable)
+        self.validConnection = self.process.returncode is None
+        log.info("AsyncLocalConnection connected: %s", self.validConnection)
+        return self.validConnection
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._master, self.bufferSize)
+        except OSError:
+            # EIO once the other end of the terminal is closed
+            data = b''
+        if not data:
+            asyncio.get_running_loop().remove_reader(self._master)
+        self._received(data)
+
+    def _write(self, data):
+        os.write(self._master, data.encode(UTF8))
+
+    @recorded_async
+    async def crawl_login(self):
+        # 'logging in' in this case is typing out the player's name
+        # and either starting a new game, or loading the old one
+        log.info("AsyncLocalConnection logging in with name: %s",
+                 self.playerName)
+        await self.get_output(self.startupTimeout)
+        await self.send_command(self.playerName, True)
+        # \x12 is Ctrl+R (redraw)
+        return await self.send_command('\x12', False)
+
+    async def disconnect(self):
+        if self._master is not None:
+            asyncio.get_running_loop().remove_reader(self._master)
+            os.close(self._master)
+            self._master = None
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.validConnection = False
+        log.info("AsyncLocalConnection disconnecting")
+
+
+class AsyncRemoteConnection(_AsyncConnection):
+    # an ssh shell channel, read by the event loop
+    # paramiko's blocking connect and login run in the default executor
+
+    def __init__(self, crawlLoginName, crawlLoginPassword,
+                 promptMarkers=None, recordPath=None,
+                 host="crawl.akrasiac.org", port=22, pool=None):
+        super().__init__(promptMarkers, recordPath)
+        self.connectionString = host
+        self.port = port
+        # a TransportPool shared with other games, see RemoteConnection
+        self.pool = pool
+        self.sshUsername = "joshua"
+        self.sshPassword = "joshua"
+        # the longest the connection stays idle before a response is over
+        self.delay = 0.5
+        self.idleFactor = 4.0
+        self.minIdle = 0.03
+        self.username = crawlLoginName
+        self.password = crawlLoginPassword
+        self.sshClient = None
+        self.sshChannel = None
+
+    def idle_timeout(self):
+        return self.gapStats.adaptive_timeout(
+            self.idleFactor, self.minIdle, self.delay)
+
+    def _open_channel(self):
+        if self.pool is not None:
+            return self.pool.open_channel(
+                self.connectionString, self.port,
+                self.sshUsername, self.sshPassword)
+        paramiko = backends.require('ssh')
+        self.sshClient = paramiko.SSHClient()
+        self.sshClient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.sshClient.connect(
+            self.connectionString,
+            port=self.port,
+            username=self.sshUsername,
+            password=self.sshPassword)
+        return self.sshClient.invoke_shell()
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.sshChannel = await loop.run_in_executor(None, self._open_channel)
+        loop.add_reader(self.sshChannel.fileno(), self._on_readable)
+        self.validConnection = True
+        log.info("AsyncRemoteConnection connected: %s",
+                 self.validConnection)
+        return self.validConnection
+
+    def _on_readable(self):
+        channel = self.sshChannel
+        while channel.recv_ready():
+            self._received(channel.recv(self.bufferSize))
+        if channel.closed or channel.eof_received:
+            asyncio.get_running_loop().remove_reader(channel.fileno())
+            self._received(b'')
+
+    def _write(self, data):
+        self.sshChannel.sendall(data)
+
+    @recorded_async
+    async def crawl_login(self):
+        # navigate the crawl login commands
+        await self.send_command('L', False)
+        await self.send_command(self.username, True)
+        await self.send_command(self.password, True)
+        # select trunk branch
+        await self.send_command('T', False)
+        result = await self.send_command('P', False)
+        log.info("AsyncRemoteConnection logged in")
+        return result
+
+    async def disconnect(self):
+        self._close_channel()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.validConnection = False
+        log.info("AsyncRemoteConnection disconnected")
+
+    async def reconnect(self):
+        # a new channel (on the same transport, if pooled) and log in again
+        self._close_channel()
+        # whatever was left of the old channel, up to its end
+        self._chunks = asyncio.Queue()
+        self._decoder.reset()
+        await self.connect()
+        return await self.crawl_login()
+
+    def _close_channel(self):
+        if self.sshChannel is not None:
+            asyncio.get_running_loop().remove_reader(self.sshChannel.fileno())
+            if self.pool is not None:
+                self.pool.release(self.sshChannel)
+        if self.sshClient:
+            self.sshClient.close()
+        self.sshChannel = None
+        self.sshClient = None
+
+
+def _take_controlling_terminal():
+    # runs in the child after setsid, so curses sees a real terminal
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
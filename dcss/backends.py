@@ -0,0 +1,46 @@
+# the third party libraries the connections are built on
+# each is imported the first time a connection needs it, not with the
+# package: paramiko (and the cryptography it pulls in) makes up most of
+# what 'import dcss' would cost, and code that only parses output, replays
+# a recording or plays locally never uses it
+import importlib
+import importlib.util
+
+# backend -> (module, what it's for)
+_backends = {
+    'ssh': ('paramiko', "RemoteConnection, AsyncRemoteConnection "
+            "and FakeCrawlServer"),
+    'pty': ('pexpect', "LocalConnection"),
+}
+_loaded = {}
+
+
+def register(name, module, usedBy=''):
+    # add a backend, or point one at another module
+    _backends[name] = (module, usedBy)
+    _loaded.pop(name, None)
+
+
+def require(name):
+    # the backend's module, imported on first use
+    module = _loaded.get(name)
+    if module is None:
+        moduleName, usedBy = _backends[name]
+        try:
+            module = importlib.import_module(moduleName)
+        except ImportError as e:
+            raise ImportError("{} needs {} (pip install {})".format(
+                usedBy or name, moduleName, moduleName)) from e
+        _loaded[name] = module
+    return module
+
+
+def available(name):
+    # whether the backend could be loaded, without loading it
+    if name in _loaded:
+        return True
+    return importlib.util.find_spec(_backends[name][0]) is not None
+
+
+def loaded(name):
+    return name in _loaded
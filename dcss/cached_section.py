@@ -0,0 +1,61 @@
+import re
+
+# ' a - Magic Dart     Conj    ####....   3%   1', split into its letter
+# and the columns, which are set apart by two or more spaces
+_menu_line = re.compile(r"\s*([a-zA-Z]) [-+#] (\S.*?)\s*$")
+_columns = re.compile(r"\s{2,}")
+
+
+def split_menu_line(line):
+    # (letter, [columns]) for an entry of a crawl menu, or None
+    match = _menu_line.match(line)
+    if match is None:
+        return None
+    return match.group(1), _columns.split(match.group(2))
+
+
+def percent(text):
+    # '12%' -> 12, None if it isn't a percentage
+    text = text.strip()
+    if text.endswith('%') and text[:-1].isdigit():
+        return int(text[:-1])
+    return None
+
+
+class CachedSection():
+    # base for sections read from screens that seldom change
+    # they are only read again once invalidated: by a message matching
+    # _invalidating, by one of the _watchedStats sidebar fields changing,
+    # or by an explicit invalidate()
+
+    # the screen the section is read from
+    _screen = None
+    # compiled regex searched in every new message, or None
+    _invalidating = None
+    # PlayerStats fields that change what the screen shows
+    _watchedStats = ('experience_level',)
+
+    def __init__(self):
+        self.invalidated = True
+        self._stats = None
+
+    def invalidate(self):
+        self.invalidated = True
+
+    def note_message(self, message):
+        if self._invalidating is not None and \
+                self._invalidating.search(message):
+            self.invalidated = True
+
+    def note_player(self, stats):
+        watched = tuple(getattr(stats, f) for f in self._watchedStats)
+        if self._stats is not None and watched != self._stats:
+            self.invalidated = True
+        self._stats = watched
+
+    def update(self, screenType, screen):
+        # screen is None if the game only answered with a message
+        # (e.g. 'You don't know any spells.'), i.e. there's nothing to list
+        if screenType == self._screen:
+            self._read(screen)
+            self.invalidated = False
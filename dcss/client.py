@@ -2,20 +2,20 @@ from .connection import LocalConnection, RemoteConnection
 from .terminal_buffer import TerminalBuffer
 from .player import Player
 from .inventory import Inventory
-from .map import Map
+from .map import Map, Overview
 from .spells import Spells
 from .abilities import Abilities
+from .religion import Religion
+from .messages import MessageLog
+from . import snapshot
 from .screens import Screens
+from .stats import ClientStats, timed
 from enum import Enum
 
 import sys
 import logging
 import traceback
 
-logging.basicConfig(
-    filename="dcss.py.log",
-    level=logging.DEBUG,
-    format='%(asctime)s|%(name)s|%(levelname)s|%(message)s')
 log = logging.getLogger(__name__)
 
 
@@ -24,6 +24,39 @@ class Direction(Enum):
     DOWN = 2
     LEFT = 3
     RIGHT = 4
+    UP_LEFT = 5
+    UP_RIGHT = 6
+    DOWN_LEFT = 7
+    DOWN_RIGHT = 8
+
+    @property
+    def key(self):
+        # crawl's vi-keys for moving one step
+        return _direction_keys[self]
+
+    @property
+    def offset(self):
+        # (dy, dx) of one step, y growing downwards like the screen
+        return _direction_offsets[self]
+
+    @classmethod
+    def from_offset(cls, dy, dx):
+        return _offset_directions[(dy, dx)]
+
+
+_direction_keys = {
+    Direction.UP: 'k', Direction.DOWN: 'j',
+    Direction.LEFT: 'h', Direction.RIGHT: 'l',
+    Direction.UP_LEFT: 'y', Direction.UP_RIGHT: 'u',
+    Direction.DOWN_LEFT: 'b', Direction.DOWN_RIGHT: 'n',
+}
+_direction_offsets = {
+    Direction.UP: (-1, 0), Direction.DOWN: (1, 0),
+    Direction.LEFT: (0, -1), Direction.RIGHT: (0, 1),
+    Direction.UP_LEFT: (-1, -1), Direction.UP_RIGHT: (-1, 1),
+    Direction.DOWN_LEFT: (1, -1), Direction.DOWN_RIGHT: (1, 1),
+}
+_offset_directions = {v: k for k, v in _direction_offsets.items()}
 
 
 class Client:
@@ -39,30 +72,106 @@ class Client:
     # aka runrest
     _more_line = 23
     _more_text = "--more--"
-
-    def __init__(self, crawlUserName, crawlPassword, useRemoteConnection):
-        self.user_name = crawlUserName
-        self.screen = Screens.MAIN
-        self.player = Player()
-        self.inventory = Inventory()
-        self.map = Map()
-        self.spells = Spells()
-        self.abilities = Abilities()
-        self.fresh = False
-        self.messages = []
-        self._last_action_msg_id = -1
-
-        if useRemoteConnection:
-            self.conn = RemoteConnection(crawlUserName, crawlPassword)
+    # keys that open each secondary screen from the main screen
+    _screen_keys = {
+        Screens.SKILLS: 'm',
+        Screens.INVENTORY: 'i',
+        Screens.CHARACTER: '%',
+        Screens.DUNGEON: '\x0f',
+        Screens.SPELLS: 'I',
+        Screens.RELIGION: '^',
+        Screens.ABILITIES: 'a',
+    }
+    # the log message shown instead of these screens when they'd be empty
+    _empty_screen_messages = {
+        Screens.SPELLS: _no_spells,
+        Screens.RELIGION: _no_religion,
+        Screens.ABILITIES: _no_abilities,
+    }
+    # shows the next page of a listing that said -more-
+    _next_page_key = '>'
+    # pause between pipelined keys, so crawl doesn't read ESC followed by
+    # another key as a single alt-key press
+    _pipeline_key_gap = 0.03
+    # the screens each parsed section is read from
+    _section_screens = {
+        'player': (Screens.MAIN,),
+        'inventory': (Screens.INVENTORY,),
+        'map': (Screens.MAIN,),
+        'overview': (Screens.DUNGEON,),
+        'spells': (Screens.SPELLS,),
+        'abilities': (Screens.ABILITIES,),
+        'religion': (Screens.RELIGION,),
+    }
+
+    def __init__(self, crawlUserName, crawlPassword, useRemoteConnection,
+                 connectionArgs=None, messageArgs=None, connection=None,
+                 compact=False):
+        self._setup(crawlUserName, messageArgs, compact)
+
+        # extra keyword arguments for the connection,
+        # e.g. {'quiescenceMs': 20} for a LocalConnection
+        # or {'recordPath': 'game.ttyrec'} to record the game
+        # connection replaces both, e.g. with a ReplayConnection
+        connectionArgs = connectionArgs or {}
+        if connection is not None:
+            self.conn = connection
+        elif useRemoteConnection:
+            self.conn = RemoteConnection(
+                crawlUserName, crawlPassword, **connectionArgs)
         else:
-            self.conn = LocalConnection(crawlUserName)
-        self.terminal = TerminalBuffer()
+            self.conn = LocalConnection(crawlUserName, **connectionArgs)
+        # parse output as it arrives, rather than once the command finishes
+        self.conn.outputListener = self.terminal.input
         if(self.conn and not self.conn.validConnection):
             if(self.conn.connect()):
                 self.terminal.input(self.conn.crawl_login())
             else:
                 raise Exception("failed to connect")
 
+        self._check_start_screen()
+
+        # if we're on the main screen, start populating messages
+        self._update_messages()
+
+    def _setup(self, crawlUserName, messageArgs=None, compact=False):
+        # state shared by every kind of client, before connecting
+        self.user_name = crawlUserName
+        self.screen = Screens.MAIN
+        self._sections = {
+            'player': Player(),
+            'inventory': Inventory(),
+            'map': Map(),
+            'overview': Overview(),
+            'spells': Spells(),
+            'abilities': Abilities(),
+            'religion': Religion(),
+        }
+        # (turn, terminal version) each screen was last parsed at
+        self._screen_stamps = {}
+        # sections that watch the messages to know when they're out of date
+        self._message_watchers = [
+            s for s in self._sections.values() if hasattr(s, 'note_message')]
+        # and those that go out of date when the sidebar changes
+        self._player_watchers = [
+            s for s in self._sections.values() if hasattr(s, 'note_player')]
+        # if set, reading a section that is stale for the current turn
+        # first refreshes just the screens it needs
+        self.lazy = True
+        self.fresh = False
+        # keyword arguments for the MessageLog,
+        # e.g. {'capacity': 500, 'spillPath': 'messages.log'}
+        self.messages = MessageLog(**(messageArgs or {}))
+        # compact keeps the screen in typed arrays, which takes far less
+        # memory when running many games in one process
+        self.terminal = TerminalBuffer(compact=compact)
+        # screens that only showed a log message the last time we tried
+        # a pipelined update leaves them out
+        self._empty_screens = set()
+        # per-call timings and counters, see enable_stats
+        self.metrics = None
+
+    def _check_start_screen(self):
         self.new_game = self.terminal.get_text(0, 0, 0, 1).startswith(
             Client._new_game_text.format(self.user_name))
 
@@ -73,99 +182,377 @@ class Client:
         # or if you load trunk during a tourney
         self.weird = ((not self.new_game) and (not self._check_main_screen()))
 
-        # if we're on the main screen, start populating messages
-        self._update_messages()
+    @property
+    def player(self):
+        return self._get_section('player')
+
+    @property
+    def inventory(self):
+        return self._get_section('inventory')
+
+    @property
+    def map(self):
+        return self._get_section('map')
+
+    @property
+    def overview(self):
+        return self._get_section('overview')
+
+    @property
+    def spells(self):
+        return self._get_section('spells')
+
+    @property
+    def abilities(self):
+        return self._get_section('abilities')
+
+    @property
+    def religion(self):
+        return self._get_section('religion')
+
+    def _get_section(self, name):
+        if self.lazy and self.is_stale(name):
+            previous = self.screen
+            self.update(screens=Client._section_screens[name])
+            # don't leave the game sitting in a menu
+            self.set_screen(previous)
+        return self._sections[name]
+
+    def current_turn(self):
+        return self._sections['player'].total_auts
+
+    def section_stamp(self, name):
+        # the oldest (turn, terminal version) the section's screens were
+        # read at, or None if one of them was never read
+        stamps = [self._screen_stamps.get(s)
+                  for s in Client._section_screens[name]]
+        if None in stamps:
+            return None
+        return min(stamps, key=lambda stamp: stamp[1])
+
+    def invalidate(self, name=None):
+        # make a section (or all of them) be read again next time
+        names = [name] if name is not None else list(self._sections)
+        for name in names:
+            section = self._sections[name]
+            if hasattr(section, 'invalidated'):
+                section.invalidated = True
+            else:
+                for s in Client._section_screens[name]:
+                    self._screen_stamps.pop(s, None)
+
+    def is_stale(self, name):
+        # sections with an invalidated flag only go stale when told so,
+        # the others whenever a turn passed since they were read
+        stamp = self.section_stamp(name)
+        if stamp is None:
+            return True
+        invalidated = getattr(self._sections[name], 'invalidated', None)
+        if invalidated is not None:
+            return invalidated
+        return stamp[0] != self.current_turn()
+
+    def save_state(self, maps=True):
+        # everything read so far as compact bytes, see snapshot.py
+        # maps=False leaves out the levels, which are most of the size
+        return snapshot.dumps(self, maps)
+
+    def load_state(self, data):
+        # go back to a state from save_state, e.g. to rewind a game
+        # the connection is left as it is, only what was parsed changes
+        # (and the terminal is compact from then on, see snapshot.py)
+        snapshot.loads(data, self)
 
     def get_screen(self):
         return self.terminal.get_text()
 
+    @timed('client', call=True)
     def send_command(self, command):
         self._send_command_helper(command)
         self._update_messages()
-        # self.terminal.input(self.conn.send_command(command, False))
         return self.terminal.get_text()
 
+    def _refresh_main(self):
+        # the sidebar is on screen after every command anyway, and parsing
+        # it only costs anything if it changed, so keep it current
+        if self.screen == Screens.MAIN and self._check_main_screen():
+            try:
+                self._parse_screen(Screens.MAIN)
+            except (ValueError, IndexError):
+                log.debug("couldn't parse the main screen")
+
+    @timed('connection')
     def _send_command_helper(self, command):
         # this exists to avoid recursive calls when handling 'more' messages
+        if self.metrics is not None:
+            self.metrics.roundTrips += 1
         self.terminal.input(self.conn.send_command(command, False))
 
+    @timed('connection')
+    def _send_keys_helper(self, keys):
+        if self.metrics is not None:
+            self.metrics.roundTrips += 1
+        self.terminal.input(
+            self.conn.send_keys(keys, Client._pipeline_key_gap))
+
+    @timed('connection')
+    def _get_output_helper(self):
+        self.terminal.input(self.conn.get_output())
+
+    def _timed_input(self, text):
+        # the output listener while the metrics are on
+        metrics = self.metrics
+        metrics.bytesReceived += len(text.encode('utf-8'))
+        metrics.begin('terminal')
+        try:
+            self.terminal.input(text)
+        finally:
+            metrics.end()
+
+    def enable_stats(self, hook=None):
+        # start timing calls, see ClientStats (hook is called after each)
+        self.metrics = ClientStats(hook)
+        self.conn.outputListener = self._timed_input
+
+    def disable_stats(self):
+        self.metrics = None
+        self.conn.outputListener = self.terminal.input
+
+    def stats(self):
+        # the client's timings and counters (None unless enable_stats was
+        # called), and the connection's own
+        return {
+            'client': None if self.metrics is None
+            else self.metrics.as_dict(),
+            'connection': self.conn.stats(),
+        }
+
     def _more_message_exists(self):
         return self.terminal.get_text(0, Client._more_line, 0, 1).strip() ==\
             Client._more_text
 
     def _get_latest_message(self):
-        if len(self.messages):
-            return self.messages[-1]
+        latest = self.messages.latest()
+        if latest is not None:
+            return latest.text
         return None
 
     def get_messages_for_last_action(self):
-        if not len(self.messages):
-            return []
-        else:
-            return self.messages[self._last_action_msg_id:len(self.messages)]
+        return [m.text for m in self.messages.for_action(self.messages.action)]
 
+    @timed('messages')
     def _update_messages(self):
         # keeping track of messages line by line
 
         # messages only appear on main screen
         if self.screen == Screens.MAIN:
-            done = False
-            updateIndex = True
-            while not done:
-                oldestNewMessage = Client._message_line_start
-                # otherwise, match the last line we have
-                for i in range(
-                        Client._message_line_start,
-                        Client._message_line_end + 1,
-                        -1):
-                    if self.terminal.get_text(0, i, 0, 1).strip() == \
-                            self._get_latest_message():
-                        oldestNewMessage = i + 1
-                        break
-
-                for i in range(oldestNewMessage, Client._message_line_end + 1):
-                    msg = self.terminal.get_text(0, i, 0, 1).strip()
-                    if len(msg):
-                        self.messages.append(msg)
-
-                # only update the index for the first pass
-                # because we want all messages generated
-                # to be linked to the action
-                if updateIndex:
-                    updateIndex = False
-                    self._last_action_msg_id = len(self.messages)
-                # if we have more messages send ' ' and repeat
-                done = not self._more_message_exists()
-                if not done:
-                    self._send_command_helper(' ')
-
-    def _check_main_screen(self):
-        name = self.terminal.get_text(37, 0, len(self.user_name), 1, False)
+            self._refresh_main()
+            self._read_messages(True)
+            # if we have more messages send ' ' and repeat
+            while self._more_message_exists():
+                if self.metrics is not None:
+                    self.metrics.moreMessages += 1
+                self._send_command_helper(' ')
+                self._refresh_main()
+                self._read_messages(False)
+
+    def _read_messages(self, newAction):
+        # one pass over the message lines currently on screen
+        # only the first pass starts a new action, because we want all
+        # messages generated to be linked to the action
+        if newAction:
+            self.messages.start_action(self.current_turn())
+        # a command that opened a menu leaves self.screen at MAIN, but what
+        # is drawn over the message area then isn't messages
+        if not self._check_main_screen():
+            return
+        lines = []
+        for i in range(Client._message_line_start,
+                       Client._message_line_end + 1):
+            msg = self.terminal.get_row(i).strip()
+            if len(msg):
+                lines.append(msg)
+
+        # the message area scrolls, so the lines we already have are the
+        # ones at its top: find the longest run of them ending our history
+        recent = self.messages.tail(len(lines))
+        known = 0
+        for k in range(min(len(lines), len(recent)), 0, -1):
+            if lines[:k] == recent[-k:]:
+                known = k
+                break
+
+        for msg in lines[known:]:
+            self.messages.append(msg)
+            for section in self._message_watchers:
+                section.note_message(msg)
+
+    def _check_main_screen(self, terminal=None):
+        terminal = terminal or self.terminal
+        name = terminal.get_text(37, 0, len(self.user_name), 1, False)
         return name == self.user_name
 
     def quit(self):
         # TODO:support actually saving/quitting based on a parameter
         self.conn.disconnect()
+        self.messages.close()
 
-    def update(self):
+    @timed('client', call=True)
+    def update(self, pipelined=False, screens=None):
         # go through each screen type, and update each parser with that screen
         # at the end, if everything completed properly, mark data as 'fresh'
+        # screens limits this to some of them (main is always read first)
+        if pipelined and screens is None:
+            return self._update_pipelined()
         result = True
 
         # if at any point a transition fails, stop trying to update
         # do not update data freshness
-        for s in Screens:
+        for s in self._update_order(screens):
             result = result and self.set_screen(s)
             if result:
-                self.player.update(s, self.terminal)
-                self.inventory.update(s, self.terminal)
-                self.map.update(s, self.terminal)
-                self.spells.update(s, self.terminal)
-                self.abilities.update(s, self.terminal)
-
-        self.fresh = result
+                self._parse_screen(s)
+                while self._more_pages(s):
+                    self._send_command_helper(Client._next_page_key)
+                    self._parse_screen(s)
+
+        return self._finish_update(result)
+
+    def _finish_update(self, result):
+        # shared with AsyncClient, like the helpers below: the steps of an
+        # update that don't talk to crawl
+        self.fresh = result and not any(
+            self.is_stale(name) for name in Client._section_screens)
         return result
 
+    def _update_order(self, screens):
+        if screens is None:
+            # every screen, but the ones only read by sections that are
+            # still valid (spells, abilities, religion and the inventory
+            # rarely change, and say so when they do)
+            return [s for s in Screens if self._needs_reading(s)]
+        # the turn comes from the main screen, so read it first
+        screens = set(screens)
+        screens.add(Screens.MAIN)
+        return [s for s in Screens if s in screens]
+
+    def _update_pipelined(self):
+        # the same sweep as update, but every screen key (each followed by
+        # ESC back to main) is sent at once and the output read in one go
+        # crawl clears the screen before drawing each of them, so a snapshot
+        # is taken at every clear, and matched up with the planned screens
+        # if that doesn't line up, fall back to the one at a time update
+        if not self.set_screen(Screens.MAIN):
+            self.fresh = False
+            return False
+        plan, keys, snapshots = self._start_pipeline()
+        try:
+            self._send_keys_helper(keys)
+            # crawl may still be working through the keys, so keep reading
+            # until every screen was drawn, or it stops sending anything
+            while len(snapshots) < 2 * len(plan):
+                version = self.terminal.version
+                self._get_output_helper()
+                if self.terminal.version == version:
+                    break
+        finally:
+            self._end_pipeline(snapshots)
+
+        paged = self._pipeline_paged(plan, snapshots)
+        if paged is None:
+            if not self._check_main_screen():
+                self.send_command('\x1b')
+            self.screen = Screens.MAIN
+            return self.update()
+        if paged:
+            return self.update(screens=paged)
+        return True
+
+    def _start_pipeline(self):
+        # parse the main screen, and take a snapshot at every clear from
+        # here on, until _end_pipeline
+        self._parse_screen(Screens.MAIN)
+        plan, keys = self._pipeline_plan()
+        snapshots = []
+        self.terminal.clearListener = \
+            lambda terminal: snapshots.append(terminal.snapshot())
+        return plan, keys, snapshots
+
+    def _end_pipeline(self, snapshots):
+        self.terminal.clearListener = None
+        snapshots.append(self.terminal.snapshot())
+
+    def _pipeline_paged(self, plan, snapshots):
+        # the screens with more pages to read, or None if the snapshots
+        # didn't line up and the update has to be done screen by screen
+        if not self._apply_pipeline(plan, snapshots):
+            log.info("pipelined update didn't line up, "
+                     "updating screen by screen")
+            return None
+        # only the first page of each screen was drawn
+        paged = [s for s in plan if self._more_pages(s)]
+        if not paged:
+            self.fresh = True
+        return paged
+
+    def _needs_reading(self, screenType):
+        names = [name for name, screens in Client._section_screens.items()
+                 if screenType in screens]
+        if not names:
+            return True
+        return any(self.is_stale(name)
+                   or not hasattr(self._sections[name], 'invalidated')
+                   for name in names)
+
+    def _pipeline_plan(self):
+        # a screen that was empty is opened again once its section goes
+        # stale, e.g. a spell was learnt since
+        self._empty_screens = {s for s in self._empty_screens
+                               if not self._needs_reading(s)}
+        plan = [s for s in self._update_order(None)
+                if s != Screens.MAIN and s not in self._empty_screens]
+        keys = []
+        for s in plan:
+            keys.append(self._screen_key(s))
+            keys.append('\x1b')
+        return plan, keys
+
+    def _apply_pipeline(self, plan, snapshots):
+        # the first snapshot is the main screen from before the first key
+        # after it, each screen and the main screen it returned to
+        frames = snapshots[1:]
+        if len(frames) != 2 * len(plan):
+            return False
+        for i in range(len(plan)):
+            if self._check_main_screen(frames[2 * i]) or \
+                    not self._check_main_screen(frames[2 * i + 1]):
+                return False
+        for i, s in enumerate(plan):
+            self._parse_screen(s, frames[2 * i])
+        self._parse_screen(Screens.MAIN)
+        return True
+
+    def _more_pages(self, screenType):
+        # whether a section read from this screen is waiting on more pages
+        return any(getattr(self._sections[name], 'more_pages', False)
+                   for name, screens in Client._section_screens.items()
+                   if screenType in screens)
+
+    @timed('parse')
+    def _parse_screen(self, screenType, terminal=None):
+        terminal = terminal or self.terminal
+        # a screen that only brought up a message has nothing to read
+        screen = None if screenType in self._empty_screens else terminal
+        for section in self._sections.values():
+            section.update(screenType, screen)
+        if screenType == Screens.MAIN:
+            stats = self._sections['player'].stats
+            for section in self._player_watchers:
+                section.note_player(stats)
+        self._screen_stamps[screenType] = (
+            self.current_turn(), terminal.version)
+
+    @timed('client', call=True)
     def set_screen(self, screenType):
         result = True
         if self.screen == screenType:
@@ -180,29 +567,20 @@ class Client:
                 result = self.set_screen(Screens.MAIN)
             # ensure transition was successful (if needed)
             if result:
-                if screenType == Screens.SKILLS:
-                    self.send_command('m')
-                elif screenType == Screens.INVENTORY:
-                    self.send_command('i')
-                elif screenType == Screens.CHARACTER:
-                    self.send_command('%')
-                elif screenType == Screens.DUNGEON:
-                    self.send_command('\x0f')
-                elif screenType == Screens.SPELLS:
-                    self.send_command('I')
-                elif screenType == Screens.RELIGION:
-                    self.send_command('^')
-                elif screenType == Screens.ABILITIES:
-                    self.send_command('a')
-                else:
-                    raise Exception(
-                        'Unrecognized screen type: ' +
-                        str(screenType))
+                self.send_command(self._screen_key(screenType))
                 # being on the main screen is a precondition for getting here
                 # so, if we are not on the main screen after this command
                 # the screen transition was successful
                 result = not self._check_main_screen()
 
+        return self._finish_transition(screenType, result)
+
+    def _screen_key(self, screenType):
+        if screenType not in Client._screen_keys:
+            raise Exception('Unrecognized screen type: ' + str(screenType))
+        return Client._screen_keys[screenType]
+
+    def _finish_transition(self, screenType, result):
         if result:
             self.screen = screenType
 
@@ -211,15 +589,15 @@ class Client:
         # we just get a log message instead
         # however, we want this after the screenType update
         # because they're still on the main screen
-        if screenType == Screens.SPELLS:
-            if self._get_latest_message() == Client._no_spells:
-                result = True
-        elif screenType == Screens.RELIGION:
-            if self._get_latest_message() == Client._no_religion:
-                result = True
-        elif screenType == Screens.ABILITIES:
-            if self._get_latest_message() == Client._no_abilities:
+        # (an older copy of the message may still be the latest one when
+        # the screen did open, so only look at it if it didn't)
+        if screenType in Client._empty_screen_messages:
+            if not result and self._get_latest_message() == \
+                    Client._empty_screen_messages[screenType]:
                 result = True
+                self._empty_screens.add(screenType)
+            else:
+                self._empty_screens.discard(screenType)
 
         return result
 
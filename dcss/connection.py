@@ -1,41 +1,84 @@
-import paramiko
 import time
-import pexpect
 import datetime
+import codecs
 import logging
+import re
+import selectors
+
+from . import backends, trace
+from .stats import LatencyStats
+from .ttyrec import TtyrecWriter, read_ttyrec, recorded
 
 log = logging.getLogger(__name__)
 
 SPLITTER = '`~`'
 COMMAND = 'BOT_CMD:'
 UTF8 = 'utf-8'
+# crawl is waiting on a keypress once one of these shows up
+PROMPT_MARKERS = [re.compile('--more--')]
+# how much recent output is searched for prompt markers
+MARKER_WINDOW = 256
 
 
 class LocalConnection():
 
-    def __init__(self, playerName):
+    def __init__(self, playerName, quiescenceMs=None, promptMarkers=None,
+                 recordPath=None, command='crawl', args=()):
         self.isWaitingForResponse = False
         self.process = None
+        # the program to run, e.g. sys.executable with
+        # ['-m', 'dcss.fakecrawl'] to play against the stand-in
+        self.command = command
+        self.args = list(args)
         self.delay = 0.25
         self.validConnection = False
         self.lastOutput = ''
         self.playerName = playerName
+        # if set, output is handed to this callable as soon as it arrives
+        # (e.g. TerminalBuffer.input) instead of being collected
+        self.outputListener = None
+
+        # if set, a response is complete once crawl has been quiet
+        # for this many milliseconds (or printed a prompt marker),
+        # instead of sleeping for delay and waiting out two expect timeouts
+        self.quiescenceMs = quiescenceMs
+        if promptMarkers is None:
+            promptMarkers = PROMPT_MARKERS
+        self.promptMarkers = promptMarkers
+        # the longest to wait for a response to start, in seconds
+        self.responseTimeout = 1.0
+        # loading or creating a game can take a while
+        self.startupTimeout = 10.0
+        self.bufferSize = 4096
+        # timings of send_command, and of the first output after sending
+        self.responseStats = LatencyStats()
+        self.firstByteStats = LatencyStats()
+        self._decoder = codecs.getincrementaldecoder(UTF8)('replace')
+        self._sentAt = None
+        # if set, everything read is also written to this ttyrec file
+        self.recorder = None if recordPath is None else \
+            TtyrecWriter(recordPath)
 
     def connect(self):
+        pexpect = backends.require('pty')
         self.process = pexpect.spawn(
-            "crawl",
+            self.command, self.args,
             timeout=self.delay)
+        if self.quiescenceMs is not None:
+            # pexpect sleeps 50ms before every send by default
+            self.process.delaybeforesend = None
         self.validConnection = self.process.isalive()
-        log.info("LocalConnection connected:" + str(self.validConnection))
+        log.info("LocalConnection connected: %s", self.validConnection)
         return self.validConnection
 
+    @recorded
     def crawl_login(self):
         # 'logging in' in this case is typing out the player's name
         # and either starting a new game, or loading the old one
-        log.info("LocalConnection logging in with name: " + self.playerName)
+        log.info("LocalConnection logging in with name: %s", self.playerName)
 
         # get_output ensures the program has fully loaded before continuing
-        self.get_output()
+        self.get_output(self.startupTimeout)
         self.send_command(self.playerName, True)
 
         # workaround for a weird bug?
@@ -45,38 +88,118 @@ class LocalConnection():
 
     def disconnect(self):
         self.process.terminate()
+        if self.recorder is not None:
+            self.recorder.close()
         self.validConnection = False
         log.info("LocalConnection disconnecting")
 
-    def get_output(self):
+    @recorded
+    def get_output(self, timeout=None):
+        if self.quiescenceMs is not None:
+            return self._read_until_idle(timeout or self.responseTimeout)
+
         done = False
         onceMore = True
         output = ''
+        # bytes read
+        size = 0
         while not done:
-            match = self.process.expect(['\\x1b\[40m', pexpect.TIMEOUT])
+            match = self.process.expect(
+                ['\\x1b\[40m', backends.require('pty').TIMEOUT])
             if match == 0:
                 buf = self.process.before
+                raw = buf if isinstance(buf, bytes) else buf.encode(UTF8)
+                if self.recorder is not None:
+                    self.recorder.write(raw)
+                trace.raw(raw)
+                size += len(raw)
                 if isinstance(buf, bytes):
                     buf = buf.decode()
-                output += buf
+                if self.outputListener:
+                    self.outputListener(buf)
+                    self.lastOutput = buf
+                else:
+                    output += buf
                 onceMore = True
             elif match == 1:
                 if not onceMore:
                     done = True
                 else:
                     onceMore = False
-        self.lastOutput = output
-        log.debug("LocalConnection received: " + repr(self.lastOutput))
+        if not self.outputListener:
+            self.lastOutput = output
+        log.debug("LocalConnection received %d bytes", size)
         return output
 
+    def _read_until_idle(self, timeout):
+        # read whatever crawl prints until it goes quiet
+        # waits up to timeout for output to start, then quiescenceMs
+        # between reads, and stops early after a prompt marker
+        pexpect = backends.require('pty')
+        start = time.monotonic()
+        deadline = start + timeout
+        idle = self.quiescenceMs / 1000.0
+        output = ''
+        # bytes read
+        size = 0
+        tail = ''
+        received = False
+
+        # anything a previous expect() read but didn't consume
+        pending = self.process.buffer
+        if pending:
+            self.process.buffer = pending[:0]
+        while True:
+            if not pending:
+                now = time.monotonic()
+                wait = idle if received else deadline - now
+                if wait < 0:
+                    break
+                try:
+                    pending = self.process.read_nonblocking(
+                        self.bufferSize, wait)
+                except (pexpect.TIMEOUT, pexpect.EOF):
+                    break
+            raw = pending if isinstance(pending, bytes) \
+                else pending.encode(UTF8)
+            if self.recorder is not None:
+                self.recorder.write(raw)
+            trace.raw(raw)
+            size += len(raw)
+            if isinstance(pending, bytes):
+                data = self._decoder.decode(pending)
+            else:
+                data = pending
+            pending = None
+            if not received:
+                received = True
+                self.firstByteStats.add(
+                    time.monotonic() - self._sentAt if self._sentAt
+                    else time.monotonic() - start)
+            if self.outputListener:
+                self.outputListener(data)
+                self.lastOutput = data
+            else:
+                output += data
+
+            # crawl won't print anything else until a key is pressed
+            tail = (tail + data)[-MARKER_WINDOW:]
+            if any(m.search(tail) for m in self.promptMarkers):
+                idle = 0
+                tail = ''
+
+        if not self.outputListener:
+            self.lastOutput = output
+        log.debug("LocalConnection received %d bytes", size)
+        return output
+
+    @recorded
     def send_command(self, command, addNewline=False):
         newlineLog = ""
         if addNewline:
             newlineLog = "\\r"
-        log.debug(
-            "LocalConnection sending command: " +
-            repr(command) +
-            newlineLog)
+        log.debug("LocalConnection sending command: %r%s", command, newlineLog)
+        self._sentAt = time.monotonic()
         if(command):
             self.isWaitingForResponse = True
             self.process.send(command)
@@ -84,19 +207,56 @@ class LocalConnection():
         if(addNewline):
             self.isWaitingForResponse = True
             self.process.send("\r")
-        time.sleep(self.delay)
+        if self.quiescenceMs is None:
+            time.sleep(self.delay)
 
-        return self.get_output()
+        output = self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    @recorded
+    def send_keys(self, keys, gap=0.0):
+        # send several keypresses, then read the output of all of them
+        # as one response. curses reads ESC and a key right after it as
+        # one alt-key press, so pause gap seconds after each ESC
+        log.debug("LocalConnection sending keys: %r", keys)
+        self._sentAt = time.monotonic()
+        for i, key in enumerate(keys):
+            if i and gap and keys[i - 1] == '\x1b':
+                time.sleep(gap)
+            self.isWaitingForResponse = True
+            self.process.send(key)
+        if self.quiescenceMs is None:
+            time.sleep(self.delay)
+
+        output = self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    def stats(self):
+        return {
+            'response': self.responseStats.as_dict(),
+            'first_byte': self.firstByteStats.as_dict(),
+        }
 
 
 class RemoteConnection():
 
-    def __init__(self, crawlLoginName, crawlLoginPassword):
+    def __init__(self, crawlLoginName, crawlLoginPassword,
+                 promptMarkers=None, recordPath=None,
+                 host="crawl.akrasiac.org", port=22, pool=None):
         super().__init__()
         self.isWaitingForResponse = False
-        self.connectionString = "crawl.akrasiac.org"
+        self.connectionString = host
+        self.port = port
+        # a TransportPool, to open the channel on an ssh connection shared
+        # with other games on the same server
+        self.pool = pool
         self.sshUsername = "joshua"
         self.sshPassword = "joshua"
+        # the longest the connection stays idle before a response is over
         self.delay = 0.5
         self.username = crawlLoginName
         self.password = crawlLoginPassword
@@ -105,20 +265,58 @@ class RemoteConnection():
         self.bufferSize = 4096
         self.validConnection = False
         self.lastOutput = ''
+        # if set, output is handed to this callable as soon as it arrives
+        # (e.g. TerminalBuffer.input) instead of being collected
+        self.outputListener = None
+        # recv can split a multi-byte character across two reads
+        self._decoder = codecs.getincrementaldecoder(UTF8)('replace')
+
+        # a response is over once the channel has been idle for longer
+        # than the usual gap between chunks of output plus idleFactor
+        # times its deviation (kept between minIdle and delay),
+        # or once it printed a prompt marker
+        self.idleFactor = 4.0
+        self.minIdle = 0.03
+        if promptMarkers is None:
+            promptMarkers = PROMPT_MARKERS
+        self.promptMarkers = promptMarkers
+        # the longest to wait for a response to start, in seconds
+        self.responseTimeout = 5.0
+        # timings of send_command, of the first output after sending,
+        # and of the gaps between chunks of one response
+        self.responseStats = LatencyStats()
+        self.firstByteStats = LatencyStats()
+        self.gapStats = LatencyStats()
+        self._selector = None
+        self._sentAt = None
+        # if set, everything read is also written to this ttyrec file
+        self.recorder = None if recordPath is None else \
+            TtyrecWriter(recordPath)
 
     def connect(self):
-        self.sshClient = paramiko.SSHClient()
-        self.sshClient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.sshClient.connect(
-            self.connectionString,
-            username=self.sshUsername,
-            password=self.sshPassword)
-        self.sshChannel = self.sshClient.invoke_shell()
+        if self.pool is not None:
+            self.sshChannel = self.pool.open_channel(
+                self.connectionString, self.port,
+                self.sshUsername, self.sshPassword)
+        else:
+            paramiko = backends.require('ssh')
+            self.sshClient = paramiko.SSHClient()
+            self.sshClient.set_missing_host_key_policy(
+                paramiko.AutoAddPolicy())
+            self.sshClient.connect(
+                self.connectionString,
+                port=self.port,
+                username=self.sshUsername,
+                password=self.sshPassword)
+            self.sshChannel = self.sshClient.invoke_shell()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sshChannel, selectors.EVENT_READ)
         # TODO:figure a way to verify connecting was successful
         self.validConnection = True
-        log.info("RemoteConnection connected: " + str(self.validConnection))
+        log.info("RemoteConnection connected: %s", self.validConnection)
         return self.validConnection
 
+    @recorded
     def crawl_login(self):
         # navigate the crawl login commands
         self.send_command('L', False)
@@ -131,34 +329,248 @@ class RemoteConnection():
         return result
 
     def disconnect(self):
-        if self.sshClient:
-            self.sshClient.close()
+        self._close_channel()
+        if self.recorder is not None:
+            self.recorder.close()
         self.validConnection = False
         log.info("RemoteConnection disconnected")
 
-    def get_output(self):
+    def reconnect(self):
+        # a new channel (on the same transport, if pooled) and log in
+        # again, e.g. after the server closed the channel
+        self._close_channel()
+        self._decoder.reset()
+        self.connect()
+        return self.crawl_login()
+
+    def _close_channel(self):
+        if self._selector:
+            self._selector.close()
+            self._selector = None
+        if self.pool is not None and self.sshChannel is not None:
+            self.pool.release(self.sshChannel)
+        elif self.sshClient:
+            self.sshClient.close()
+        self.sshChannel = None
+        self.sshClient = None
+
+    def idle_timeout(self):
+        # adapts to how the server paces its output
+        return self.gapStats.adaptive_timeout(
+            self.idleFactor, self.minIdle, self.delay)
+
+    @recorded
+    def get_output(self, timeout=None):
+        # wait up to timeout for output to start, then read until
+        # the channel goes idle or a prompt marker shows up
+        start = time.monotonic()
+        deadline = start + (timeout or self.responseTimeout)
         output = ''
-        while(self.sshChannel.recv_ready()):
-            if(self.isWaitingForResponse):
-                self.isWaitingForResponse = False
-            buffer = self.sshChannel.recv(self.bufferSize)
-            if(len(buffer) != 0):
-                output += buffer.decode(UTF8)
-        self.lastOutput = output
-        log.debug("RemoteConnection received: " + repr(self.lastOutput))
+        # bytes read
+        size = 0
+        tail = ''
+        lastChunk = None
+        done = False
+        while not done:
+            now = time.monotonic()
+            if lastChunk is None:
+                wait = deadline - now
+            else:
+                wait = min(self.idle_timeout(), deadline - now)
+            if wait < 0 or not self._selector.select(wait):
+                break
+
+            while self.sshChannel.recv_ready():
+                if(self.isWaitingForResponse):
+                    self.isWaitingForResponse = False
+                buffer = self.sshChannel.recv(self.bufferSize)
+                if(len(buffer) == 0):
+                    break
+                now = time.monotonic()
+                if lastChunk is None:
+                    self.firstByteStats.add(now - (self._sentAt or start))
+                else:
+                    self.gapStats.add(now - lastChunk)
+                lastChunk = now
+
+                if self.recorder is not None:
+                    self.recorder.write(buffer)
+                trace.raw(buffer)
+                size += len(buffer)
+                data = self._decoder.decode(buffer)
+                if self.outputListener:
+                    self.outputListener(data)
+                    self.lastOutput = data
+                else:
+                    output += data
+
+                # crawl won't print anything else until a key is pressed
+                tail = (tail + data)[-MARKER_WINDOW:]
+                if any(m.search(tail) for m in self.promptMarkers):
+                    done = True
+
+            # the channel was closed from the other side
+            if self.sshChannel.closed or (
+                    self.sshChannel.eof_received and
+                    not self.sshChannel.recv_ready()):
+                break
+
+        if not self.outputListener:
+            self.lastOutput = output
+        log.debug("RemoteConnection received %d bytes", size)
         return output
 
+    @recorded
     def send_command(self, command, addNewline):
-        log.debug("RemoteConnection sending command: " + str(command))
+        log.debug("RemoteConnection sending command: %r", command)
+        self._sentAt = time.monotonic()
+        # the newline goes with the command: waiting for the echo first
+        # would wait out responseTimeout where nothing is echoed, like
+        # at the password prompt
+        if(addNewline):
+            command += '\n'
         if(command):
             self.isWaitingForResponse = True
-            self.sshChannel.send(command)
-            time.sleep(self.delay)
+            self.sshChannel.sendall(command)
 
-        if(addNewline):
+        output = self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    @recorded
+    def send_keys(self, keys, gap=0.0):
+        # send several keypresses, then read the output of all of them
+        # as one response. curses reads ESC and a key right after it as
+        # one alt-key press, so pause gap seconds after each ESC
+        log.debug("RemoteConnection sending keys: %r", keys)
+        self._sentAt = time.monotonic()
+        for i, key in enumerate(keys):
+            if i and gap and keys[i - 1] == '\x1b':
+                time.sleep(gap)
             self.isWaitingForResponse = True
-            self.get_output()
-            self.sshChannel.send('\n')
-            time.sleep(self.delay)
+            self.sshChannel.sendall(key)
+
+        output = self.get_output()
+        self.responseStats.add(time.monotonic() - self._sentAt)
+        self._sentAt = None
+        return output
+
+    def stats(self):
+        return {
+            'response': self.responseStats.as_dict(),
+            'first_byte': self.firstByteStats.as_dict(),
+            'gap': self.gapStats.as_dict(),
+            'idle_timeout': self.idle_timeout(),
+        }
 
+
+class ReplayConnection():
+    # plays back a ttyrec recording in place of a game, with the same
+    # interface as the connections above, to rerun the parsers offline
+    # each call that reads a response gets the next one recorded (the
+    # recorder marks where they end); a recording without those marks,
+    # e.g. one from a public server, is handed back a record at a time
+    # speed None replays as fast as possible, 1.0 at the pace it was
+    # recorded at, 2.0 twice as fast...
+
+    def __init__(self, path, speed=None, playerName=None):
+        self.path = path
+        self.speed = speed
+        self.playerName = playerName
+        self.isWaitingForResponse = False
+        self.validConnection = False
+        self.lastOutput = ''
+        # if set, output is handed to this callable as soon as it is read
+        # (e.g. TerminalBuffer.input) instead of being collected
+        self.outputListener = None
+        # never set, replays aren't recorded again
+        self.recorder = None
+        self.responseStats = LatencyStats()
+        self._decoder = codecs.getincrementaldecoder(UTF8)('replace')
+        self._frames = []
+        self._position = 0
+        self._marked = False
+        # wall clock time the recording's first frame is played at
+        self._start = None
+
+    def connect(self):
+        self._frames = read_ttyrec(self.path)
+        self._position = 0
+        self._marked = any(not f.data for f in self._frames)
+        self._start = None
+        self.validConnection = True
+        log.info("ReplayConnection opened %s (%d records)",
+                 self.path, len(self._frames))
+        return self.validConnection
+
+    def crawl_login(self):
+        return self.get_output()
+
+    def disconnect(self):
+        self.validConnection = False
+        log.info("ReplayConnection closed")
+
+    @property
+    def finished(self):
+        return self._position >= len(self._frames)
+
+    def get_output(self, timeout=None):
+        # the next response, or '' once the recording is over
+        started = time.monotonic()
+        output = []
+        while self._position < len(self._frames):
+            frame = self._frames[self._position]
+            self._position += 1
+            if not frame.data:
+                break
+            self._play(frame, output)
+            if not self._marked:
+                break
+        output = "".join(output)
+        if not self.outputListener:
+            self.lastOutput = output
+        self.responseStats.add(time.monotonic() - started)
+        return output
+
+    def replay(self):
+        # everything left in the recording, as one response
+        output = []
+        while self._position < len(self._frames):
+            frame = self._frames[self._position]
+            self._position += 1
+            if frame.data:
+                self._play(frame, output)
+        output = "".join(output)
+        if not self.outputListener:
+            self.lastOutput = output
+        return output
+
+    def _play(self, frame, output):
+        if self.speed:
+            if self._start is None:
+                self._start = time.monotonic() - frame.time / self.speed
+            wait = self._start + frame.time / self.speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        data = self._decoder.decode(frame.data)
+        if self.outputListener:
+            self.outputListener(data)
+            self.lastOutput = data
+        else:
+            output.append(data)
+
+    def send_command(self, command, addNewline=False):
+        log.debug("ReplayConnection ignoring command: %r", command)
+        return self.get_output()
+
+    def send_keys(self, keys, gap=0.0):
+        log.debug("ReplayConnection ignoring keys: %r", keys)
         return self.get_output()
+
+    def stats(self):
+        return {
+            'response': self.responseStats.as_dict(),
+            'position': self._position,
+            'records': len(self._frames),
+        }
@@ -0,0 +1,481 @@
+# a stand-in for crawl, to test and time the connections and the client
+# without the game: it draws crawl-like screens (a level to walk around,
+# the sidebar, messages and the menus the client reads) in answer to
+# each key, after a configurable delay, in chunks, with --more-- chains
+# run it on a terminal for LocalConnection:
+#   python -m dcss.fakecrawl [--delay S] [--jitter S] [--chunk-size N] ...
+# or serve it over ssh for RemoteConnection with FakeCrawlServer
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import tty
+
+from . import backends
+
+# the main screen layout, as in player.py and map.py
+_VIEW_WIDTH = 33
+_VIEW_HEIGHT = 17
+_SIDEBAR_X = 37
+_COLUMN_X = 55
+_MESSAGE_TOP = 17
+_MESSAGE_BOT = 22
+_MORE_ROW = 23
+_LEVEL_WIDTH = 80
+_LEVEL_HEIGHT = 70
+
+_moves = {
+    'h': (0, -1), 'j': (1, 0), 'k': (-1, 0), 'l': (0, 1),
+    'y': (-1, -1), 'u': (-1, 1), 'b': (1, -1), 'n': (1, 1),
+}
+_colors = {'#': 33, '.': 37, '~': 34, '+': 33, '>': 37, '<': 37,
+           '$': 33, ')': 36, '[': 36, '!': 35, '?': 37, '%': 31}
+_messages = [
+    "You hit the goblin.", "The goblin hits you!", "You miss the jackal.",
+    "The jackal bites you.", "You hear a distant noise.",
+    "You see here 3 stones.", "There is an open door here.",
+    "You kill the goblin!", "The kobold shouts!",
+]
+
+_menus = {
+    'i': ["Inventory: 3/52 slots",
+          "Hand Weapons",
+          " a - a +0 hand axe (weapon)",
+          "Missiles",
+          " c - 3 stones (quivered)",
+          "Potions",
+          " d - 2 potions of curing"],
+    'I': ["Your Spells                      Type          Power      "
+          "Failure  Level",
+          " a - Magic Dart                   Conj          ####....   "
+          "3%       1"],
+    'a': ["Ability - do what?                  Cost                    "
+          "Failure",
+          " a - Berserk                        None                    "
+          "0%"],
+    '^': ["Trog the Angry",
+          "Piety: ***...",
+          "Trog likes it when you kill living beings."],
+    'm': ["Skills (level, training)",
+          " a + Fighting      3.0",
+          " b + Axes          4.0"],
+    '%': ["Character overview",
+          "Health: 40/40   AC:  5   Str: 21"],
+    '\x0f': ["Overview of the Dungeon",
+             "Dungeon (1-2/15)"],
+}
+# what crawl says instead of these menus when they'd be empty
+_empty = {
+    'I': "You don't know any spells.",
+    'a': "Sorry, you're not good enough to have a special ability.",
+    '^': "You are not religious.",
+}
+
+
+def _goto(row, col):
+    return "\x1b[{};{}H".format(row + 1, col + 1)
+
+
+def _sgr(color):
+    return "\x1b[0;{}m".format(color)
+
+
+class FakeCrawl():
+    # the game: turns keys into the text crawl would draw
+    # delay is how long a response takes to start, plus or minus up to
+    # jitter; it is sent in chunks of chunkSize bytes (all at once if
+    # None) chunkGap apart. after a move, moreChance is the chance of a
+    # --more-- chain of moreLength pages (a (least, most) range)
+    # emptyMenus are keys like 'I' that only print crawl's message
+
+    def __init__(self, name=None, seed=0, delay=0.02, jitter=0.0,
+                 chunkSize=None, chunkGap=0.0, moreChance=0.0,
+                 moreLength=(2, 4), emptyMenus=()):
+        self.name = name
+        self.delay = delay
+        self.jitter = jitter
+        self.chunkSize = chunkSize
+        self.chunkGap = chunkGap
+        self.moreChance = moreChance
+        self.moreLength = moreLength
+        self.emptyMenus = set(emptyMenus)
+        self._rng = random.Random(seed)
+        self.turn = 0
+        self.health = 40
+        self._level = self._make_level()
+        self.player = (_LEVEL_HEIGHT // 2, _LEVEL_WIDTH // 2)
+        self._level[self.player[0]][self.player[1]] = '.'
+        # the menu being shown, or None on the main screen
+        self._menu = None
+        # --more-- pages still to show
+        self._pages = []
+
+    def _make_level(self):
+        rng = self._rng
+        level = [['#'] * _LEVEL_WIDTH for _ in range(_LEVEL_HEIGHT)]
+        for _ in range(60):
+            y = rng.randint(1, _LEVEL_HEIGHT - 10)
+            x = rng.randint(1, _LEVEL_WIDTH - 15)
+            for row in level[y:y + rng.randint(3, 9)]:
+                for col in range(x, x + rng.randint(4, 14)):
+                    row[col] = rng.choice('.......~+$)[!?%')
+        return level
+
+    def wait(self):
+        # seconds to wait before answering
+        return max(0.0, self.delay + self._rng.uniform(-self.jitter,
+                                                       self.jitter))
+
+    def chunks(self, data):
+        if not self.chunkSize:
+            return [data]
+        return [data[i:i + self.chunkSize]
+                for i in range(0, len(data), self.chunkSize)]
+
+    def greeting(self):
+        return "Enter name: "
+
+    def respond(self, key):
+        # the text drawn in answer to key
+        if self._pages:
+            return self._next_page()
+        if self._menu is not None:
+            if key == '\x1b':
+                self._menu = None
+                return self.main_screen()
+            return self._draw_menu(self._menu)
+        if key == '\x12':
+            return self.main_screen()
+        if key in _menus:
+            if key in self.emptyMenus:
+                return self._draw_messages([_empty[key]])
+            self._menu = key
+            return self._draw_menu(key)
+        if key == '\x1b':
+            # nothing to close, crawl just puts the cursor back
+            return _goto(self.player[0], self.player[1])
+        return self._take_turn(key)
+
+    def main_screen(self):
+        out = ["\x1b[H\x1b[2J", self._draw_view(), self._draw_sidebar()]
+        return "".join(out)
+
+    def _take_turn(self, key):
+        self.turn += 1
+        move = _moves.get(key)
+        if move is not None:
+            y, x = self.player[0] + move[0], self.player[1] + move[1]
+            if 0 < y < _LEVEL_HEIGHT - 1 and 0 < x < _LEVEL_WIDTH - 1 and \
+                    self._level[y][x] != '#':
+                self.player = (y, x)
+        self.health = max(1, min(40, self.health
+                                 + self._rng.choice((-2, -1, 0, 1, 1))))
+        out = [self._draw_view(), self._draw_sidebar(rows=(2, 9))]
+        if self._rng.random() < self.moreChance:
+            pages = self._rng.randint(*self.moreLength)
+            self._pages = [self._random_messages(_MESSAGE_BOT -
+                                                 _MESSAGE_TOP + 1)
+                           for _ in range(pages)]
+            out.append(self._next_page())
+        elif self._rng.random() < 0.5:
+            out.append(self._draw_messages(self._random_messages(
+                self._rng.randint(1, 3))))
+        return "".join(out)
+
+    def _random_messages(self, count):
+        return [self._rng.choice(_messages) for _ in range(count)]
+
+    def _next_page(self):
+        out = [_goto(_MORE_ROW, 0), "\x1b[K",
+               self._draw_messages(self._pages.pop(0))]
+        if self._pages:
+            out.append(_goto(_MORE_ROW, 0) + _sgr(37) + "--more--")
+        return "".join(out)
+
+    def _draw_view(self):
+        out = []
+        top = self.player[0] - _VIEW_HEIGHT // 2
+        left = self.player[1] - _VIEW_WIDTH // 2
+        for row in range(_VIEW_HEIGHT):
+            out.append(_goto(row, 0))
+            color = None
+            for col in range(_VIEW_WIDTH):
+                y, x = top + row, left + col
+                if (y, x) == self.player:
+                    glyph = '@'
+                elif 0 <= y < _LEVEL_HEIGHT and 0 <= x < _LEVEL_WIDTH and \
+                        abs(y - self.player[0]) <= 7 and \
+                        abs(x - self.player[1]) <= 12:
+                    glyph = self._level[y][x]
+                else:
+                    glyph = ' '
+                if _colors.get(glyph, 37) != color:
+                    color = _colors.get(glyph, 37)
+                    out.append(_sgr(color))
+                out.append(glyph)
+        return "".join(out)
+
+    def _draw_sidebar(self, rows=(0, 11)):
+        lines = [
+            ("{} the Skirmisher".format(self.name), ""),
+            ("Minotaur Berserker", ""),
+            ("Health: {}/40".format(self.health), "=" * (self.health // 2)),
+            ("Magic: 0/0", ""),
+            ("AC:  5", "Str: 21"),
+            ("EV:  9", "Int: 8"),
+            ("SH:  0", "Dex: 11"),
+            ("XL:  3 Next: 42%", "Place: Dungeon:2"),
+            ("Noise: ---------", "Time: {}.0 (1.0)".format(self.turn * 10)),
+            ("a) +0 hand axe", ""),
+            ("c) 3 stones", ""),
+        ]
+        out = [_sgr(37)]
+        for row in range(*rows):
+            left, right = lines[row]
+            out.append(_goto(row, _SIDEBAR_X))
+            out.append(left.ljust(_COLUMN_X - _SIDEBAR_X) + right)
+            out.append("\x1b[K")
+        return "".join(out)
+
+    def _draw_messages(self, messages):
+        # scroll messages into the message window, like crawl does
+        out = ["\x1b[{};{}r".format(_MESSAGE_TOP + 1, _MESSAGE_BOT + 1),
+               _goto(_MESSAGE_BOT, 0), _sgr(37)]
+        for message in messages:
+            out.append("\r\n_" + message + "\x1b[K")
+        out.append("\x1b[1;{}r".format(_MORE_ROW + 1))
+        return "".join(out)
+
+    def _draw_menu(self, key):
+        return "\x1b[H\x1b[2J" + "\r\n".join(_menus[key])
+
+
+def play(game, read, write):
+    # answer keys from read() (bytes, b'' once closed) with write(bytes)
+    # until the other end goes away
+    while True:
+        keys = read()
+        if not keys:
+            return
+        for key in keys.decode('utf-8', 'replace'):
+            _send(game, game.respond(key), write)
+
+
+def _send(game, text, write):
+    if not text:
+        return
+    time.sleep(game.wait())
+    for i, chunk in enumerate(game.chunks(text.encode('utf-8'))):
+        if i and game.chunkGap:
+            time.sleep(game.chunkGap)
+        write(chunk)
+
+
+def _read_line(read, write=None, echo=False):
+    # a line typed at a prompt, ended by return
+    line = b''
+    while True:
+        data = read()
+        if not data:
+            return None
+        for i in range(len(data)):
+            key = data[i:i + 1]
+            if key in (b'\r', b'\n'):
+                return line.decode('utf-8', 'replace')
+            line += key
+            if echo:
+                write(key)
+
+
+def run_terminal(game):
+    # play on this process's terminal, as crawl does for LocalConnection
+    tty.setraw(0)
+
+    def read():
+        try:
+            return os.read(0, 1024)
+        except OSError:
+            return b''
+
+    def write(data):
+        while data:
+            data = data[os.write(1, data):]
+
+    write(game.greeting().encode('utf-8'))
+    name = _read_line(read)
+    if name is None:
+        return
+    game.name = game.name or name
+    _send(game, game.main_screen(), write)
+    play(game, read, write)
+
+
+def _ssh_server(paramiko):
+    # made once paramiko is loaded, which is only when a server starts
+    class SSHServer(paramiko.ServerInterface):
+        # anyone can log in, like a public server's guest account
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_pty_request(self, *args):
+            return True
+
+        def check_channel_shell_request(self, channel):
+            return True
+    return SSHServer
+
+
+class FakeCrawlServer():
+    # serves FakeCrawl games over ssh, in threads of this process, behind
+    # a dgamelaunch-like menu (L to log in, T for trunk, P to play) like
+    # the one RemoteConnection goes through
+    # gameArgs are keyword arguments for each FakeCrawl
+    # e.g. with FakeCrawlServer(delay=0.05) as server:
+    #          RemoteConnection(name, password, port=server.port, ...)
+
+    # generating a key takes a while, one is enough for every server
+    _hostKey = None
+    _serverClass = None
+
+    def __init__(self, host='127.0.0.1', port=0, **gameArgs):
+        self.host = host
+        self.port = port
+        self.gameArgs = gameArgs
+        self.games = []
+        # ssh connections accepted so far
+        self.connections = 0
+        self._socket = None
+        self._transports = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        paramiko = backends.require('ssh')
+        if FakeCrawlServer._hostKey is None:
+            FakeCrawlServer._hostKey = paramiko.RSAKey.generate(2048)
+            FakeCrawlServer._serverClass = _ssh_server(paramiko)
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(8)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def _accept(self):
+        while self._socket is not None:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(client,),
+                             daemon=True).start()
+
+    def _serve(self, client):
+        paramiko = backends.require('ssh')
+        transport = paramiko.Transport(client)
+        self._transports.append(transport)
+        transport.add_server_key(FakeCrawlServer._hostKey)
+        try:
+            transport.start_server(server=FakeCrawlServer._serverClass())
+        except paramiko.SSHException:
+            return
+        self.connections += 1
+        # a client can play several games over one connection, one
+        # channel each (see TransportPool)
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                threading.Thread(target=self._channel, args=(channel,),
+                                 daemon=True).start()
+
+    def _channel(self, channel):
+        with channel:
+            self._session(channel)
+
+    def _session(self, channel):
+        def read():
+            try:
+                return channel.recv(1024)
+            except (OSError, EOFError):
+                return b''
+
+        def write(data):
+            try:
+                channel.sendall(data)
+            except (OSError, EOFError):
+                pass
+
+        def show(text):
+            write(("\x1b[H\x1b[2J" + text).encode('utf-8'))
+
+        name = None
+        show("## fake crawl server\r\n\r\n L) Login\r\n q) Quit\r\n")
+        while True:
+            key = read()
+            if not key or key[:1] == b'q':
+                return
+            if key[:1] == b'L':
+                show("Please enter your username: ")
+                name = _read_line(read, write, echo=True)
+                show("Please enter your password: ")
+                # like dgamelaunch, the password isn't echoed
+                if name is None or _read_line(read) is None:
+                    return
+                show("Logged in as: {}\r\n\r\n T) Trunk\r\n".format(name))
+            elif key[:1] == b'T' and name is not None:
+                show("Trunk\r\n\r\n P) Play\r\n")
+            elif key[:1] == b'P' and name is not None:
+                break
+        game = FakeCrawl(name, **self.gameArgs)
+        self.games.append(game)
+        _send(game, game.main_screen(), write)
+        play(game, read, write)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="a stand-in for crawl, on this terminal")
+    parser.add_argument('--name', help="the character, instead of asking")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int)
+    parser.add_argument('--chunk-gap', type=float, default=0.0)
+    parser.add_argument('--more-chance', type=float, default=0.0)
+    parser.add_argument('--empty', default='',
+                        help="menu keys that only print a message, e.g. Ia^")
+    args = parser.parse_args()
+    run_terminal(FakeCrawl(
+        args.name, args.seed, args.delay, args.jitter, args.chunk_size,
+        args.chunk_gap, args.more_chance, emptyMenus=args.empty))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
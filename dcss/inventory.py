@@ -1,7 +1,152 @@
+from collections import deque, namedtuple
+import re
+
+from .screens import Screens
+
+# one inventory slot
+# quantity is 1 for 'a'/'an'/'the' items, and equipped is how the item is
+# in use ('weapon', 'worn', 'quivered', 'left hand'...) or None
+Item = namedtuple('Item', ['letter', 'name', 'quantity', 'category',
+                           'equipped'])
+# what changed in one slot; old or new is None if the slot was empty
+InventoryChange = namedtuple('InventoryChange',
+                             ['sequence', 'letter', 'old', 'new'])
+
+# ' a - a +0 hand axe (weapon)', the '-' is '+' or '#' if selected
+_item_line = re.compile(r"\s*([a-zA-Z]) [-+#] (.+?)\s*$")
+_quantity = re.compile(r"(\d+) (.*)")
+_article = re.compile(r"(?:an?|the) (.*)")
+_equipped = re.compile(
+    r"(.*?) \((weapon|worn|quivered|left hand|right hand|around neck|"
+    r"in hand|offhand)\)$")
+# category headings may have a hint after them, spaced off to the right
+_heading = re.compile(r"\s*(\S.*?)(?:\s{2,}.*)?$")
+# the listing continues on another page
+_more = re.compile(r"-more-|--more--")
+
+# messages after which the inventory can't be trusted
+# crawl also shows a slot when something is picked up: 'b - 3 stones'
+_invalidating = re.compile(
+    r"^_?(?:[a-zA-Z] - |You (?:drop|pick up|quaff|read|eat|wield|unwield|"
+    r"put on|take off|remove|are now wearing|throw|shoot|fire|evoke|"
+    r"drink)|.* (?:is|are) destroyed|.* (?:crumbles|evaporates|burns))")
+
+
+def parse_item_line(line, category=None):
+    # an Item from a line of the listing, or None if it isn't one
+    match = _item_line.match(line)
+    if match is None:
+        return None
+    letter, name = match.groups()
+    equipped = None
+    match = _equipped.match(name)
+    if match is not None:
+        name, equipped = match.groups()
+    quantity = 1
+    match = _quantity.match(name)
+    if match is not None:
+        quantity, name = int(match.group(1)), match.group(2)
+    else:
+        match = _article.match(name)
+        if match is not None:
+            name = match.group(1)
+    return Item(letter, name, quantity, category, equipped)
+
 
 class Inventory():
+    # the items on the inventory screen, by letter
+    # the listing may go over several pages; the page after one that said
+    # -more- continues it, and slots only disappear once the last page
+    # was read
+    # changes are kept in a feed, and messages that mean the items may have
+    # changed mark the inventory invalidated until it's read again
+
+    _feedSize = 256
+
     def __init__(self):
+        self.slots = {}
+        self.more_pages = False
+        self.invalidated = True
+        self.sequence = 0
+        self.changes = deque(maxlen=Inventory._feedSize)
+        # functions called with each InventoryChange as it happens
+        self.listeners = []
+        # parsed Items by the line they came from, for the current listing
+        self._lines = {}
+        self._lastLines = {}
+        self._seen = set()
+        self._category = None
         return
 
+    def __getitem__(self, letter):
+        return self.slots[letter]
+
+    def __contains__(self, letter):
+        return letter in self.slots
+
+    def __iter__(self):
+        return iter(self.slots.values())
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, letter, default=None):
+        # letter may be None, e.g. Player.wielded_item with nothing wielded
+        return self.slots.get(letter, default)
+
     def update(self, screenType, screen):
-        pass
+        if screenType == Screens.INVENTORY:
+            self._read_page(screen)
+
+    def note_message(self, message):
+        if _invalidating.match(message):
+            self.invalidated = True
+
+    def changes_since(self, sequence):
+        # changes after sequence, oldest first
+        # (if the feed no longer goes back that far, only what it holds)
+        return [c for c in self.changes if c.sequence > sequence]
+
+    def _read_page(self, terminal):
+        lines = terminal.get_text().split('\n')
+        if not self.more_pages:
+            # a new listing
+            self._lastLines, self._lines = self._lines, {}
+            self._seen = set()
+            self._category = None
+        self.more_pages = False
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            if _more.search(line):
+                self.more_pages = True
+                continue
+            # an unchanged line is the item it was last time
+            item = self._lastLines.get((line, self._category))
+            if item is None:
+                item = parse_item_line(line, self._category)
+            if item is None:
+                self._category = _heading.match(line).group(1)
+                continue
+            self._lines[(line, item.category)] = item
+            self._seen.add(item.letter)
+            self._set_slot(item.letter, item)
+        if not self.more_pages:
+            for letter in set(self.slots) - self._seen:
+                self._set_slot(letter, None)
+            self._lastLines = {}
+            self.invalidated = False
+
+    def _set_slot(self, letter, item):
+        old = self.slots.get(letter)
+        if old == item:
+            return
+        if item is None:
+            del self.slots[letter]
+        else:
+            self.slots[letter] = item
+        self.sequence += 1
+        change = InventoryChange(self.sequence, letter, old, item)
+        self.changes.append(change)
+        for listener in self.listeners:
+            listener(change)
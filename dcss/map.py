@@ -1,7 +1,305 @@
+import logging
+import re
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .cached_section import CachedSection
+from .screens import Screens
+
+log = logging.getLogger(__name__)
+
+# the map viewport in the top left corner of the main screen
+VIEW_WIDTH = 33
+VIEW_HEIGHT = 17
+# crawl levels are at most this big. the viewport is kept centred on the
+# player, so where a level's cells are is only known relative to where we
+# first saw it: each level gets a grid twice the size, with that first view
+# in the middle, so it fits wherever on the level we started
+LEVEL_WIDTH = 80
+LEVEL_HEIGHT = 70
+
+# sidebar rows with the place and the game time (see player.py)
+_place_row, _time_row, _sidebar_right = 7, 8, 55
+
+# glyphs that can't be walked through
+BLOCKING = '#'
+# how far (in cells) the view can have scrolled between two reads, and how
+# many of the cells the two views share must agree to accept a scroll
+_max_scroll = 8
+_min_agreement = 0.8
+# a step in any direction is accepted straight away if it agrees this well
+_near_agreement = 0.95
+
+
+def _codes(glyphs):
+    return np.array([ord(g) for g in glyphs], dtype=np.uint32)
+
+
+class Level():
+    # everything seen of one level, as numpy arrays indexed [y, x]
+    # glyphs holds code points (0 where nothing was seen), attrs ids into
+    # Map.attributes, seen the game time a cell was last seen (NaN if never)
+    # and known whether it was seen at all
+
+    def __init__(self, place):
+        self.place = place
+        shape = (2 * LEVEL_HEIGHT, 2 * LEVEL_WIDTH)
+        self.glyphs = np.zeros(shape, dtype=np.uint32)
+        self.attrs = np.zeros(shape, dtype=np.uint16)
+        self.seen = np.full(shape, np.nan)
+        self.known = np.zeros(shape, dtype=bool)
+        # where the player is, (y, x) on this level's grid
+        self.player = None
+        # where the top left of the viewport was, and what it showed
+        self._origin = None
+        self._view = None
+
+    def find(self, glyphs):
+        # (y, x) of every cell showing one of glyphs, as an (n, 2) array
+        return np.argwhere(np.isin(self.glyphs, _codes(glyphs)))
+
+    def frontier(self, blocking=BLOCKING):
+        # (y, x) of every known cell that can be walked on and has an
+        # unknown neighbour, i.e. where exploring can continue from
+        open_cells = self.known & ~np.isin(self.glyphs, _codes(blocking))
+        unknown = np.pad(~self.known, 1, constant_values=True)
+        edge = (unknown[:-2, 1:-1] | unknown[2:, 1:-1]
+                | unknown[1:-1, :-2] | unknown[1:-1, 2:])
+        return np.argwhere(open_cells & edge)
+
+    def text(self):
+        # the known part of the level as text, mostly for debugging
+        rows, cols = np.nonzero(self.known)
+        if not len(rows):
+            return ""
+        block = self.glyphs[rows.min():rows.max() + 1,
+                            cols.min():cols.max() + 1]
+        block = np.where(block == 0, ord(' '), block)
+        return "\n".join(
+            row.astype('<u4').tobytes().decode('utf-32-le').rstrip()
+            for row in block)
+
+    def _merge(self, view, colors, mask, turn):
+        # copy the viewport cells in mask onto the grid
+        y, x = self._origin
+        top, left = max(0, -y), max(0, -x)
+        bot = min(VIEW_HEIGHT, self.glyphs.shape[0] - y)
+        right = min(VIEW_WIDTH, self.glyphs.shape[1] - x)
+        # blank cells on screen are ones we don't know (any more)
+        mask = mask & (view != ord(' '))
+        mask[:top] = False
+        mask[bot:] = False
+        mask[:, :left] = False
+        mask[:, right:] = False
+        rows, cols = np.nonzero(mask)
+        self.glyphs[rows + y, cols + x] = view[rows, cols]
+        self.attrs[rows + y, cols + x] = colors[rows, cols]
+        self.seen[rows + y, cols + x] = np.nan if turn is None else turn
+        self.known[rows + y, cols + x] = True
+
+    def _find_scroll(self, view):
+        # how far the view scrolled since the last read: the offset where
+        # the two views agree best, the nearest one if several do
+        # most turns move a step at most, so look at those offsets first
+        # None if nothing is good enough (e.g. after a teleport)
+        scroll = self._best_scroll(view, 1, _near_agreement)
+        if scroll is None:
+            scroll = self._best_scroll(view, _max_scroll, _min_agreement)
+        return scroll
+
+    def _best_scroll(self, view, radius, threshold):
+        blank = ord(' ')
+        padded = np.pad(self._view, radius, constant_values=blank)
+        # every offset at once; windows[dy, dx] is the last view moved by
+        # (dy - radius, dx - radius)
+        windows = sliding_window_view(padded, view.shape)
+        score = _agreement(windows, view, blank)
+        best = score.max()
+        if best < threshold:
+            return None
+        dy, dx = np.nonzero(score == best)
+        nearest = np.argmin(np.maximum(abs(dy - radius), abs(dx - radius)))
+        return (int(dy[nearest]) - radius, int(dx[nearest]) - radius)
+
+    def _locate(self, view):
+        # the viewport origin that best matches what was seen here before
+        # or None if nothing does
+        if not self.known.any():
+            return None
+        rows, cols = np.nonzero(self.known)
+        top = max(0, rows.min() - VIEW_HEIGHT + 1)
+        left = max(0, cols.min() - VIEW_WIDTH + 1)
+        region = self.glyphs[top:rows.max() + VIEW_HEIGHT,
+                             left:cols.max() + VIEW_WIDTH]
+        if region.shape[0] < VIEW_HEIGHT or region.shape[1] < VIEW_WIDTH:
+            return None
+        # every placement at once, as an (ny, nx, VIEW_HEIGHT, VIEW_WIDTH)
+        # view onto the grid
+        windows = sliding_window_view(region, view.shape)
+        score = _agreement(windows, view, 0)
+        y, x = np.unravel_index(score.argmax(), score.shape)
+        if score[y, x] <= _min_agreement:
+            return None
+        return (top + int(y), left + int(x))
+
+
+def _agreement(windows, view, unknown):
+    # for each placement in windows, the fraction of cells shown in both
+    # it and view that match (0 if too few are shown to tell)
+    shown = (windows != unknown) & (windows != ord(' ')) & (view != ord(' '))
+    count = np.count_nonzero(shown, axis=(2, 3))
+    agree = np.count_nonzero(shown & (windows == view), axis=(2, 3))
+    return np.where(count >= 16, agree / np.maximum(count, 1), 0.0)
+
 
 class Map():
     def __init__(self):
+        # place (as shown in the sidebar) -> Level
+        self.levels = {}
+        self.level = None
+        # interned SGR sequences, attrs in the levels index into this
+        self.attributes = ['']
+        self._attributeIds = {'': 0}
+        self._colorIds = {}
+        # terminal version the viewport was last read at
+        self._main_version = -1
         return
 
     def update(self, screenType, screen):
-        pass
+        if screenType == Screens.MAIN:
+            self._update_view(screen)
+
+    def _update_view(self, terminal):
+        if terminal.version == self._main_version:
+            return
+        if terminal.version < self._main_version:
+            # versions only go up, so this is a different terminal
+            self._main_version = -1
+            if self.level is not None:
+                self.level._view = None
+        place = terminal.get_row(_place_row)[_sidebar_right:]
+        place = place.split(':', 1)[1].strip() if ':' in place else ''
+        turn = _read_time(terminal)
+
+        view = np.frombuffer(
+            "".join(terminal.get_row(y)[:VIEW_WIDTH]
+                    for y in range(VIEW_HEIGHT)).encode('utf-32-le'),
+            dtype='<u4').reshape(VIEW_HEIGHT, VIEW_WIDTH).astype(np.uint32)
+
+        level = self.levels.get(place)
+        if level is None:
+            level = self.levels[place] = Level(place)
+        if level is not self.level:
+            # a level we left scrolled the view in ways we didn't follow
+            level._view = None
+        self.level = level
+
+        mask = np.ones(view.shape, dtype=bool)
+        if level._view is None:
+            # new, or back on a level: find where we are from what we saw
+            level = self._place_view(level, view)
+        else:
+            changed = self._changed_cells(terminal)
+            if not changed.any():
+                mask = changed
+            else:
+                scroll = level._find_scroll(view)
+                if scroll is None:
+                    log.debug("lost track of the view on %s", place)
+                    level = self._place_view(level, view)
+                elif scroll == (0, 0):
+                    # only merge what was drawn over
+                    mask = changed
+                else:
+                    y, x = level._origin
+                    level._origin = (y + scroll[0], x + scroll[1])
+
+        colors = self._read_colors(terminal, mask)
+        level._merge(view, colors, mask, turn)
+        level._view = view
+        players = np.argwhere(view == ord('@'))
+        if len(players):
+            level.player = (level._origin[0] + int(players[0][0]),
+                            level._origin[1] + int(players[0][1]))
+        self._main_version = terminal.version
+
+    def _changed_cells(self, terminal):
+        # viewport cells drawn over since the last read
+        mask = np.zeros((VIEW_HEIGHT, VIEW_WIDTH), dtype=bool)
+        for x, y, w, h in terminal.changed_regions(self._main_version):
+            mask[y:y + h, x:x + w] = True
+        return mask
+
+    def _place_view(self, level, view):
+        # put the view where it matches the level, or if it matches nowhere
+        # start the level over with the view in the middle
+        origin = level._locate(view)
+        if origin is None:
+            if level.known.any():
+                log.debug("couldn't place the view on %s, starting over",
+                          level.place)
+                level = self.levels[level.place] = self.level = \
+                    Level(level.place)
+            origin = (LEVEL_HEIGHT - VIEW_HEIGHT // 2,
+                      LEVEL_WIDTH - VIEW_WIDTH // 2)
+        level._origin = origin
+        return level
+
+    def _read_colors(self, terminal, mask):
+        # attribute ids of the viewport cells, only filled in where needed
+        colors = np.zeros((VIEW_HEIGHT, VIEW_WIDTH), dtype=np.uint16)
+        rows = np.nonzero(mask.any(axis=1))[0]
+        for y in rows:
+            row = terminal.get_colors(0, int(y), VIEW_WIDTH, 1)[0]
+            # a row only has a handful of different sequences
+            ids = {key: self._intern(color) for key, color in
+                   {id(color): color for color in row}.items()}
+            colors[y] = [ids[id(color)] for color in row]
+        return colors
+
+    def _intern(self, color):
+        # the same sequence object is usually shared by many cells,
+        # so look it up by identity before formatting it
+        # (keeping the object, so its id can't be reused meanwhile)
+        known = self._colorIds.get(id(color))
+        if known is not None and known[0] is color:
+            return known[1]
+        key = '' if color is None else str(color)
+        attr = self._attributeIds.get(key)
+        if attr is None:
+            attr = len(self.attributes)
+            if attr > 0xffff:
+                raise OverflowError("too many distinct attributes")
+            self.attributes.append(key)
+            self._attributeIds[key] = attr
+        if len(self._colorIds) > 4096:
+            self._colorIds.clear()
+        self._colorIds[id(color)] = (color, attr)
+        return attr
+
+
+def _read_time(terminal):
+    time = terminal.get_row(_time_row)[_sidebar_right:]
+    try:
+        return float(time.split(':', 1)[1].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+class Overview(CachedSection):
+    # the dungeon overview (Ctrl-O): branches, and the altars, shops and
+    # portals on each level. it's text with no cells to merge, so just
+    # the lines are kept; it only changes on a new level or a find
+    _screen = Screens.DUNGEON
+    _invalidating = re.compile(r"Found ")
+    _watchedStats = ('place',)
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def _read(self, terminal):
+        self.lines = [] if terminal is None else \
+            [line.rstrip() for line in terminal.get_text().split('\n')
+             if line.strip()]
@@ -0,0 +1,283 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+import io
+import re
+try:
+    from re import _parser as _sre_parse
+except ImportError:
+    # before python 3.11
+    import sre_parse as _sre_parse
+
+# one line of the message log
+# id counts up from 0 over the whole game, action is the id of the command
+# that produced it, and turn the game time (in auts) when it was read
+Message = namedtuple('Message', ['id', 'action', 'turn', 'text'])
+
+# what the search index is made of: runs of word characters
+_words = re.compile(r"\w+")
+
+
+def _required_words(pattern):
+    # the runs of word characters any match of the compiled regex has,
+    # from the literals at its top level; none if it ignores case
+    if pattern.flags & re.IGNORECASE:
+        return []
+    try:
+        parsed = _sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return []
+    runs = [[]]
+    for op, value in parsed:
+        if op == _sre_parse.LITERAL:
+            runs[-1].append(chr(value))
+        elif runs[-1]:
+            runs.append([])
+    return [word for run in runs for word in _words.findall("".join(run))]
+
+
+class MessageLog():
+    # the game's message history, in bounded memory
+    # the newest capacity messages are kept in a ring buffer; older ones are
+    # dropped, or appended to the file at spillPath if one is given
+    # every command is an action, and the messages it produced are a
+    # contiguous run of ids, so looking them up is just slicing the ring
+    # search goes through an index of the words in each message (and where
+    # the spilled ones are in the file) to find which messages to match
+
+    def __init__(self, capacity=2000, spillPath=None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.spillPath = spillPath
+        self._spill = None
+        self._slots = [None] * capacity
+        self._next_id = 0
+        # id of the current action, and the turn it started at
+        self.action = -1
+        self.turn = None
+        # action id -> [first message id, end message id)
+        # only for actions that may still have messages in the ring
+        self._spans = {}
+        self._first_action = 0
+        # set when restoring a snapshot (see snapshot.py): a callable
+        # making (ring, actions) out of the saved columns, which is only
+        # called once one of them is used
+        self._saved = None
+        # word -> ids of the messages with that word, oldest first
+        # without a spill file, the ids of dropped messages are pruned
+        # every capacity messages
+        self._index = {}
+        # where each message spilled by this log starts in the file, from
+        # id _spillBase on; lines that were in the file before _spillStart
+        # aren't indexed, and are always read
+        self._offsets = array('q')
+        self._spillBase = None
+        self._spillStart = None
+
+    @property
+    def _ring(self):
+        if self._saved is not None:
+            self._load_saved()
+        return self._slots
+
+    @property
+    def _actions(self):
+        if self._saved is not None:
+            self._load_saved()
+        return self._spans
+
+    def _defer(self, load):
+        # take the ring and the actions from load() once they're used
+        # what was spilled until now is left out of the index
+        self._saved = load
+        self._index = {}
+        self._offsets = array('q')
+        self._spillBase = None
+        self._spillStart = None if self._spill is None else \
+            self._spill.tell()
+
+    def _load_saved(self):
+        load, self._saved = self._saved, None
+        self._slots, self._spans = load()
+        for message in self:
+            self._index_message(message)
+
+    def __len__(self):
+        return self._next_id - self.oldest_id()
+
+    def __iter__(self):
+        for i in range(self.oldest_id(), self._next_id):
+            yield self._ring[i % self.capacity]
+
+    def oldest_id(self):
+        return max(0, self._next_id - self.capacity)
+
+    def get(self, messageId):
+        # the message with this id, or None if it's no longer in memory
+        if self.oldest_id() <= messageId < self._next_id:
+            return self._ring[messageId % self.capacity]
+        return None
+
+    def latest(self):
+        return self.get(self._next_id - 1)
+
+    def tail(self, count):
+        # the texts of the last count messages, oldest first
+        start = max(self.oldest_id(), self._next_id - count)
+        return [self._ring[i % self.capacity].text
+                for i in range(start, self._next_id)]
+
+    def start_action(self, turn=None):
+        # messages appended from now on belong to a new action
+        self.action += 1
+        self.turn = turn
+        self._actions[self.action] = [self._next_id, self._next_id]
+        self._prune_actions(self.oldest_id())
+        return self.action
+
+    def append(self, text):
+        if self._next_id >= self.capacity:
+            self._evict(self._ring[self._next_id % self.capacity])
+        message = Message(self._next_id, self.action, self.turn, text)
+        self._ring[self._next_id % self.capacity] = message
+        self._index_message(message)
+        self._next_id += 1
+        if self.action in self._actions:
+            self._actions[self.action][1] = self._next_id
+        return message
+
+    def for_action(self, action):
+        # the messages an action produced, as far as they're still in memory
+        span = self._actions.get(action)
+        if span is None:
+            return []
+        start = max(span[0], self.oldest_id())
+        return [self._ring[i % self.capacity] for i in range(start, span[1])]
+
+    def search(self, pattern, spilled=False):
+        # messages containing pattern, a plain string or a compiled regex
+        # oldest first; spilled also searches the messages on disk
+        # each message is matched on its own, so ^ and $ are its ends and
+        # nothing matches across two messages, in memory as on disk
+        if self._saved is not None:
+            self._load_saved()
+        if isinstance(pattern, str):
+            words = _words.findall(pattern)
+
+            def match(text):
+                return pattern in text
+        else:
+            words = _required_words(pattern)
+            match = pattern.search
+        ids = self._candidates(words)
+        oldest = self.oldest_id()
+        found = []
+        if spilled:
+            spilledIds = None if ids is None else \
+                ids[:bisect_left(ids, oldest)]
+            found.extend(m for m in self._spilled(spilledIds)
+                         if match(m.text))
+        if ids is None:
+            messages = self
+        else:
+            messages = [self._ring[i % self.capacity]
+                        for i in ids[bisect_left(ids, oldest):]]
+        found.extend(m for m in messages if match(m.text))
+        return found
+
+    def _candidates(self, words):
+        # the ids, in order, of the messages that have each of words within
+        # one of their own (a run of word characters can't span two), or
+        # None to match every message
+        if not words:
+            return None
+        found = None
+        for word in set(words):
+            ids = set()
+            for token, postings in self._index.items():
+                if word in token:
+                    ids.update(postings)
+            found = ids if found is None else found & ids
+            if not found:
+                break
+        return sorted(found)
+
+    def _index_message(self, message):
+        for word in set(_words.findall(message.text)):
+            ids = self._index.get(word)
+            if ids is None:
+                ids = self._index[word] = array('q')
+            ids.append(message.id)
+
+    def _prune_index(self, oldest):
+        for word in list(self._index):
+            ids = self._index[word]
+            del ids[:bisect_left(ids, oldest)]
+            if not ids:
+                del self._index[word]
+
+    def _evict(self, message):
+        if self.spillPath is not None:
+            if self._spill is None:
+                self._spill = io.open(self.spillPath, 'ab')
+                self._spillStart = self._spill.tell()
+            if self._spillBase is None:
+                self._spillBase = message.id
+            self._offsets.append(self._spill.tell())
+            self._spill.write("{}\t{}\t{}\t{}\n".format(
+                message.id, message.action,
+                '' if message.turn is None else message.turn,
+                message.text).encode('utf-8'))
+        elif (message.id + 1) % self.capacity == 0:
+            self._prune_index(message.id + 1)
+        self._prune_actions(message.id + 1)
+
+    def _prune_actions(self, oldest):
+        # forget actions whose messages all left the ring, and keep no more
+        # actions than messages, for long runs of commands with no output
+        while self._first_action < self.action and (
+                len(self._actions) > self.capacity
+                or self._actions[self._first_action][1] <= oldest):
+            del self._actions[self._first_action]
+            self._first_action += 1
+
+    def _spilled(self, ids=None):
+        # the messages in the spill file, or only those of ids that this
+        # log spilled (and the lines it didn't write), oldest first
+        if self.spillPath is None:
+            return
+        if self._spill is not None:
+            self._spill.flush()
+        try:
+            spill = io.open(self.spillPath, 'rb')
+        except IOError:
+            return
+        with spill:
+            end = self._spillStart
+            while end is None or spill.tell() < end:
+                line = spill.readline()
+                if not line:
+                    return
+                yield _spilled_message(line)
+            if ids is None:
+                for line in spill:
+                    yield _spilled_message(line)
+                return
+            for messageId in ids:
+                if self._spillBase is None or messageId < self._spillBase:
+                    continue
+                spill.seek(self._offsets[messageId - self._spillBase])
+                yield _spilled_message(spill.readline())
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+def _spilled_message(line):
+    messageId, action, turn, text = \
+        line.decode('utf-8').rstrip('\n').split('\t', 3)
+    return Message(int(messageId), int(action),
+                   float(turn) if turn else None, text)
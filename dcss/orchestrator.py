@@ -0,0 +1,273 @@
+from collections import namedtuple
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from .client import Client
+from .screens import Screens
+
+log = logging.getLogger(__name__)
+
+# what a worker reports for every request
+# ok is False if the game failed, error then holds the reason
+GameResult = namedtuple(
+    'GameResult',
+    ['request', 'game', 'ok', 'player', 'restarted', 'elapsed', 'error'])
+
+
+class Orchestrator():
+    # runs many games, each on its own LocalConnection crawl process,
+    # spread over a pool of worker processes
+    # commands are routed to the worker that owns the game, and results
+    # come back as compact GameResults; crashed games are restarted, and
+    # so are crashed workers (up to maxRestarts times each), with all
+    # their games; requests a dead worker had taken fail
+
+    def __init__(self, games, workers=None, connectionArgs=None,
+                 maxRestarts=3, compact=True):
+        self.games = list(games)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workerCount = max(1, min(workers, len(self.games)))
+        self.connectionArgs = connectionArgs or {}
+        self.maxRestarts = maxRestarts
+        # whether the games keep their screens in compact arrays (see
+        # TerminalBuffer), which a worker with many games wants
+        self.compact = compact
+        # game name -> index of the worker it lives on
+        self.assignment = {
+            g: i % self.workerCount for i, g in enumerate(self.games)}
+        self.workers = []
+        self.results = None
+        self._requests = []
+        self._ids = itertools.count()
+        # request id -> (worker index, game) until its result is in
+        self._pending = {}
+        self._started = None
+        self._context = None
+        # how often collect looks for dead workers while it waits
+        self.pollInterval = 0.5
+        self.actions = 0
+        self.failures = 0
+        self.restarts = 0
+        self.workerRestarts = [0] * self.workerCount
+
+    def start(self):
+        self._context = multiprocessing.get_context()
+        self.results = self._context.Queue()
+        self.workers = [None] * self.workerCount
+        self._requests = [None] * self.workerCount
+        for i in range(self.workerCount):
+            self._spawn(i)
+        self._started = time.monotonic()
+
+    def _spawn(self, i):
+        games = [g for g in self.games if self.assignment[g] == i]
+        requests = self._context.Queue()
+        worker = self._context.Process(
+            target=_worker,
+            args=(games, self.connectionArgs, self.compact,
+                  self.maxRestarts, requests, self.results),
+            daemon=True)
+        worker.start()
+        self.workers[i] = worker
+        self._requests[i] = requests
+
+    def stop(self, timeout=10):
+        for requests in self._requests:
+            if requests is not None:
+                requests.put(None)
+        for worker in self.workers:
+            if worker is None:
+                continue
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self._requests = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def send(self, game, command):
+        # queue a command for a game, returns the request id
+        return self._submit('command', game, command)
+
+    def update(self, game):
+        # queue a full Client.update for a game
+        return self._submit('update', game, None)
+
+    def _submit(self, kind, game, payload):
+        request = next(self._ids)
+        i = self.assignment[game]
+        self._pending[request] = (i, game)
+        if self.workers[i] is None:
+            # the worker died too often, its games are gone
+            self.results.put(GameResult(
+                request, game, False, None, False, 0.0,
+                "worker gave up after too many restarts"))
+        else:
+            self._requests[i].put((kind, request, game, payload))
+        return request
+
+    def collect(self, timeout=None):
+        # wait for every outstanding request, in completion order
+        results = []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            wait = self.pollInterval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            try:
+                result = self.results.get(timeout=wait)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            # a request failed for a dead worker may still have come in
+            if result.request not in self._pending:
+                continue
+            self._record(result)
+            results.append(result)
+        return results
+
+    def _check_workers(self):
+        # fail the requests of workers that died (a crash, the OOM
+        # killer...) and start them again, which restarts their games
+        dead = [i for i, worker in enumerate(self.workers)
+                if worker is not None and not worker.is_alive()]
+        for i in dead:
+            worker = self.workers[i]
+            error = "worker exited with code {}".format(worker.exitcode)
+            log.warning("worker %d %s", i, error)
+            restart = self.workerRestarts[i] < self.maxRestarts
+            if restart:
+                self.workerRestarts[i] += 1
+                self._spawn(i)
+            else:
+                self.workers[i] = None
+                self._requests[i] = None
+            for request, (owner, game) in list(self._pending.items()):
+                if owner == i:
+                    self.results.put(GameResult(
+                        request, game, False, None, restart, 0.0, error))
+
+    def _record(self, result):
+        self._pending.pop(result.request, None)
+        if result.ok:
+            self.actions += 1
+        else:
+            self.failures += 1
+        if result.restarted:
+            self.restarts += 1
+
+    def command_all(self, commands, timeout=None):
+        # send {game: command} and wait for all of them, keyed by game
+        for game, command in commands.items():
+            self.send(game, command)
+        return {r.game: r for r in self.collect(timeout)}
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0
+        return {
+            'games': len(self.games),
+            'workers': self.workerCount,
+            'actions': self.actions,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'worker_restarts': sum(self.workerRestarts),
+            'pending': len(self._pending),
+            'elapsed': elapsed,
+            'actions_per_second': self.actions / elapsed if elapsed else 0,
+        }
+
+
+def _start_game(game, connectionArgs, compact):
+    return Client(game, '', False, connectionArgs, compact=compact)
+
+
+def _alive(client):
+    process = client.conn.process
+    return client.conn.validConnection and process and process.isalive()
+
+
+def _worker(games, connectionArgs, compact, maxRestarts, requests,
+            results):
+    clients = {}
+    restarts = dict.fromkeys(games, 0)
+    for game in games:
+        try:
+            clients[game] = _start_game(game, connectionArgs, compact)
+        except Exception:
+            log.exception("starting %s failed", game)
+            clients[game] = None
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, request, game, payload = message
+        start = time.monotonic()
+        restarted = False
+        client = clients.get(game)
+
+        # restart the game if its crawl process went away
+        if client is None or not _alive(client):
+            if restarts[game] >= maxRestarts:
+                results.put(GameResult(
+                    request, game, False, None, False, 0.0,
+                    "too many restarts"))
+                continue
+            restarts[game] += 1
+            restarted = True
+            try:
+                if client is not None:
+                    client.quit()
+            except Exception:
+                pass
+            try:
+                client = clients[game] = _start_game(
+                    game, connectionArgs, compact)
+            except Exception as e:
+                clients[game] = None
+                results.put(GameResult(
+                    request, game, False, None, True,
+                    time.monotonic() - start, repr(e)))
+                continue
+
+        state = None
+        error = None
+        try:
+            if kind == 'command':
+                client.send_command(payload)
+            elif kind == 'update':
+                client.update()
+                # update leaves the game in the last screen it read, and
+                # the next command is meant for the game, not that menu
+                client.set_screen(Screens.MAIN)
+            ok = True
+        except Exception as e:
+            # the next request for this game will restart it if needed
+            error = repr(e)
+            ok = False
+        if ok and client.screen == Screens.MAIN:
+            # what was parsed so far, the player property could send keys
+            state = client._sections['player'].stats
+        results.put(GameResult(
+            request, game, ok, state, restarted,
+            time.monotonic() - start, error))
+
+    for client in clients.values():
+        if client is not None:
+            try:
+                client.quit()
+            except Exception:
+                pass
@@ -0,0 +1,245 @@
+from collections import OrderedDict
+import heapq
+
+import numpy as np
+
+from .client import Direction
+from .map import BLOCKING
+
+# distances and costs are float arrays the shape of a Level's grid,
+# indexed [y, x]. a cost is what it takes to step onto a cell,
+# np.inf where that's impossible. like crawl, a diagonal step costs the
+# same as a straight one
+
+
+def level_costs(level, blocking=BLOCKING, unknown=np.inf):
+    # step costs for a Level: 1 for every known cell that isn't blocking
+    # unknown cells cost unknown, e.g. 1 to plan through unexplored space
+    costs = np.full(level.glyphs.shape, float(unknown))
+    costs[level.known] = 1.0
+    codes = np.array([ord(g) for g in blocking], dtype=np.uint32)
+    costs[level.known & np.isin(level.glyphs, codes)] = np.inf
+    return costs
+
+
+def dijkstra(costs, sources, diagonal=True):
+    # the distance from every cell to the nearest of sources, a list of
+    # (y, x) or a boolean mask; np.inf for cells that can't reach any
+    distances = np.full(costs.shape, np.inf)
+    distances[_source_mask(costs.shape, sources)] = 0.0
+    _relax(distances, costs, diagonal)
+    return distances
+
+
+def _source_mask(shape, sources):
+    if isinstance(sources, np.ndarray) and sources.dtype == bool:
+        return sources
+    mask = np.zeros(shape, dtype=bool)
+    sources = np.asarray(list(sources), dtype=int).reshape(-1, 2)
+    mask[sources[:, 0], sources[:, 1]] = True
+    return mask
+
+
+def _relax(distances, costs, diagonal):
+    # lower distances in place until every cell is at most its cheapest
+    # neighbour plus its own cost, a whole grid at a time
+    # distances must already be upper bounds (e.g. inf, with 0 at sources)
+    reachable = np.isfinite(costs) | np.isfinite(distances)
+    if not reachable.any():
+        return
+    # nothing outside the reachable cells can change, so work on a crop
+    rows = np.nonzero(reachable.any(axis=1))[0]
+    cols = np.nonzero(reachable.any(axis=0))[0]
+    crop = (slice(max(0, rows[0] - 1), rows[-1] + 2),
+            slice(max(0, cols[0] - 1), cols[-1] + 2))
+    dist = distances[crop]
+    cost = costs[crop]
+    padded = np.full((dist.shape[0] + 2, dist.shape[1] + 2), np.inf)
+    while True:
+        padded[1:-1, 1:-1] = dist
+        if diagonal:
+            # the 3x3 minimum, one row of three and then one column
+            across = np.minimum(np.minimum(padded[:, :-2], padded[:, 1:-1]),
+                                padded[:, 2:])
+            nearest = np.minimum(np.minimum(across[:-2], across[1:-1]),
+                                 across[2:])
+        else:
+            nearest = np.minimum(
+                np.minimum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+                np.minimum(padded[1:-1, :-2], padded[1:-1, 2:]))
+        relaxed = np.minimum(dist, nearest + cost)
+        if np.array_equal(relaxed, dist):
+            break
+        dist[...] = relaxed
+
+
+def _neighbours(diagonal):
+    if diagonal:
+        return [d.offset for d in Direction]
+    return [Direction.UP.offset, Direction.DOWN.offset,
+            Direction.LEFT.offset, Direction.RIGHT.offset]
+
+
+def descend(distances, start, diagonal=True):
+    # the path from start down to the nearest source of a distance map,
+    # as (y, x) cells after start; None if start can't reach one
+    y, x = start
+    if not np.isfinite(distances[y, x]):
+        return None
+    height, width = distances.shape
+    steps = _neighbours(diagonal)
+    path = []
+    while distances[y, x] > 0:
+        best = None
+        for dy, dx in steps:
+            ny, nx = y + dy, x + dx
+            if 0 <= ny < height and 0 <= nx < width and \
+                    (best is None or distances[ny, nx] < distances[best]):
+                best = (ny, nx)
+        if distances[best] >= distances[y, x]:
+            return None
+        y, x = best
+        path.append(best)
+    return path
+
+
+class DijkstraMap():
+    # a distance map to a set of sources (items, stairs, monsters,
+    # unexplored cells...), kept up to date as the costs and sources change
+    # instead of being recomputed each turn
+
+    def __init__(self, costs, sources, diagonal=True):
+        self.diagonal = diagonal
+        self.costs = np.array(costs, dtype=float)
+        self.sources = _source_mask(self.costs.shape, sources).copy()
+        self.distances = dijkstra(self.costs, self.sources, diagonal)
+
+    def update(self, costs=None, sources=None):
+        # only what the changes can affect is recomputed:
+        # cells whose distance could have gone through a cell that got more
+        # expensive are forgotten, then everything is relaxed again, which
+        # also spreads any cheaper cells and new sources
+        costs = self.costs if costs is None else np.asarray(costs, float)
+        sources = self.sources if sources is None else \
+            _source_mask(self.costs.shape, sources)
+        if (self.sources & ~sources).any():
+            # a source went away, anything may be further now
+            self.__init__(costs, sources, self.diagonal)
+            return self.distances
+        distances = self.distances
+        dearer = costs > self.costs
+        if dearer.any():
+            # every cell at least this far may have been reached through
+            # one of them
+            distances[distances >= distances[dearer].min()] = np.inf
+        distances[sources] = 0.0
+        if dearer.any() or (costs < self.costs).any() or \
+                (sources & ~self.sources).any():
+            _relax(distances, costs, self.diagonal)
+        self.costs = np.array(costs, dtype=float)
+        self.sources = sources.copy()
+        return distances
+
+    def path(self, start):
+        return descend(self.distances, start, self.diagonal)
+
+    def directions(self, start):
+        path = self.path(start)
+        return None if path is None else path_directions(start, path)
+
+
+def astar(costs, start, goal, diagonal=True):
+    # the cheapest path from start to goal, as (y, x) cells after start,
+    # or None if there isn't one
+    start, goal = tuple(start), tuple(goal)
+    if not np.isfinite(costs[goal]):
+        return None
+    height, width = costs.shape
+    steps = _neighbours(diagonal)
+    # no step costs less than the cheapest cell, so this never overestimates
+    cheapest = costs[np.isfinite(costs)].min()
+
+    def estimate(cell):
+        dy, dx = abs(cell[0] - goal[0]), abs(cell[1] - goal[1])
+        return cheapest * (max(dy, dx) if diagonal else dy + dx)
+
+    best = {start: 0.0}
+    came = {}
+    queue = [(estimate(start), 0.0, start)]
+    while queue:
+        _, spent, cell = heapq.heappop(queue)
+        if cell == goal:
+            path = []
+            while cell != start:
+                path.append(cell)
+                cell = came[cell]
+            path.reverse()
+            return path
+        if spent > best[cell]:
+            continue
+        for dy, dx in steps:
+            ny, nx = cell[0] + dy, cell[1] + dx
+            if not (0 <= ny < height and 0 <= nx < width):
+                continue
+            total = spent + costs[ny, nx]
+            if total < best.get((ny, nx), np.inf):
+                best[(ny, nx)] = total
+                came[(ny, nx)] = cell
+                heapq.heappush(
+                    queue, (total + estimate((ny, nx)), total, (ny, nx)))
+    return None
+
+
+class PathFinder():
+    # A* over a cost grid, remembering the paths it found
+    # a remembered path is kept while nothing on it got more expensive and
+    # nothing anywhere got cheaper (which could make a shorter one)
+
+    def __init__(self, costs, diagonal=True, cacheSize=256):
+        self.diagonal = diagonal
+        self.costs = np.array(costs, dtype=float)
+        self.cacheSize = cacheSize
+        self._paths = OrderedDict()
+
+    def update(self, costs):
+        costs = np.asarray(costs, dtype=float)
+        if (costs < self.costs).any():
+            self._paths.clear()
+        else:
+            dearer = costs > self.costs
+            if dearer.any():
+                for key, path in list(self._paths.items()):
+                    if path is not None and \
+                            any(dearer[cell] for cell in path):
+                        del self._paths[key]
+        self.costs = np.array(costs, dtype=float)
+
+    def path(self, start, goal):
+        key = (tuple(start), tuple(goal))
+        if key in self._paths:
+            self._paths.move_to_end(key)
+            return self._paths[key]
+        path = astar(self.costs, start, goal, self.diagonal)
+        self._paths[key] = path
+        if len(self._paths) > self.cacheSize:
+            self._paths.popitem(last=False)
+        return path
+
+    def directions(self, start, goal):
+        path = self.path(start, goal)
+        return None if path is None else path_directions(start, path)
+
+
+def path_directions(start, path):
+    # the Direction of each step along path, a list of (y, x) after start
+    directions = []
+    y, x = start
+    for ny, nx in path:
+        directions.append(Direction.from_offset(ny - y, nx - x))
+        y, x = ny, nx
+    return directions
+
+
+def path_keys(start, path):
+    # the keys that walk path, for Client.send_command one at a time
+    return "".join(d.key for d in path_directions(start, path))
@@ -1,180 +1,147 @@
+from collections import namedtuple
+from itertools import chain
+import re
+
 from .screens import Screens
 
+# everything the sidebar shows, in the order it appears on screen
+PlayerStats = namedtuple('PlayerStats', [
+    'title', 'race',
+    'current_health', 'max_health', 'total_health',
+    'current_mana', 'max_mana',
+    'armour_class', 'current_str', 'base_str',
+    'evasion', 'current_int', 'base_int',
+    'shielding', 'current_dex', 'base_dex',
+    'experience_level', 'next_experience_level', 'place',
+    'total_auts', 'last_action_duration',
+    'wielded_item', 'quivered_item'])
+
+# the sidebar starts at this column, its second column 18 further along
+_SIDEBAR_X = 37
+_COLUMN_WIDTH = 18
+
+# a player's name is followed by 'the' if it's short enough
+_title = re.compile(r"\s*\S+ (?:the )?(\S+)")
+# 'Health: 10/20', or 'Health: 10/20 (25)' while the maximum is reduced
+_pool = re.compile(r"[^:]*: *(-?\d+)/(-?\d+)(?: \((-?\d+)\))?")
+# 'Str: 12', or 'Str: 12 (15)' while drained. wizmode adds GDR after AC
+_value = re.compile(r"[^:]*: *(-?\d+)(?: \((-?\d+)\))?")
+_experience = re.compile(r"[^:]*: *(\d+) *[^:]*: *(\d+)%")
+# only the first ':' is the label, places like 'Dungeon:2' have more
+_place = re.compile(r"[^:]*: *(.*?) *$")
+# the last action's duration may be missing after a fresh load
+_time = re.compile(r"[^:]*: *(\d+(?:\.\d+)?)(?: \((\d+(?:\.\d+)?)\))?")
+
+
+def _match(pattern, text):
+    match = pattern.match(text)
+    if match is None:
+        raise ValueError("unexpected sidebar text {!r}".format(text))
+    return match
+
+
+def _with_base(current, base):
+    current = int(current)
+    return current, current if base is None else int(base)
+
+
+# one parser per sidebar row, each given the row from the sidebar column
+# and returning that row's fields of PlayerStats
+
+def _parse_title(line):
+    return (_match(_title, line).group(1),)
+
+
+def _parse_race(line):
+    # this only changes if in wizmode. but no reason not to support it
+    return (line.strip(),)
+
+
+def _parse_health(line):
+    current, maximum, total = _match(_pool, line[:_COLUMN_WIDTH]).groups()
+    maximum = int(maximum)
+    return int(current), maximum, maximum if total is None else int(total)
+
+
+def _parse_mana(line):
+    match = _match(_pool, line[:_COLUMN_WIDTH])
+    return int(match.group(1)), int(match.group(2))
+
+
+def _parse_stat(line):
+    # a defence on the left (AC, EV or SH), an attribute on the right
+    defence = int(_match(_value, line[:_COLUMN_WIDTH]).group(1))
+    return (defence,) + _with_base(
+        *_match(_value, line[_COLUMN_WIDTH:]).groups())
+
+
+def _parse_experience(line):
+    match = _match(_experience, line[:_COLUMN_WIDTH])
+    place = _match(_place, line[_COLUMN_WIDTH:]).group(1)
+    return int(match.group(1)), int(match.group(2)), place
+
+
+def _parse_time(line):
+    total, last = _match(_time, line[_COLUMN_WIDTH:]).groups()
+    return float(total), 0.0 if last is None else float(last)
+
+
+def _parse_item(line):
+    # just the inventory letter, or None if the slot is empty
+    item = line[:1]
+    return (None if item == '-' else item,)
+
+
+_row_parsers = (
+    _parse_title, _parse_race, _parse_health, _parse_mana,
+    _parse_stat, _parse_stat, _parse_stat, _parse_experience,
+    _parse_time, _parse_item, _parse_item)
+
 
 class Player():
     def __init__(self):
-        self.current_health = None
-        self.max_health = None
-        self.total_health = None
-        self.current_mana = None
-        self.max_mana = None
-        self.race = None
-        self.title = None
-        self.armour_class = None
-        self.evasion = None
-        self.shielding = None
-        self.current_str = None
-        self.base_str = None
-        self.current_int = None
-        self.base_int = None
-        self.current_dex = None
-        self.base_dex = None
-        self.place = None
-        self.total_auts = None
-        self.last_action_duration = None
-        self.experience_level = None
-        self.next_experience_level = None
-        self.wielded_item = None
-        self.quivered_item = None
+        self.stats = PlayerStats._make([None] * len(PlayerStats._fields))
         self.gold = None
+        # the fields last read from each sidebar row
+        self._row_values = [None] * len(_row_parsers)
+        # set when a row changed but stats hasn't been rebuilt yet
+        self._rows_changed = False
+        # terminal version the sidebar was last read at
+        self._main_version = -1
         return
 
+    def __getattr__(self, name):
+        # the sidebar fields, e.g. player.current_health, come from stats
+        # (this is only reached for names that aren't set on the player)
+        if name.startswith('_') or name == 'stats':
+            raise AttributeError(name)
+        return getattr(self.stats, name)
+
     def update(self, screenType, terminal):
         if screenType == Screens.MAIN:
-            self._update_health(terminal)
-            self._update_mana(terminal)
-            self._update_title(terminal)
-            self._update_race(terminal)
-            self._update_armour_class(terminal)
-            self._update_evasion(terminal)
-            self._update_shielding(terminal)
-            self._update_str(terminal)
-            self._update_int(terminal)
-            self._update_dex(terminal)
-            self._update_experience_level(terminal)
-            self._update_next_experience_level(terminal)
-            self._update_place(terminal)
-            self._update_actions(terminal)
-            self._update_wielded_item(terminal)
-            self._update_quivered_item(terminal)
+            self._update_sidebar(terminal)
         elif screenType == Screens.CHARACTER:
             pass
 
-    # internal helper functions, just for general cleanliness
-
-    def _update_health(self, terminal):
-        # grab the health line from the sidebar, up to the = signs
-        # then grab the part after the semicolon
-        health = terminal.get_text(37, 2, 18, 1).split(':')[
-            1].strip().split('/')
-
-        self.current_health = int(health[0])
-
-        if ' ' in health[1]:
-            self.max_health = int(health[1].split(' ')[0])
-            self.total_health = int(health[1].split(' ')[1][1:-1])
-        else:
-            self.max_health = int(health[1])
-            self.total_health = self.max_health
-
-    def _update_mana(self, terminal):
-        # grab the text immediately after 'Mana: ' from the sidebar
-        manaInfo = terminal.get_text(37, 3, 18, 1).split(':')[1].split('/')
-
-        self.current_mana = int(manaInfo[0])
-        self.max_mana = int(manaInfo[1])
-
-    def _update_title(self, terminal):
-        titleInfo = terminal.get_text(37, 0, 0, 1).strip()
-        words = titleInfo.split(' ')
-        # if the player's name is short enough, the second word is 'the'
-        if words[1] == 'the':
-            self.title = words[2]
-        # if the player's name is too long, the second word is the title
-        else:
-            self.title = words[1]
-
-    def _update_race(self, terminal):
-        # this only changes if in wizmode. but no reason not to support it
-        # grab the race from the sidebar, to the end of the line
-        self.race = terminal.get_text(37, 1, 0, 1).strip()
-
-    def _update_armour_class(self, terminal):
-        # grab AC from the sidebar
-        # wizmode displays GDR, so account for that too
-        acInfo = terminal.get_text(37, 4, 18, 1).split(':')[1].strip()
-
-        # there will only be a ' ' left after stripming if in wizmode, for GDR
-        if ' ' in acInfo:
-            self.armour_class = int(acInfo.split(' ')[0])
-        else:
-            self.armour_class = int(acInfo)
-
-    def _update_evasion(self, terminal):
-        # grab EV from sidebar
-        self.evasion = int(
-            terminal.get_text(
-                37, 5, 18, 1).split(':')[1].strip())
-
-    def _update_shielding(self, terminal):
-        # grab SH from sidebar
-        self.shielding = int(
-            terminal.get_text(
-                37, 6, 18, 1).split(':')[1].strip())
-
-    def _update_str(self, terminal):
-        strInfo = terminal.get_text(55, 4, 0, 1).split(':')[1].strip()
-        if ' ' in strInfo:
-            self.current_str = int(strInfo.split(' ')[0])
-            self.base_str = int(strInfo.split(' ')[1][1:-1])
-        else:
-            self.current_str = int(strInfo)
-            self.base_str = self.current_str
-
-    def _update_int(self, terminal):
-        intInfo = terminal.get_text(55, 5, 0, 1).split(':')[1].strip()
-        if ' ' in intInfo:
-            self.current_int = int(intInfo.split(' ')[0])
-            self.base_int = int(intInfo.split(' ')[1][1:-1])
-        else:
-            self.current_int = int(intInfo)
-            self.base_int = self.current_int
-
-    def _update_dex(self, terminal):
-        dexInfo = terminal.get_text(55, 6, 0, 1).split(':')[1].strip()
-        if ' ' in dexInfo:
-            self.current_dex = int(dexInfo.split(' ')[0])
-            self.base_dex = int(dexInfo.split(' ')[1][1:-1])
-        else:
-            self.current_dex = int(dexInfo)
-            self.base_dex = self.current_dex
-
-    def _update_experience_level(self, terminal):
-        self.experience_level = int(
-            terminal.get_text(
-                37, 7, 7, 1).split(':')[1] .strip())
-
-    def _update_next_experience_level(self, terminal):
-        # make sure to remove '%' character before conversion
-        self.next_experience_level = int(terminal.get_text(
-            44, 7, 11, 1).split(':')[1] .strip()[:-1])
-
-    def _update_place(self, terminal):
-        # make sure to only split on first ':' since they may be in the value
-        self.place = terminal.get_text(55, 7, 0, 1).split(':', 1)[1].strip()
-
-    def _update_actions(self, terminal):
-        # last action may not exist after a fresh load
-        timeInfo = terminal.get_text(55, 8, 0, 1).split(':')[1].strip()
-        if ' ' in timeInfo:
-            self.total_auts = float(timeInfo.split(' ')[0])
-            self.last_action_duration = float(timeInfo.split(' ')[1][1:-1])
-        else:
-            self.total_auts = float(timeInfo.split(' ')[0])
-            self.last_action_duration = 0.0
-
-    def _update_wielded_item(self, terminal):
-        # this will just be a key to get the item from inventory
-        # since it's just the index, we only need the one character
-        self.wielded_item = terminal.get_text(37, 9, 1, 1)
-        # minor convenience: if value is '-' (nothing wielded), use None
-        if self.wielded_item == '-':
-            self.wielded_item = None
-
-    def _update_quivered_item(self, terminal):
-        # this will just be a key to get the item from inventory
-        # since it's just the index, we only need the one character
-        self.quivered_item = terminal.get_text(37, 10, 1, 1)
-        # minor convenience: if value is '-' (nothing quivered), use None
-        if self.quivered_item == '-':
-            self.quivered_item = None
+    def _update_sidebar(self, terminal):
+        if terminal.version == self._main_version:
+            return
+        if terminal.version < self._main_version:
+            # versions only go up, so this is a different terminal
+            self._main_version = -1
+        # only reread rows where something was drawn over the sidebar
+        # (most of a turn's damage is on the map to its left)
+        rows = set()
+        for x, y, w, h in terminal.changed_regions(self._main_version):
+            if x + w > _SIDEBAR_X:
+                rows.update(range(y, min(y + h, len(_row_parsers))))
+        values = self._row_values
+        for y in rows:
+            fields = _row_parsers[y](terminal.get_row(y)[_SIDEBAR_X:])
+            if fields != values[y]:
+                values[y] = fields
+                self._rows_changed = True
+        if self._rows_changed:
+            self.stats = PlayerStats._make(chain.from_iterable(values))
+            self._rows_changed = False
+        self._main_version = terminal.version
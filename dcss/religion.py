@@ -0,0 +1,60 @@
+import re
+
+from .cached_section import CachedSection
+from .screens import Screens
+
+# the stars (and dots) showing piety, e.g. '****..'
+_piety = re.compile(r"([*.]*\*[*.]*)")
+# some are more than one word, and the title after them has no fixed form
+_gods = ('Ashenzari', 'Beogh', 'Cheibriados', 'Dithmenos', 'Elyvilon',
+         'Fedhas', 'Gozag', 'Hepliaklqana', 'Ignis', 'Jiyva',
+         'Kikubaaqudgha', 'Lugonu', 'Makhleb', 'Nemelex Xobeh', 'Okawaru',
+         'Pakellas', 'Qazlal', 'Ru', 'Sif Muna', 'The Shining One', 'Trog',
+         'Uskayaw', 'Vehumet', 'Wu Jian', 'Xom', 'Yredelemnul', 'Zin')
+
+
+def _split_title(line):
+    # 'Sif Muna the Loreminder' -> ('Sif Muna', 'the Loreminder')
+    for god in _gods:
+        if line == god or line.startswith(god + ' '):
+            return god, line[len(god) + 1:] or None
+    # a god we don't know of, whose title hopefully starts with 'the'
+    if ' the ' in line:
+        god, title = line.split(' the ', 1)
+        return god, 'the ' + title
+    return line, None
+
+
+class Religion(CachedSection):
+    # the god screen. god is None if the player isn't religious
+    _screen = Screens.RELIGION
+    _invalidating = re.compile(
+        r"You (?:join|renounce|abandon)|welcomes you|forgives you|"
+        r"You feel (?:a surge of divine|a hint of divine|.*(?:pleased|"
+        r"displeased|wrath))|piety|is (?:pleased|displeased|angry)")
+
+    def __init__(self):
+        super().__init__()
+        self.god = None
+        self.title = None
+        self.piety = None
+        self.lines = []
+        return
+
+    def _read(self, terminal):
+        self.god = self.title = self.piety = None
+        self.lines = []
+        if terminal is None:
+            return
+        self.lines = [line.strip() for line in
+                      terminal.get_text().split('\n') if line.strip()]
+        if not self.lines:
+            return
+        # the screen opens with the god's name and title, 'Trog the Angry'
+        self.god, self.title = _split_title(self.lines[0])
+        for line in self.lines[1:]:
+            if 'Piety' in line or 'piety' in line:
+                match = _piety.search(line)
+                if match is not None:
+                    self.piety = match.group(1).count('*')
+                break
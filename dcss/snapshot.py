@@ -0,0 +1,531 @@
+from array import array
+from collections import deque
+from functools import partial
+from itertools import chain
+from math import nan
+import marshal
+import struct
+import sys
+
+import numpy as np
+
+from .inventory import InventoryChange, Item
+from .map import Level
+from .messages import Message
+from .player import PlayerStats
+from .abilities import Ability
+from .screens import Screens
+from .spells import Spell
+from .terminal_buffer import ArrayGrid, CharacterGrid, TerminalBuffer
+
+# a compact binary image of a client's state: the terminal, the parsed
+# sections and the message log, to pick a game back up or to rewind to
+#
+#   b'DCSS', u16 format version, then a marshal (version 4) dict of sections
+#
+# marshal only holds plain values (None, bools, numbers, strings, bytes,
+# tuples, lists and dicts), and reads them back at C speed. namedtuples
+# are written as tuples and rebuilt by the section that owns them, and
+# bulk data (terminal cells, map levels) as the raw array bytes, so it's
+# copied rather than converted
+# a snapshot is bound to the format version it was written with; loading
+# another version raises ValueError
+
+MAGIC = b'DCSS'
+FORMAT_VERSION = 1
+
+_header = struct.Struct('<4sH')
+# fixed, so snapshots don't change with the python version writing them
+_marshalVersion = 4
+
+_little = sys.byteorder == 'little'
+
+
+def _pack(sections):
+    return _header.pack(MAGIC, FORMAT_VERSION) + \
+        marshal.dumps(sections, _marshalVersion)
+
+
+def _unpack(data):
+    if len(data) < _header.size:
+        raise ValueError("not a snapshot")
+    magic, version = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a snapshot")
+    if version != FORMAT_VERSION:
+        raise ValueError("snapshot format {} isn't supported (expected {})"
+                         .format(version, FORMAT_VERSION))
+    try:
+        return marshal.loads(memoryview(data)[_header.size:])
+    except (EOFError, TypeError) as e:
+        raise ValueError("corrupt snapshot: {}".format(e))
+
+
+# the terminal
+
+# attribute strings back to sequences; the same few come up in every
+# snapshot, and sequences aren't changed once made, so they're shared
+_sequences = {}
+_sequenceParser = TerminalBuffer(1, 1)
+
+
+def _sequence(text):
+    if not text:
+        return None
+    sequence = _sequences.get(text)
+    if sequence is None:
+        if len(_sequences) > 4096:
+            _sequences.clear()
+        sequence = _sequences[text] = \
+            _sequenceParser._parse_sequence_at(text, 0)[0]
+    return sequence
+
+
+def _glyph_array(data):
+    values = array(ArrayGrid._glyphType)
+    if values.itemsize != 4:
+        # a 2 byte 'u' (windows), go through str instead
+        return array(ArrayGrid._glyphType, str(data, 'utf-32-le'))
+    values.frombytes(data)
+    if not _little:
+        values.byteswap()
+    return values
+
+
+def _attr_array(data):
+    values = array('H')
+    values.frombytes(data)
+    if not _little:
+        values.byteswap()
+    return values
+
+
+def _ints(data):
+    values = array('q')
+    values.frombytes(data)
+    if not _little:
+        values.byteswap()
+    return values.tolist()
+
+
+def _int_bytes(values):
+    values = array('q', values)
+    if not _little:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _row_bytes(row):
+    if row.typecode == 'H':
+        if not _little:
+            row = array('H', row)
+            row.byteswap()
+        return row.tobytes()
+    if _little and row.itemsize == 4:
+        return row.tobytes()
+    return row.tounicode().encode('utf-32-le')
+
+
+def _grid_state(grid):
+    # (attribute strings, glyph bytes, attr bytes), rows one after another
+    if isinstance(grid, ArrayGrid):
+        attributes = ['' if a is None else str(a) for a in grid.attributes]
+        glyphs = b"".join(_row_bytes(row) for row in grid.glyphs)
+        attrs = b"".join(_row_bytes(row) for row in grid.attrs)
+        return attributes, glyphs, attrs
+    # a CharacterGrid holds the sequences themselves; number them here
+    attributes = ['']
+    ids = {}
+    glyphs = []
+    attrs = array('H')
+    for row in grid.rows:
+        for c in row:
+            glyphs.append(c.value or ' ')
+            if not c.value:
+                attrs.append(0)
+                continue
+            key = str(c.color)
+            attr = ids.get(key)
+            if attr is None:
+                attr = ids[key] = len(attributes)
+                # a cell written with no colour keeps None, like the
+                # ArrayGrid table does
+                attributes.append('' if c.color is None else key)
+            attrs.append(attr)
+    if not _little:
+        attrs.byteswap()
+    return attributes, "".join(glyphs).encode('utf-32-le'), attrs.tobytes()
+
+
+def _restore_grid(width, height, compact, attributes, glyphs, attrs):
+    sequences = [_sequence(a) for a in attributes]
+    if compact:
+        grid = ArrayGrid.__new__(ArrayGrid)
+        grid.width = width
+        grid.height = height
+        grid._blankGlyphs = array(ArrayGrid._glyphType, ' ' * width)
+        grid._blankAttrs = array('H', [0]) * width
+        # one array for the whole screen, then a slice (a copy) per row
+        glyphs = _glyph_array(glyphs)
+        attrs = _attr_array(attrs)
+        grid.glyphs = [glyphs[i:i + width]
+                       for i in range(0, width * height, width)]
+        grid.attrs = [attrs[i:i + width]
+                      for i in range(0, width * height, width)]
+        grid.attributes = sequences
+        # keyed like ArrayGrid.intern does
+        grid._attributeIds = {str(a): i for i, a in enumerate(sequences)
+                              if i}
+        return grid
+    grid = CharacterGrid.__new__(CharacterGrid)
+    grid.width = width
+    grid.height = height
+    text = str(glyphs, 'utf-32-le')
+    ids = _attr_array(attrs)
+    Character = TerminalBuffer.Character
+    grid.rows = [
+        [Character(text[i], sequences[ids[i]]) if ids[i]
+         else Character("", None)
+         for i in range(y * width, (y + 1) * width)]
+        for y in range(height)]
+    return grid
+
+
+# the newest entries of the damage log that are saved; asking a restored
+# terminal about older versions gets whole changed rows (changed_rows),
+# which is still right, and rebuilding the log is most of a restore
+_damageSaved = 64
+
+
+def terminal_state(terminal):
+    attributes, glyphs, attrs = _grid_state(terminal.grid)
+    return {
+        'size': (terminal.width, terminal.height),
+        'window': (terminal.window_top, terminal.window_bot),
+        'cursor': (terminal.cursor_pos.x, terminal.cursor_pos.y),
+        'saved_cursor': (terminal.savedCursorPosition.x,
+                         terminal.savedCursorPosition.y),
+        'compact': isinstance(terminal.grid, ArrayGrid),
+        'skip_unsupported': terminal.skip_unsupported,
+        'color': str(terminal.cur_color),
+        'attributes': attributes,
+        'glyphs': glyphs,
+        'attrs': attrs,
+        'version': terminal.version,
+        'row_versions': _int_bytes(terminal.row_versions),
+        'damage': _int_bytes(chain.from_iterable(
+            list(terminal._damage)[-_damageSaved:])),
+        'pending': terminal._pending,
+    }
+
+
+def restore_terminal(terminal, state, compact=None):
+    # fill terminal in place (so whatever feeds it keeps doing so)
+    # compact picks the grid kind, by default the one that was saved
+    width, height = state['size']
+    if compact is None:
+        compact = state['compact']
+    terminal.width = width
+    terminal.height = height
+    terminal.window_top, terminal.window_bot = state['window']
+    terminal.cursor_pos = TerminalBuffer.Position(*state['cursor'])
+    terminal.savedCursorPosition = \
+        TerminalBuffer.Position(*state['saved_cursor'])
+    terminal.skip_unsupported = state['skip_unsupported']
+    terminal.grid = _restore_grid(width, height, compact,
+                                  state['attributes'], state['glyphs'],
+                                  state['attrs'])
+    terminal.cur_color = _sequence(state['color'])
+    terminal._cur_attr = terminal.grid.intern(terminal.cur_color)
+    terminal.version = state['version']
+    terminal.row_versions = _ints(state['row_versions'])
+    # (version, x0, y0, x1, y1) entries
+    damage = iter(_ints(state['damage']))
+    terminal._damage = deque(zip(damage, damage, damage, damage, damage),
+                             maxlen=TerminalBuffer._damageLogSize)
+    terminal._row_text = [None] * height
+    terminal._pending = state['pending']
+    return terminal
+
+
+# the sections
+
+def _player_state(player):
+    return (tuple(player.stats), player.gold, player._row_values,
+            player._rows_changed, player._main_version)
+
+
+def _restore_player(player, state):
+    stats, player.gold, rows, player._rows_changed, \
+        player._main_version = state
+    player.stats = PlayerStats._make(stats)
+    player._row_values = list(rows)
+
+
+def _item_state(item):
+    return None if item is None else tuple(item)
+
+
+def _item(item):
+    return None if item is None else Item._make(item)
+
+
+def _inventory_state(inventory):
+    return ([tuple(item) for item in inventory.slots.values()],
+            inventory.more_pages, inventory.invalidated, inventory.sequence,
+            [(c.sequence, c.letter, _item_state(c.old), _item_state(c.new))
+             for c in inventory.changes])
+
+
+def _restore_inventory(inventory, state):
+    items, inventory.more_pages, inventory.invalidated, \
+        inventory.sequence, changes = state
+    inventory.slots = {item[0]: Item._make(item) for item in items}
+    inventory.changes.clear()
+    inventory.changes.extend(
+        InventoryChange(sequence, letter, _item(old), _item(new))
+        for sequence, letter, old, new in changes)
+    # the line cache only holds for the listing it came from
+    inventory._lines = {}
+    inventory._lastLines = {}
+    inventory._seen = set()
+    inventory._category = None
+
+
+def _cached_state(section, fields):
+    return (section.invalidated, section._stats) + \
+        tuple(getattr(section, f) for f in fields)
+
+
+def _restore_cached(section, state, fields):
+    section.invalidated, section._stats = state[:2]
+    for field, value in zip(fields, state[2:]):
+        setattr(section, field, value)
+
+
+def _spells_state(spells):
+    return _cached_state(spells, ()) + \
+        ([tuple(s) for s in spells.spells.values()],)
+
+
+def _restore_spells(spells, state):
+    _restore_cached(spells, state[:2], ())
+    spells.spells = {s[0]: Spell._make(s) for s in state[2]}
+
+
+def _abilities_state(abilities):
+    return _cached_state(abilities, ()) + \
+        ([tuple(a) for a in abilities.abilities.values()],)
+
+
+def _restore_abilities(abilities, state):
+    _restore_cached(abilities, state[:2], ())
+    abilities.abilities = {a[0]: Ability._make(a) for a in state[2]}
+
+
+_religionFields = ('god', 'title', 'piety', 'lines')
+
+
+def _religion_state(religion):
+    return _cached_state(religion, _religionFields)
+
+
+def _restore_religion(religion, state):
+    _restore_cached(religion, state, _religionFields)
+
+
+def _overview_state(overview):
+    return _cached_state(overview, ('lines',))
+
+
+def _restore_overview(overview, state):
+    _restore_cached(overview, state, ('lines',))
+
+
+def _array_state(values):
+    return (values.dtype.str, values.shape, values.tobytes())
+
+
+def _restore_array(state):
+    dtype, shape, data = state
+    return np.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
+
+def _level_state(level):
+    return {
+        'place': level.place,
+        'glyphs': _array_state(level.glyphs),
+        'attrs': _array_state(level.attrs),
+        'seen': _array_state(level.seen),
+        'known': _array_state(level.known),
+        'player': level.player,
+        'origin': level._origin,
+        'view': None if level._view is None else _array_state(level._view),
+    }
+
+
+def _restore_level(state):
+    level = Level.__new__(Level)
+    level.place = state['place']
+    level.glyphs = _restore_array(state['glyphs'])
+    level.attrs = _restore_array(state['attrs'])
+    level.seen = _restore_array(state['seen'])
+    level.known = _restore_array(state['known'])
+    level.player = state['player']
+    level._origin = state['origin']
+    level._view = None if state['view'] is None else \
+        _restore_array(state['view'])
+    return level
+
+
+def _map_state(levelMap):
+    return {
+        'levels': [_level_state(level)
+                   for level in levelMap.levels.values()],
+        'level': None if levelMap.level is None else levelMap.level.place,
+        'attributes': levelMap.attributes,
+        'main_version': levelMap._main_version,
+    }
+
+
+def _restore_map(levelMap, state):
+    levels = [_restore_level(level) for level in state['levels']]
+    levelMap.levels = {level.place: level for level in levels}
+    levelMap.level = None if state['level'] is None else \
+        levelMap.levels[state['level']]
+    levelMap.attributes = list(state['attributes'])
+    levelMap._attributeIds = {a: i for i, a in
+                              enumerate(levelMap.attributes)}
+    levelMap._colorIds = {}
+    levelMap._main_version = state['main_version']
+
+
+_sectionStates = {
+    'player': (_player_state, _restore_player),
+    'inventory': (_inventory_state, _restore_inventory),
+    'map': (_map_state, _restore_map),
+    'overview': (_overview_state, _restore_overview),
+    'spells': (_spells_state, _restore_spells),
+    'abilities': (_abilities_state, _restore_abilities),
+    'religion': (_religion_state, _restore_religion),
+}
+
+
+# the message log
+
+def _messages_state(log):
+    # column by column: the ids of the messages in memory run up to
+    # _next_id, so only their actions, turns (NaN for None) and texts
+    messages = list(log)
+    turns = array('d', [nan if m.turn is None else m.turn for m in messages])
+    if not _little:
+        turns.byteswap()
+    return (log.capacity, log._next_id, log.action, log.turn,
+            log._first_action,
+            _int_bytes(chain.from_iterable(
+                (action, first, end)
+                for action, (first, end) in log._actions.items())),
+            _int_bytes(m.action for m in messages), turns.tobytes(),
+            "\0".join(m.text for m in messages))
+
+
+_newMessage = partial(tuple.__new__, Message)
+
+
+def _restore_messages(log, state):
+    # the spill file is where this log was told to put it, not where the
+    # saved one did
+    # a full log is thousands of Messages, more than all the rest of a
+    # restore, so they're only made once the log is used (see MessageLog)
+    capacity, nextId, log.action, log.turn, log._first_action, actions, \
+        messageActions, turns, texts = state
+    log.capacity = capacity
+    log._next_id = nextId
+    log._defer(partial(_message_columns, capacity, nextId, actions,
+                       messageActions, turns, texts))
+
+
+def _message_columns(capacity, nextId, actions, messageActions, turns,
+                     texts):
+    # (ring, actions) for a MessageLog, from what _messages_state saved
+    messageActions = _ints(messageActions)
+    turns, data = array('d'), turns
+    turns.frombytes(data)
+    if not _little:
+        turns.byteswap()
+    texts = texts.split("\0") if messageActions else []
+    ring = [None] * capacity
+    # built by tuple.__new__ through map, without a python call each
+    count = len(messageActions)
+    messages = list(map(_newMessage, zip(
+        range(nextId - count, nextId), messageActions,
+        [None if turn != turn else turn for turn in turns], texts)))
+    # the ids are consecutive, so at most two runs of the ring
+    start = (nextId - count) % capacity
+    head = min(count, capacity - start)
+    ring[start:start + head] = messages[:head]
+    ring[:count - head] = messages[head:]
+    actions = iter(_ints(actions))
+    return ring, {action: [first, end]
+                  for action, first, end in zip(actions, actions, actions)}
+
+
+# the client
+
+def client_state(client, maps=True):
+    # maps=False leaves the levels out, which are most of a snapshot's size
+    sections = {name: state(client._sections[name])
+                for name, (state, _) in _sectionStates.items()
+                if maps or name != 'map'}
+    return {
+        'terminal': terminal_state(client.terminal),
+        'sections': sections,
+        'messages': _messages_state(client.messages),
+        'client': {
+            'screen': client.screen.value,
+            'stamps': {screen.value: stamp for screen, stamp in
+                       client._screen_stamps.items()},
+            'empty_screens': [s.value for s in client._empty_screens],
+            'fresh': client.fresh,
+            'new_game': getattr(client, 'new_game', None),
+            'weird': getattr(client, 'weird', None),
+        },
+    }
+
+
+def restore_client(client, state):
+    # put a saved state back into client, in place
+    # the terminal is rebuilt from the array buffers as they are, whatever
+    # grid the client had: making a Character per cell for a CharacterGrid
+    # is slower than the whole rest of the restore
+    restore_terminal(client.terminal, state['terminal'], compact=True)
+    for name, sectionState in state['sections'].items():
+        _sectionStates[name][1](client._sections[name], sectionState)
+    _restore_messages(client.messages, state['messages'])
+    info = state['client']
+    client.screen = Screens(info['screen'])
+    client._screen_stamps = {Screens(screen): tuple(stamp)
+                             for screen, stamp in info['stamps'].items()}
+    client._empty_screens = {Screens(s) for s in info['empty_screens']}
+    client.fresh = info['fresh']
+    client.new_game = info['new_game']
+    client.weird = info['weird']
+    return client
+
+
+def dumps(client, maps=True):
+    return _pack(client_state(client, maps))
+
+
+def loads(data, client):
+    return restore_client(client, _unpack(data))
+
+
+def dump_terminal(terminal):
+    return _pack({'terminal': terminal_state(terminal)})
+
+
+def load_terminal(data, compact=None):
+    terminal = TerminalBuffer.__new__(TerminalBuffer)
+    terminal.clearListener = None
+    return restore_terminal(terminal, _unpack(data)['terminal'], compact)
@@ -1,7 +1,49 @@
+from collections import namedtuple
+import re
+
+from .cached_section import CachedSection, percent, split_menu_line
+from .screens import Screens
+
+# one memorised spell; schools is a tuple like ('Conj',), power the bar
+# as shown, failure a percentage, and extra any columns after the level
+Spell = namedtuple('Spell', ['letter', 'name', 'schools', 'power',
+                             'failure', 'level', 'extra'])
+
+
+class Spells(CachedSection):
+    _screen = Screens.SPELLS
+    _invalidating = re.compile(
+        r"You (?:add the spell|have learned|learn|forget|can no longer)"
+        r"|spell (?:library|memory)|Your memory")
+    # failure rates follow intelligence and skill (which levels with XL)
+    _watchedStats = ('experience_level', 'current_int')
 
-class Spells():
     def __init__(self):
+        super().__init__()
+        self.spells = {}
         return
 
-    def update(self, screenType, screen):
-        pass
+    def __getitem__(self, letter):
+        return self.spells[letter]
+
+    def __iter__(self):
+        return iter(self.spells.values())
+
+    def __len__(self):
+        return len(self.spells)
+
+    def _read(self, terminal):
+        spells = {}
+        if terminal is not None:
+            for line in terminal.get_text().split('\n'):
+                entry = split_menu_line(line)
+                if entry is None or len(entry[1]) < 5:
+                    continue
+                letter, columns = entry
+                name, schools, power, failure, level = columns[:5]
+                if not level.isdigit() or percent(failure) is None:
+                    continue
+                spells[letter] = Spell(
+                    letter, name, tuple(schools.split('/')), power,
+                    percent(failure), int(level), tuple(columns[5:]))
+        self.spells = spells
@@ -0,0 +1,165 @@
+# ssh connections shared by the games played on the same server
+# a RemoteConnection on its own does the whole tcp, key exchange and
+# login handshake for the one shell channel it uses; given a pool, it
+# opens its channel on a transport the pool already has up for that host
+# and account instead, and hands the channel back when it disconnects
+# e.g. pool = TransportPool()
+#      conn = RemoteConnection(name, password, pool=pool)
+import logging
+import threading
+
+from . import backends
+
+log = logging.getLogger(__name__)
+
+
+class _Entry():
+    # one transport, and the channels open on it
+
+    def __init__(self, client):
+        self.client = client
+        self.channels = set()
+
+    def active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def prune(self):
+        # channels the server closed still count until looked at
+        self.channels = {c for c in self.channels if not c.closed}
+
+
+class TransportPool():
+    # transports by (host, port, username, password)
+    # each carries at most maxChannels channels (OpenSSH servers allow
+    # 10 sessions per connection by default), more games open another
+    # transport. keepalive is how often, in seconds, an ssh keepalive is
+    # sent on each, so idle ones aren't dropped by the server or on the
+    # way (0 for none). transports with no channels left are kept open
+    # for the next game until close(), unless closeIdle is set
+
+    def __init__(self, maxChannels=10, keepalive=30, closeIdle=False):
+        self.maxChannels = maxChannels
+        self.keepalive = keepalive
+        self.closeIdle = closeIdle
+        # how many transports were opened, and how many channels
+        self.transportsOpened = 0
+        self.channelsOpened = 0
+        self._entries = {}
+        # _lock guards the bookkeeping, and is never held while talking
+        # to a server; each key has a lock of its own, held while opening
+        # a channel for it, so games on the same server wait for one
+        # handshake instead of each doing their own
+        self._lock = threading.Lock()
+        self._keyLocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open_channel(self, host, port, username, password,
+                     term='vt100', width=80, height=24):
+        # a shell channel on a pooled transport, like
+        # SSHClient.invoke_shell. a transport found dead on the way is
+        # dropped, and the channel opened on a new one
+        key = (host, port, username, password)
+        paramiko = backends.require('ssh')
+        with self._lock:
+            keyLock = self._keyLocks.setdefault(key, threading.Lock())
+        with keyLock:
+            for entry in self._free_entries(key):
+                try:
+                    return self._shell(entry, term, width, height)
+                except paramiko.SSHException:
+                    log.info("couldn't open a channel to %s, reconnecting",
+                             host)
+                    self._drop(key, entry)
+            entry = self._connect(paramiko, host, port, username, password)
+            with self._lock:
+                self._entries.setdefault(key, []).append(entry)
+            return self._shell(entry, term, width, height)
+
+    def release(self, channel):
+        # close a channel from open_channel
+        channel.close()
+        idle = None
+        with self._lock:
+            for entries in self._entries.values():
+                for entry in entries:
+                    if channel in entry.channels:
+                        entry.channels.discard(channel)
+                        if self.closeIdle and not entry.channels:
+                            entries.remove(entry)
+                            idle = entry
+                        break
+        if idle is not None:
+            idle.client.close()
+
+    def close(self):
+        with self._lock:
+            entries = [e for es in self._entries.values() for e in es]
+            self._entries = {}
+        for entry in entries:
+            entry.client.close()
+
+    def stats(self):
+        with self._lock:
+            entries = [e for es in self._entries.values() for e in es]
+            for entry in entries:
+                entry.prune()
+            return {
+                'transports': len(entries),
+                'channels': sum(len(e.channels) for e in entries),
+                'transports_opened': self.transportsOpened,
+                'channels_opened': self.channelsOpened,
+            }
+
+    def _free_entries(self, key):
+        # the live transports for key with room for another channel
+        with self._lock:
+            entries = self._entries.get(key, [])
+            dead = [e for e in entries if not e.active()]
+            for entry in dead:
+                entries.remove(entry)
+            free = []
+            for entry in entries:
+                entry.prune()
+                if len(entry.channels) < self.maxChannels:
+                    free.append(entry)
+        for entry in dead:
+            entry.client.close()
+        return free
+
+    def _connect(self, paramiko, host, port, username, password):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, port=port, username=username,
+                       password=password)
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        with self._lock:
+            self.transportsOpened += 1
+        log.info("TransportPool connected to %s:%s", host, port)
+        return _Entry(client)
+
+    def _shell(self, entry, term, width, height):
+        channel = entry.client.get_transport().open_session()
+        try:
+            channel.get_pty(term, width, height)
+            channel.invoke_shell()
+        except Exception:
+            channel.close()
+            raise
+        with self._lock:
+            entry.channels.add(channel)
+            self.channelsOpened += 1
+        return channel
+
+    def _drop(self, key, entry):
+        with self._lock:
+            entries = self._entries.get(key, [])
+            if entry in entries:
+                entries.remove(entry)
+        entry.client.close()
@@ -0,0 +1,184 @@
+import bisect
+import functools
+import time
+
+
+class LatencyStats():
+    # running summary of a duration in seconds
+    # keeps count/total/min/max, an exponentially weighted moving average
+    # (and mean deviation, like TCP's smoothed RTT and RTTVAR)
+    # and a coarse histogram for percentiles, in constant memory
+    _bounds = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+               0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.ewma = None
+        self.deviation = None
+        # one bucket per bound, plus one for anything above the last
+        self.buckets = [0] * (len(LatencyStats._bounds) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        if self.ewma is None:
+            self.ewma = seconds
+            self.deviation = seconds / 2
+        else:
+            self.deviation += self.alpha * (
+                abs(seconds - self.ewma) - self.deviation)
+            self.ewma += self.alpha * (seconds - self.ewma)
+        self.buckets[bisect.bisect_left(LatencyStats._bounds, seconds)] += 1
+
+    def adaptive_timeout(self, factor, low, high):
+        # smoothed value plus factor times its deviation, kept in [low, high]
+        # (how TCP derives its retransmit timeout from round trip times)
+        # before any samples, be patient and use high
+        if self.ewma is None:
+            return high
+        return max(low, min(high, self.ewma + factor * self.deviation))
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the given fraction of samples
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                if i < len(LatencyStats._bounds):
+                    return min(LatencyStats._bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean(),
+            'min': self.min,
+            'max': self.max,
+            'last': self.last,
+            'ewma': self.ewma,
+            'deviation': self.deviation,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class ClientStats():
+    # where the time of a client's calls (send_command, set_screen and
+    # update) goes, split into phases: waiting on the connection, feeding
+    # the terminal, reading messages, parsing screens, and the client's
+    # own work in between. each phase counts only its own time, not that
+    # of the phases inside it, so the phases of a call add up to the call
+    # one LatencyStats per call and phase, plus counters
+    # hook, if set, is called after each call with its name, its duration
+    # and a dict of the seconds spent in each phase
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.calls = {}
+        self.phases = {}
+        # commands sent and waited on, --more-- prompts answered
+        self.roundTrips = 0
+        self.moreMessages = 0
+        self.bytesReceived = 0
+        # [phase, start, seconds spent in the phases inside it]
+        self._stack = []
+        self._call = None
+        self._current = {}
+
+    def begin(self, phase, call=None):
+        if not self._stack:
+            self._call = call or 'other'
+            self._current = {}
+        self._stack.append([phase, time.perf_counter(), 0.0])
+
+    def end(self):
+        phase, start, inner = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self._current[phase] = \
+            self._current.get(phase, 0.0) + elapsed - inner
+        if self._stack:
+            self._stack[-1][2] += elapsed
+            return
+        call = self._call
+        if call not in self.calls:
+            self.calls[call] = LatencyStats()
+        self.calls[call].add(elapsed)
+        for name, seconds in self._current.items():
+            key = (call, name)
+            if key not in self.phases:
+                self.phases[key] = LatencyStats()
+            self.phases[key].add(seconds)
+        if self.hook is not None:
+            self.hook(call, elapsed, self._current)
+
+    def as_dict(self):
+        calls = {}
+        for call, stats in self.calls.items():
+            calls[call] = {'total': stats.as_dict()}
+        for (call, phase), stats in self.phases.items():
+            calls[call][phase] = stats.as_dict()
+        return {
+            'calls': calls,
+            'round_trips': self.roundTrips,
+            'more_messages': self.moreMessages,
+            'bytes_received': self.bytesReceived,
+        }
+
+
+def timed(phase, call=False):
+    # for the client methods to time, if the client's metrics are on
+    # call marks the ones reported by name (when not inside another)
+    def decorator(method):
+        name = method.__name__ if call else None
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            metrics.begin(phase, name)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.end()
+        return wrapper
+    return decorator
+
+
+def timed_async(phase, call=False):
+    def decorator(method):
+        name = method.__name__ if call else None
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return await method(self, *args, **kwargs)
+            metrics.begin(phase, name)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                metrics.end()
+        return wrapper
+    return decorator
@@ -1,5 +1,7 @@
 from enum import Enum
-from collections import namedtuple
+from collections import namedtuple, deque
+from array import array, typecodes
+import copy
 import re
 import logging
 
@@ -84,11 +86,226 @@ class EscapeSequence():
                 return 1
 
 
+class CharacterGrid():
+    # the original cell storage: a list of rows, each a list of Characters
+    # attributes are the EscapeSequence objects themselves
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = [self._blank_row() for _ in range(height)]
+
+    def _blank_row(self):
+        return [TerminalBuffer.Character("", None) for _ in range(self.width)]
+
+    def intern(self, color):
+        return color
+
+    def copy(self):
+        other = CharacterGrid.__new__(CharacterGrid)
+        other.width = self.width
+        other.height = self.height
+        other.rows = [[TerminalBuffer.Character(c.value, c.color) for c in row]
+                      for row in self.rows]
+        return other
+
+    def cell(self, y, x):
+        return self.rows[y][x]
+
+    def row_text(self, y):
+        return "".join(c.value or " " for c in self.rows[y])
+
+    def colors(self, y, start, end):
+        return [c.color for c in self.rows[y][start:end]]
+
+    def write(self, y, x, text, attr):
+        self.rows[y][x:x + len(text)] = [
+            TerminalBuffer.Character(c, attr) for c in text]
+
+    def erase(self, y, start, end):
+        for cell in self.rows[y][start:end]:
+            cell.reset()
+
+    def scroll(self, top, bot, num):
+        # positive num moves lines up, negative moves them down
+        # lines that get uncovered at the other end are blank
+        rows = self.rows
+        if num > 0:
+            for i in range(top, bot + 1):
+                if i + num <= bot:
+                    rows[i] = rows[i + num]
+                else:
+                    rows[i] = self._blank_row()
+        else:
+            # iterate backwards, otherwise we copy the same lines repeatedly
+            for i in range(bot, top - 1, -1):
+                if i + num >= top:
+                    rows[i] = rows[i + num]
+                else:
+                    rows[i] = self._blank_row()
+
+    def delete(self, y, x, amount):
+        # remove amount cells at x, pulling the rest of the row left
+        row = self.rows[y]
+        for i in range(x, self.width):
+            if i + amount < self.width:
+                row[i] = row[i + amount]
+            else:
+                row[i] = TerminalBuffer.Character("", None)
+
+
+class ArrayGrid():
+    # compact cell storage: per row, one typed array of glyphs
+    # and one of attribute ids. SGR sequences are interned into a small
+    # attribute table, id 0 being a cell that was never written (or erased)
+    # 'u' is deprecated from python 3.13 in favour of 'w'
+    _glyphType = 'w' if 'w' in typecodes else 'u'
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._blankGlyphs = array(ArrayGrid._glyphType, ' ' * width)
+        self._blankAttrs = array('H', [0]) * width
+        self.glyphs = [array(ArrayGrid._glyphType, self._blankGlyphs)
+                       for _ in range(height)]
+        self.attrs = [array('H', self._blankAttrs) for _ in range(height)]
+        self.attributes = [None]
+        self._attributeIds = {}
+
+    def intern(self, color):
+        key = str(color)
+        attr = self._attributeIds.get(key)
+        if attr is None:
+            attr = len(self.attributes)
+            if attr > 0xffff:
+                raise OverflowError("too many distinct attributes")
+            self.attributes.append(color)
+            self._attributeIds[key] = attr
+        return attr
+
+    def copy(self):
+        other = ArrayGrid.__new__(ArrayGrid)
+        other.width = self.width
+        other.height = self.height
+        other._blankGlyphs = self._blankGlyphs
+        other._blankAttrs = self._blankAttrs
+        other.glyphs = [array(ArrayGrid._glyphType, row)
+                        for row in self.glyphs]
+        other.attrs = [array('H', row) for row in self.attrs]
+        other.attributes = list(self.attributes)
+        other._attributeIds = dict(self._attributeIds)
+        return other
+
+    def cell(self, y, x):
+        attr = self.attrs[y][x]
+        if not attr:
+            return TerminalBuffer.Character("", None)
+        return TerminalBuffer.Character(
+            self.glyphs[y][x], self.attributes[attr])
+
+    def row_text(self, y):
+        return self.glyphs[y].tounicode()
+
+    def colors(self, y, start, end):
+        attributes = self.attributes
+        return [attributes[a] for a in self.attrs[y][start:end]]
+
+    def write(self, y, x, text, attr):
+        count = len(text)
+        self.glyphs[y][x:x + count] = array(ArrayGrid._glyphType, text)
+        self.attrs[y][x:x + count] = array('H', [attr]) * count
+
+    def erase(self, y, start, end):
+        self.glyphs[y][start:end] = self._blankGlyphs[start:end]
+        self.attrs[y][start:end] = self._blankAttrs[start:end]
+
+    def scroll(self, top, bot, num):
+        # rotate the row arrays and blank the ones that wrapped around
+        # so scrolling never allocates new rows
+        size = bot + 1 - top
+        num = max(-size, min(size, num))
+        if not num:
+            return
+        for rows, blank in ((self.glyphs, self._blankGlyphs),
+                            (self.attrs, self._blankAttrs)):
+            window = rows[top:bot + 1]
+            window = window[num:] + window[:num]
+            if num > 0:
+                recycled = window[-num:]
+            else:
+                recycled = window[:-num]
+            for row in recycled:
+                row[:] = blank
+            rows[top:bot + 1] = window
+
+    def delete(self, y, x, amount):
+        amount = max(0, min(self.width - x, amount))
+        keep = self.width - amount
+        for row, blank in ((self.glyphs[y], self._blankGlyphs),
+                           (self.attrs[y], self._blankAttrs)):
+            row[x:keep] = row[x + amount:]
+            row[keep:] = blank[keep:]
+
+
+class RowView():
+    # Character based access to one row of a TerminalBuffer, for older
+    # callers of terminal[y][x]. with the compact grid the Characters are
+    # copies, so write through the view instead: like any other write it
+    # updates the versions, the damage log and the cached row text
+
+    def __init__(self, terminal, y):
+        self.terminal = terminal
+        self.grid = terminal.grid
+        self.y = y
+
+    def __len__(self):
+        return self.grid.width
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [self.grid.cell(self.y, i)
+                    for i in range(*x.indices(self.grid.width))]
+        return self.grid.cell(self.y, self._index(x))
+
+    def __iter__(self):
+        for x in range(self.grid.width):
+            yield self.grid.cell(self.y, x)
+
+    def __setitem__(self, x, character):
+        x = self._index(x)
+        if character.value:
+            self.grid.write(self.y, x, character.value,
+                            self.grid.intern(character.color))
+        else:
+            self.grid.erase(self.y, x, x + 1)
+        self.terminal._damage_rect(x, self.y, x + 1, self.y + 1)
+
+    def _index(self, x):
+        if x < 0:
+            x += self.grid.width
+        if not 0 <= x < self.grid.width:
+            raise IndexError("column out of range")
+        return x
+
+
 class TerminalBuffer():
-    _parser = re.compile(r"^\x1b\[\??([\d;]*)(\w)")
+    # the lexer matches these at an index into the input (no '^' anchor)
+    _parser = re.compile(r"\x1b\[\??([\d;]*)(\w)")
     # secondary parser for other sequences that are sufficiently different
     # these commonly don't have data, or don't use nums exclusively for data
-    _unknownParser = re.compile(r"^\x1b[\(\)\=\>\%]?([\w\d])?")
+    # '=' and '>' take no argument, so they can't swallow the next character
+    _unknownParser = re.compile(r"\x1b(?:[\(\)\%][\w\d]?|[\=\>]|[\w\d])?")
+    # a run of characters that are written straight into the buffer
+    # anything else is either an escape sequence or a control character
+    _textRun = re.compile(r"[^\x1b\r\n\b\x0f\x00]+")
+    # how many damaged rectangles are remembered for changed_regions
+    # older changes are still tracked, but only per row
+    _damageLogSize = 512
+    # the start of an escape sequence that was cut off at the end of input
+    # it is held back until the next input() call completes it
+    _partialSequence = re.compile(r"\x1b(\[\??[\d;]*|[\(\)\%])?\Z")
+    # anything longer than this isn't a sequence being streamed in
+    _maxPendingLength = 64
 
     class Position:
         def __init__(self, x, y):
@@ -109,7 +326,8 @@ class TerminalBuffer():
             self.value = ""
             self.color = None
 
-    def __init__(self, width=80, height=24, ignoreUnsupported=True):
+    def __init__(self, width=80, height=24, ignoreUnsupported=True,
+                 compact=False):
         self.width = width
         self.height = height
         self.window_top = 0
@@ -118,87 +336,190 @@ class TerminalBuffer():
         # this dictates whether the terminal errors, or silently ignores it
         self.skip_unsupported = ignoreUnsupported
 
-        # this is 'backwards' from normal
-        # (i.e. to get the char at x,y you do self.terminal[y][x])
-        # the purpose of this is to make pushing full lines up easier
-        self.terminal = [
-            [self.Character("", None) for _ in range(self.width)]
-            for __ in range(self.height)]
+        # compact keeps glyphs and attributes in typed arrays
+        # instead of allocating a Character object per cell
+        if compact:
+            self.grid = ArrayGrid(self.width, self.height)
+        else:
+            self.grid = CharacterGrid(self.width, self.height)
         self.cursor_pos = self.Position(0, 0)
         self.savedCursorPosition = self.Position(-1, -1)
 
         # this represents default coloring,
         # so set it as the current color from the start
         self.cur_color = EscapeSequence([0], "m")
+        self._cur_attr = self.grid.intern(self.cur_color)
+
+        # damage tracking: every change to the cells bumps version,
+        # stamps the rows it touched and logs the rectangle it covered
+        # so callers can ask what changed since a version they saw
+        self.version = 0
+        self.row_versions = [0] * self.height
+        self._damage = deque(maxlen=TerminalBuffer._damageLogSize)
+        # rendered text of each row, None until read after a change
+        self._row_text = [None] * self.height
+
+        # incomplete escape sequence left over from the last input() call
+        self._pending = ''
+        # if set, called with this buffer right before the screen is cleared
+        # i.e. with the last full frame, before the next one is drawn
+        self.clearListener = None
+
+    @property
+    def terminal(self):
+        # this is 'backwards' from normal
+        # (i.e. to get the char at x,y you do self.terminal[y][x])
+        # the purpose of this is to make pushing full lines up easier
+        return [RowView(self, y) for y in range(self.height)]
 
     def __str__(self):
         return self.get_text()
 
-    def parse_sequence(self, string):
-        match = TerminalBuffer._parser.match(string)
+    def snapshot(self):
+        # an independent copy of the screen contents and cursor
+        # for parsing a frame after the live buffer has moved on
+        other = copy.copy(self)
+        other.grid = self.grid.copy()
+        other.cursor_pos = self.Position(self.cursor_pos.x, self.cursor_pos.y)
+        other.savedCursorPosition = self.Position(
+            self.savedCursorPosition.x, self.savedCursorPosition.y)
+        other.row_versions = list(self.row_versions)
+        other._damage = deque(self._damage, maxlen=self._damage.maxlen)
+        other._row_text = list(self._row_text)
+        other.clearListener = None
+        return other
+
+    def parse_sequence(self, string, pos=0):
+        # returns the sequence starting at pos, and the index just past it
+        # pos defaults to the start, so single sequences can still be parsed
+        seq, end = self._parse_sequence_at(string, pos)
+        return seq, string[end:]
+
+    def _parse_sequence_at(self, string, pos):
+        match = TerminalBuffer._parser.match(string, pos)
         if not match:
-            match = TerminalBuffer._unknownParser.match(string)
+            match = TerminalBuffer._unknownParser.match(string, pos)
 
             if not match:
-                raise ParseException("Couldn't parse sequence:" + repr(string))
+                raise ParseException(
+                    "Couldn't parse sequence:" + repr(string[pos:]))
 
             # just make an unknown sequence
             return EscapeSequence(
                 [],
                 SequenceType.UNKNOWN.value,
-                string[match.start():match.end()]
-            ), string[match.end():]
+                match.group(0)
+            ), match.end()
 
         data, char = match.groups()
 
         if not data:
             data = []
         else:
-            data = [int(x) for x in data.split(';')]
+            # an empty parameter (e.g. '\x1b[;5H') counts as 0
+            data = [int(x) if x else 0 for x in data.split(';')]
 
-        result = EscapeSequence(data, char), string[match.end():]
-        return result
+        return EscapeSequence(data, char), match.end()
 
     def get_next_sequence(self, string):
-        while string:
+        # single pass over the input, tracking an index instead of slicing
+        # yields escape sequences, single control characters,
+        # and runs of printable characters as one string each
+        pos = 0
+        length = len(string)
+        textRun = TerminalBuffer._textRun.match
+        while pos < length:
             # if the string is an escape sequence,
             # we need to construct the sequence based on the following chars
-            if string[0] == '\x1b':
-                # parse_sequence handles truncating the string for iteration
-                seq, string = self.parse_sequence(string)
+            if string[pos] == '\x1b':
+                seq, pos = self._parse_sequence_at(string, pos)
                 yield seq
+                continue
 
-            # if the string is a normal string, just yield
+            match = textRun(string, pos)
+            if match:
+                yield match.group(0)
+                pos = match.end()
+            # anything else is a control character, handled one at a time
             else:
-                yield string[0]
-                # slice the string for the next iteration
-                string = string[1:]
+                yield string[pos]
+                pos += 1
 
     def input(self, string):
-        log_dict = {}
+        # input can be fed in arbitrary chunks (e.g. straight from recv)
+        # an escape sequence split across chunks is completed on the next call
+        if self._pending:
+            string = self._pending + string
+            self._pending = ''
+        start = string.rfind('\x1b')
+        if start != -1 and len(string) - start <= \
+                TerminalBuffer._maxPendingLength and \
+                TerminalBuffer._partialSequence.match(string, start):
+            self._pending = string[start:]
+            string = string[:start]
+        self._apply_input(string)
+
+    def flush(self):
+        # parse whatever is held back as-is, e.g. at the end of a stream
+        pending = self._pending
+        self._pending = ''
+        self._apply_input(pending)
+
+    def _apply_input(self, string):
         for val in self.get_next_sequence(string):
             if isinstance(val, EscapeSequence):
-                self.apply_sequence(val, log_dict)
+                self.apply_sequence(val)
+            # handle special case characters
+            elif val == '\r':
+                self.cursor_pos.x = 0
+            elif val == '\b':
+                self.move_cursor(-1, 0, True)
+            elif val == '\n':
+                self.move_cursor(0, 1, True)
+            elif val == '\x0f' or val == '\x00':
+                pass
+            # standard characters
             else:
-                # handle special case characters
-                if val == '\r':
-                    self.cursor_pos.x = 0
-                elif val == '\b':
-                    self.move_cursor(-1, 0, True)
-                elif val == '\n':
-                    self.move_cursor(0, 1, True)
-                elif val == '\x0f' or val == '\x00':
-                    pass
-                # standard characters
-                else:
-                    self.terminal[self.cursor_pos.y][self.cursor_pos.x] \
-                        = self.Character(val, self.cur_color)
-                    self.move_cursor(1, 0, True)
-
-        if len(log_dict):
-            log.warning("Ignored sequence counts: " + str(log_dict))
+                self.write_text(val)
+
+    def write_text(self, text):
+        # write a run of characters starting at the cursor
+        # the run is split at the right edge, so wrapping (and scrolling)
+        # happens exactly as if the characters were written one at a time
+        start = 0
+        length = len(text)
+        while start < length:
+            x = self.cursor_pos.x
+            end = min(length, start + self.width - x)
+            self.grid.write(
+                self.cursor_pos.y, x, text[start:end], self._cur_attr)
+            self._damage_rect(x, self.cursor_pos.y, x + end - start,
+                              self.cursor_pos.y + 1)
+            self.move_cursor(end - start, 0, True)
+            start = end
 
     def get_text(self, x=0, y=0, w=0, h=0, color=False):
+        x, y, w, h = self._clip_region(x, y, w, h)
+        if x == 0 and w == self.width:
+            return "\n".join(self.get_row(i) for i in range(y, y + h))
+        return "\n".join(
+            self.get_row(i)[x:x + w] for i in range(y, y + h))
+
+    def get_row(self, y):
+        # the text of a whole row, cached until the row changes
+        text = self._row_text[y]
+        if text is None:
+            text = self._row_text[y] = self.grid.row_text(y)
+        return text
+
+    def get_colors(self, x=0, y=0, w=0, h=0):
+        # the SGR sequence of each cell in the region, one list per row
+        # None for cells that were never written
+        x, y, w, h = self._clip_region(x, y, w, h)
+        return [self.grid.colors(i, x, x + w) for i in range(y, y + h)]
+
+    def _clip_region(self, x, y, w, h):
+        # a width or height of 0 means 'the rest of the screen'
         if w == 0:
             w = self.width
         if h == 0:
@@ -207,9 +528,7 @@ class TerminalBuffer():
         y = max(0, min(self.height - 1, y))
         w = max(0, min(self.width - x, w))
         h = max(0, min(self.height - y, h))
-
-        return "\n".join("".join(str(self.terminal[i][j]) for j in range(
-            x, x + w)) for i in range(y, y + h))
+        return x, y, w, h
 
     def move_cursor(self, x, y, wrap):
         if wrap:
@@ -220,9 +539,12 @@ class TerminalBuffer():
             while self.cursor_pos.x + x < 0:
                 x += self.width
                 y -= 1
-        if self.cursor_pos.y + y > self.window_bot:
+        # only moving down past the bottom of the scroll window scrolls,
+        # and the cursor then stays on the window's bottom line
+        if y > 0 and self.cursor_pos.y <= self.window_bot and \
+                self.cursor_pos.y + y > self.window_bot:
             self.scroll_up((self.cursor_pos.y + y) - self.window_bot)
-            y = (self.cursor_pos.y + y) - (self.window_bot - 1)
+            y = self.window_bot - self.cursor_pos.y
         # technically, shouldn't need the max/min functions here
         # but they aren't very expensive, and being safe is cool
         self.cursor_pos.x = max(
@@ -234,73 +556,98 @@ class TerminalBuffer():
         # this also needs to reset cursor position
         self.cursor_pos.x = 0
         self.cursor_pos.y = 0
-        for i in range(len(self.terminal)):
-            for k in range(len(self.terminal[i])):
-                self.terminal[i][k].reset()
+        self._erase_rows(0, self.height)
 
     def clear_from_start(self):
-        for i in range(self.cursor_pos.x):
-            for j in range(self.cursor_pos.y):
-                self.terminal[j][i].reset()
+        self._erase_rows(0, self.cursor_pos.y)
+        self.clear_line_before()
 
     def clear_to_end(self):
-        for i in range(self.cursor_pos.x, self.width):
-            for j in range(self.cursor_pos.y, self.height):
-                self.terminal[j][i].reset()
+        self.clear_line_after()
+        self._erase_rows(self.cursor_pos.y + 1, self.height)
 
     def clear_line_before(self):
-        for i in range(self.cursor_pos.x):
-            self.terminal[self.cursor_pos.y][i].reset()
+        self._erase_line(0, self.cursor_pos.x)
 
     def clear_line_after(self):
-        for i in range(self.cursor_pos.x, self.width):
-            self.terminal[self.cursor_pos.y][i].reset()
+        self._erase_line(self.cursor_pos.x, self.width)
 
     def clear_line(self):
-        for i in range(self.width):
-            self.terminal[self.cursor_pos.y][i].reset()
+        self._erase_line(0, self.width)
 
     def scroll_up(self, num):
-        for i in range(self.window_top, self.window_bot + 1):
-            # we are shifting num lines
-            # for any line that's more than num lines from the bottom
-            # just copy from the line num lines down
-            if i + num <= self.window_bot:
-                self.terminal[i] = self.terminal[i + num]
-            # if the line is within num lines of the bottom, reset the line
-            else:
-                self.terminal[i] = \
-                    [self.Character("", None) for _ in range(self.width)]
+        self.grid.scroll(self.window_top, self.window_bot, num)
+        self._damage_rect(0, self.window_top, self.width, self.window_bot + 1)
 
     def scroll_down(self, num):
-        # we need to iterate backwards here
-        # otherwise, we just copy the first num lines over and over again
-        for i in range(self.window_bot, self.window_top + 1, -1):
-            # we are shifting num lines
-            # for any line that's more than num lines from the bottom
-            # just copy from the line num lines down
-            if i - num >= self.window_bot:
-                self.terminal[i] = self.terminal[i - num]
-            # if the line is within num lines of the bottom, reset
-            else:
-                self.terminal[i] = \
-                    [self.Character("", None) for _ in range(self.width)]
+        self.grid.scroll(self.window_top, self.window_bot, -num)
+        self._damage_rect(0, self.window_top, self.width, self.window_bot + 1)
 
     def push_characters_left(self, amount):
         # this is effectively deleting characters
         # and pushing the remaining characters back, due to the removed chars
-        # we can just move the characters, overwriting the old values
-        for i in range(self.cursor_pos.x, self.width):
-            # move characters that aren't being deleted
-            if i + amount < self.width:
-                self.terminal[self.cursor_pos.y][i] = \
-                    self.terminal[self.cursor_pos.y][i + amount]
-            # clear characters if the source would be outside the screen
-            else:
-                self.terminal[self.cursor_pos.y][i] = \
-                    self.Character("", None)
-
-    def apply_sequence(self, sequence, log_dict):
+        self.grid.delete(self.cursor_pos.y, self.cursor_pos.x, amount)
+        self._damage_rect(self.cursor_pos.x, self.cursor_pos.y,
+                          self.width, self.cursor_pos.y + 1)
+
+    def _erase_line(self, start, end):
+        if start < end:
+            self.grid.erase(self.cursor_pos.y, start, end)
+            self._damage_rect(start, self.cursor_pos.y,
+                              end, self.cursor_pos.y + 1)
+
+    def _erase_rows(self, start, end):
+        if start < end:
+            for i in range(start, end):
+                self.grid.erase(i, 0, self.width)
+            self._damage_rect(0, start, self.width, end)
+
+    def _damage_rect(self, x0, y0, x1, y1):
+        # x1 and y1 are exclusive
+        self.version += 1
+        for i in range(y0, y1):
+            self.row_versions[i] = self.version
+            self._row_text[i] = None
+        self._damage.append((self.version, x0, y0, x1, y1))
+
+    def changed_rows(self, since):
+        # rows that were written, erased or scrolled after version since
+        return [i for i, v in enumerate(self.row_versions) if v > since]
+
+    def changed_regions(self, since):
+        # (x, y, w, h) rectangles changed after version since, oldest first
+        # if the damage log no longer reaches back to since,
+        # whole changed rows are returned instead
+        if self.version - len(self._damage) > since:
+            return [(0, i, self.width, 1) for i in self.changed_rows(since)]
+        # walk back from the newest, so a recent since stays cheap
+        regions = []
+        for v, x0, y0, x1, y1 in reversed(self._damage):
+            if v <= since:
+                break
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+        regions.reverse()
+        return regions
+
+    def changed(self, since, x=0, y=0, w=0, h=0):
+        # whether anything inside the region changed after version since
+        # the region is given the same way as for get_text
+        if since >= self.version:
+            return False
+        x, y, w, h = self._clip_region(x, y, w, h)
+        if max(self.row_versions[y:y + h], default=0) <= since:
+            return False
+        # the rows changed, but without the log we can't tell which columns
+        if self.version - len(self._damage) > since:
+            return True
+        for v, x0, y0, x1, y1 in reversed(self._damage):
+            if v <= since:
+                break
+            if x0 < x + w and x < x1 and y0 < y + h and y < y1:
+                return True
+        return False
+
+    def apply_sequence(self, sequence, log_dict=None):
         if sequence.sequenceType == SequenceType.CURSOR_UP:
             self.move_cursor(0, -sequence.get_data(0), False)
         elif sequence.sequenceType == SequenceType.CURSOR_DOWN:
@@ -330,6 +677,8 @@ class TerminalBuffer():
                 0, min(self.height - 1, sequence.get_data(0) - 1))
         elif sequence.sequenceType == SequenceType.ERASE_IN_DISPLAY:
             if sequence.get_data(0) == 2:
+                if self.clearListener:
+                    self.clearListener(self)
                 self.clear_terminal()
             elif sequence.get_data(0) == 1:
                 self.clear_from_start()
@@ -350,6 +699,7 @@ class TerminalBuffer():
             self.scroll_down(sequence.get_data(0))
         elif sequence.sequenceType == SequenceType.SELECT_GRAPHIC_RENDITION:
             self.cur_color = sequence
+            self._cur_attr = self.grid.intern(sequence)
         elif sequence.sequenceType == SequenceType.SAVE_CURSOR_POSITION:
             self.savedCursorPosition.x = self.cursor_pos.x
             self.savedCursorPosition.y = self.cursor_pos.y
@@ -366,15 +716,15 @@ class TerminalBuffer():
                         sequence.get_data(0) - 1 < 0 or\
                         sequence.get_data(1) - 1 > self.height or\
                         sequence.get_data(1) < sequence.get_data(0):
-                    log.warning("ignoring windowSize: " + repr(sequence))
+                    log.warning("ignoring windowSize: %r", sequence)
                 else:
                     self.window_top = sequence.get_data(0) - 1
                     self.window_bot = sequence.get_data(1) - 1
         elif self.skip_unsupported:
-            if str(sequence) in log_dict.keys():
-                log_dict[str(sequence)] += 1
-            else:
-                log_dict[str(sequence)] = 1
+            # log_dict, if given, counts them
+            if log_dict is not None:
+                log_dict[str(sequence)] = log_dict.get(str(sequence), 0) + 1
+            log.debug("ignoring unsupported sequence %s", sequence)
         else:
             raise NotImplementedError(
                 "Unsupported sequence: " + repr(sequence))
@@ -0,0 +1,116 @@
+# opt-in tracing, for finding out what a game did
+# until enable() is called nothing is written anywhere: the package's
+# logger only has a NullHandler, and its debug calls return at once
+# once enabled, log records are put on a queue and formatted and written
+# to the file by a background thread, so the game never waits on the disk
+# while tracing, the package's records go to the trace file only, not on
+# to the application's handlers
+# the raw output read from crawl isn't logged, it goes to a ring buffer of
+# ttyrec records holding the last rawBytes of it, which dump_raw writes
+# out (and a ReplayConnection plays back)
+# setting DCSS_TRACE to a path when importing dcss enables it too
+import atexit
+from collections import deque
+import io
+import logging
+import logging.handlers
+import queue
+
+from .ttyrec import pack_frame
+
+FORMAT = '%(asctime)s|%(name)s|%(levelname)s|%(message)s'
+
+_logger = logging.getLogger('dcss')
+_handler = None
+_listener = None
+_ring = None
+# the logger's propagate from before enable()
+_propagate = True
+
+
+class RawRing():
+    # the most recent output, as packed ttyrec records
+    # whole records are dropped from the front to stay within capacity
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self._records = deque()
+
+    def append(self, data, timestamp=None):
+        record = pack_frame(data, timestamp)
+        self._records.append(record)
+        self.size += len(record)
+        while self.size > self.capacity and len(self._records) > 1:
+            self.size -= len(self._records.popleft())
+
+    def getvalue(self):
+        return b''.join(self._records)
+
+    def clear(self):
+        self._records.clear()
+        self.size = 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler formats the message before queueing it, so that the
+    # record can be pickled; ours stays in this process, so leave the
+    # formatting to the listener's thread
+
+    def prepare(self, record):
+        return record
+
+
+def enable(path='dcss.py.log', level=logging.DEBUG, rawBytes=1 << 20):
+    # start tracing to the log file at path (appended to)
+    # rawBytes is how much raw output to keep, 0 for none
+    global _handler, _listener, _ring, _propagate
+    disable()
+    fileHandler = logging.FileHandler(path, delay=True)
+    fileHandler.setFormatter(logging.Formatter(FORMAT))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, fileHandler)
+    _listener.start()
+    _handler = _QueueHandler(records)
+    _logger.addHandler(_handler)
+    _logger.setLevel(level)
+    _propagate = _logger.propagate
+    _logger.propagate = False
+    _ring = RawRing(rawBytes) if rawBytes else None
+    atexit.register(disable)
+
+
+def disable():
+    # stop tracing, once everything queued so far is written
+    global _handler, _listener, _ring
+    if _handler is None:
+        return
+    _logger.removeHandler(_handler)
+    _logger.setLevel(logging.NOTSET)
+    _logger.propagate = _propagate
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _handler = None
+    _listener = None
+    _ring = None
+    atexit.unregister(disable)
+
+
+def enabled():
+    return _handler is not None
+
+
+def raw(data):
+    # called with every chunk of bytes read from crawl
+    if _ring is not None:
+        _ring.append(data)
+
+
+def dump_raw(path):
+    # write the raw output kept so far to a ttyrec file, if tracing
+    if _ring is None:
+        return False
+    with io.open(path, 'wb') as out:
+        out.write(_ring.getvalue())
+    return True
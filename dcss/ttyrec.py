@@ -0,0 +1,129 @@
+import bz2
+from collections import namedtuple
+import functools
+import gzip
+import io
+import logging
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+# ttyrec: one record per chunk of output, each a header of the time it was
+# read (seconds and microseconds) and the length of the data that follows,
+# all little endian u32s
+_header = struct.Struct('<III')
+
+# one chunk of output, time in seconds since the epoch
+Frame = namedtuple('Frame', ['time', 'data'])
+
+
+class TtyrecWriter():
+    # appends the raw output of a connection to a ttyrec file
+    # the connection also writes an empty record at the end of each
+    # response (players skip them), so a ReplayConnection can hand the
+    # output back one response at a time
+    # path may also be a binary file that's already open; a file that
+    # exists is added to, like ttyrec -a
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        # how many recorded calls are under way, see recorded()
+        self._depth = 0
+
+    def write(self, data, timestamp=None):
+        if self._file is None:
+            if hasattr(self.path, 'write'):
+                self._file = self.path
+            else:
+                self._file = io.open(self.path, 'ab')
+        self._file.write(pack_frame(data, timestamp))
+
+    def end_response(self):
+        self.write(b'')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            if self._file is not self.path:
+                self._file.close()
+            else:
+                self._file.flush()
+            self._file = None
+
+
+def pack_frame(data, timestamp=None):
+    # one ttyrec record, header and data
+    if timestamp is None:
+        timestamp = time.time()
+    seconds = int(timestamp)
+    return _header.pack(seconds, int((timestamp - seconds) * 1000000),
+                        len(data)) + data
+
+
+def recorded(method):
+    # for the connection methods that read a response: once the outermost
+    # of them returns, the response is over
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        recorder = self.recorder
+        if recorder is None:
+            return method(self, *args, **kwargs)
+        recorder._depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            recorder._depth -= 1
+            if not recorder._depth:
+                recorder.end_response()
+    return wrapper
+
+
+def recorded_async(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        recorder = self.recorder
+        if recorder is None:
+            return await method(self, *args, **kwargs)
+        recorder._depth += 1
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            recorder._depth -= 1
+            if not recorder._depth:
+                recorder.end_response()
+    return wrapper
+
+
+def parse_ttyrec(data):
+    # the Frames in the bytes of a ttyrec file
+    # a record cut off at the end (e.g. by a crash while writing) is dropped
+    frames = []
+    pos = 0
+    end = len(data)
+    unpack = _header.unpack_from
+    size = _header.size
+    while pos + size <= end:
+        seconds, micros, length = unpack(data, pos)
+        pos += size
+        if pos + length > end:
+            log.warning("ttyrec ends in the middle of a record")
+            break
+        frames.append(Frame(seconds + micros / 1000000.0,
+                            bytes(data[pos:pos + length])))
+        pos += length
+    return frames
+
+
+def read_ttyrec(path):
+    # archived games are often compressed, '.gz' and '.bz2' are opened
+    # as such
+    if path.endswith('.gz'):
+        recording = gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        recording = bz2.open(path, 'rb')
+    else:
+        recording = io.open(path, 'rb')
+    with recording:
+        return parse_ttyrec(recording.read())
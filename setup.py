@@ -4,7 +4,7 @@ setup(
     name='dcss.py',
     version='0.1dev',
     packages=['dcss'],
-    install_requires=['paramiko', 'pexpect'],
+    install_requires=['numpy', 'paramiko', 'pexpect'],
     url='https://github.com/Rapptz/discord.py',
     description='A python wrapper for Dungeon Crawl Stone Soup (dcss)',
     license='MIT')
@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.messages import MessageLog
+
+_texts = [
+    "You hit the goblin.",
+    "The jackal bites you.",
+    "You hear a distant noise.",
+    "You see here 3 stones.",
+    "There is an open door here.",
+]
+
+
+def _log(count, **kwargs):
+    log = MessageLog(**kwargs)
+    for i in range(count):
+        log.start_action(float(i))
+        log.append(_texts[i % len(_texts)])
+    return log
+
+
+def _scan(messages, pattern):
+    # what search has to find, without the index
+    if isinstance(pattern, str):
+        return [m for m in messages if pattern in m.text]
+    return [m for m in messages if pattern.search(m.text)]
+
+
+def test_index_narrows_candidates():
+    log = _log(100)
+    ids = log._candidates(['goblin'])
+    assert len(ids) == 20
+    assert all('goblin' in log.get(i).text for i in ids)
+    # words only part of one in the message still find it
+    assert log._candidates(['obli']) == ids
+    assert log._candidates(['goblin', 'jackal']) == []
+
+
+def test_search_matches_a_scan():
+    log = _log(100)
+    patterns = ["goblin", "obli", "hit the gob", "!", "",
+                re.compile(r"^The \w+ bites"), re.compile(r"here\.$"),
+                re.compile(r"(?i)YOU HEAR"), re.compile(r"goblin|door"),
+                re.compile(r"st?ones")]
+    for pattern in patterns:
+        assert log.search(pattern) == _scan(log, pattern), pattern
+
+
+def test_search_spilled(tmpdir):
+    path = str(tmpdir.join('messages.log'))
+    # a line from before this log, which the index doesn't know about
+    with open(path, 'w') as f:
+        f.write("7\t3\t\tYou hit the goblin.\n")
+    log = _log(60, capacity=10, spillPath=path)
+    try:
+        every = log.search("", spilled=True)
+        assert len(every) == 61
+        for pattern in ["goblin", "stones", re.compile(r"^You h")]:
+            found = log.search(pattern, spilled=True)
+            assert found == _scan(every, pattern), pattern
+        # the spilled matches are looked up through the index
+        assert len(log._candidates(['goblin'])) == 12
+    finally:
+        log.close()
+
+
+def test_index_is_pruned_without_a_spill_file():
+    log = _log(1000, capacity=50)
+    assert max(len(ids) for ids in log._index.values()) <= 100
+    assert log.search("goblin") == _scan(log, "goblin")
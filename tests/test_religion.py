@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dcss.religion import Religion
+from dcss.screens import Screens
+from dcss.terminal_buffer import TerminalBuffer
+
+
+def _read(*lines):
+    terminal = TerminalBuffer()
+    terminal.input("\x1b[H\x1b[2J" + "\r\n".join(lines))
+    religion = Religion()
+    religion.update(Screens.RELIGION, terminal)
+    return religion
+
+
+def test_one_word_god():
+    religion = _read("Trog the Angry", "Piety: ***...")
+    assert religion.god == 'Trog'
+    assert religion.title == 'the Angry'
+    assert religion.piety == 3
+
+
+def test_multi_word_god():
+    religion = _read("Sif Muna the Loreminder", "Piety: ****..")
+    assert religion.god == 'Sif Muna'
+    assert religion.title == 'the Loreminder'
+    assert religion.piety == 4
+    religion = _read("The Shining One the Honourable")
+    assert religion.god == 'The Shining One'
+    assert religion.title == 'the Honourable'
+
+
+def test_unknown_god():
+    religion = _read("Foo Bar the Unheard of")
+    assert religion.god == 'Foo Bar'
+    assert religion.title == 'the Unheard of'
+    assert _read("Foo").god == 'Foo'
+
+
+def test_not_religious():
+    religion = Religion()
+    religion.update(Screens.RELIGION, None)
+    assert religion.god is None